@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 import argparse
 
-from azlassets import __version__, config, downloadmgr, extractor, importer
+from azlassets import __version__, benchmark, config, downloadmgr, extractor, importer, simulator, versioncontrol
 from azlassets.classes import Client
+from azlassets.integrity import IntegrityLevel
 
 
 def ensure_installed() -> bool:
@@ -24,9 +25,23 @@ def execute_import(args):
 	importer.execute_from_args(args)
 
 
+def execute_simulate(args):
+	simulator.execute_from_args(args)
+
+
+def execute_benchmark(args):
+	benchmark.execute_from_args(args)
+
+
+def execute_convert_hashes(args):
+	versioncontrol.execute_from_args(args)
+
+
 def add_subparser_download(parser):
-	download_parser = parser.add_parser("download", aliases=["d"], help="Download assets for a client")
-	download_parser.add_argument("client", type=str, choices=Client.__members__, help="client to update")
+	download_parser = parser.add_parser("download", aliases=["d"], help="Download assets for one or more clients")
+	download_parser.add_argument(
+		"client", type=str, nargs="+", choices=Client.__members__, help="clients to update at the same time"
+	)
 	download_parser.add_argument(
 		"-e",
 		"--extract",
@@ -52,6 +67,23 @@ def add_subparser_download(parser):
 		action=argparse.BooleanOptionalAction,
 		help="Checks if all files are correct using the local hash file.",
 	)
+	download_parser.add_argument(
+		"--integrity-level",
+		type=str,
+		choices=[level.value for level in IntegrityLevel],
+		help="Level of --check-integrity, overrides the config: fast compares only sizes, sampled hashes a part of the files, full hashes all files.",
+	)
+	download_parser.add_argument(
+		"--time-budget",
+		type=float,
+		help="Minutes after which --check-integrity stops and continues on the next run, overrides the config, 0 for no limit.",
+	)
+	download_parser.add_argument(
+		"--deep",
+		default=False,
+		action=argparse.BooleanOptionalAction,
+		help="Hashes all files with --check-integrity and --repair, also files unchanged since they were last hashed.",
+	)
 	download_parser.add_argument(
 		"--ignore-hashfile",
 		default=False,
@@ -107,10 +139,47 @@ def add_subparser_import(parser):
 	import_parser.set_defaults(func=execute_import)
 
 
+def add_simulator_arguments(parser):
+	parser.add_argument("--files", type=int, default=2000, help="Amount of files in the simulated corpus.")
+	parser.add_argument("--seed", type=int, default=0, help="Seed of the simulated corpus.")
+	parser.add_argument("--latency", type=float, default=0.02, help="Delay in seconds before each response.")
+	parser.add_argument("--bandwidth", type=int, default=0, help="Bytes per second per response, 0 for unlimited.")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="Share of asset requests answered with 500.")
+	parser.add_argument("--missing-rate", type=float, default=0.0, help="Share of files answered with 404.")
+	parser.add_argument("--cdn-port", type=int, default=8080, help="Port of the simulated CDN.")
+	parser.add_argument("--gate-port", type=int, default=8081, help="Port of the simulated gate server.")
+
+
+def add_subparser_simulate(parser):
+	simulate_parser = parser.add_parser("simulate", help="Run a local simulator of the game servers")
+	add_simulator_arguments(simulate_parser)
+	simulate_parser.set_defaults(func=execute_simulate)
+
+
+def add_subparser_benchmark(parser):
+	benchmark_parser = parser.add_parser("benchmark", help="Benchmark downloads from a local simulator of the game servers")
+	benchmark_parser.add_argument(
+		"client", nargs="?", default="EN", type=str, choices=Client.__members__, help="client to download as"
+	)
+	benchmark_parser.add_argument("--runs", type=int, default=3, help="Amount of benchmark runs.")
+	add_simulator_arguments(benchmark_parser)
+	benchmark_parser.set_defaults(func=execute_benchmark)
+
+
+def add_subparser_convert_hashes(parser):
+	convert_parser = parser.add_parser("convert-hashes", help="Convert the local hash files to csv or a binary index")
+	convert_parser.add_argument("client", type=str, nargs="+", choices=Client.__members__, help="clients to convert")
+	convert_parser.add_argument("format", type=str, choices=["csv", "index"], help="format to convert to")
+	convert_parser.set_defaults(func=execute_convert_hashes)
+
+
 def add_subparsers(parser):
 	add_subparser_download(parser)
 	add_subparser_extract(parser)
 	add_subparser_import(parser)
+	add_subparser_simulate(parser)
+	add_subparser_benchmark(parser)
+	add_subparser_convert_hashes(parser)
 
 
 def main():
@@ -0,0 +1,211 @@
+import asyncio
+import contextlib
+import os
+import shutil
+from collections.abc import AsyncGenerator
+from enum import Enum
+from pathlib import Path
+
+try:
+	import fcntl
+except ImportError:  # not available on windows
+	fcntl = None
+
+# ioctl request cloning a file on linux filesystems supporting reflinks (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+class LinkMode(Enum):
+	"""
+	How files with identical content are placed at another path.
+	"""
+
+	HARDLINK = "hardlink"
+	"""Hardlink to the existing file, requires both paths on the same filesystem."""
+	REFLINK = "reflink"
+	"""Copy-on-write clone of the existing file, requires a filesystem supporting reflinks."""
+	COPY = "copy"
+	"""Full copy of the existing file."""
+
+
+def reflink(source: Path, destination: Path):
+	"""
+	Create a copy-on-write clone of a file.
+
+	Args:
+		source: The file to clone
+		destination: Path of the clone
+
+	Raises:
+		OSError: If the platform or filesystem doesn't support reflinks
+	"""
+	if fcntl is None:
+		raise OSError("Reflinks are not supported on this platform.")
+	with source.open("rb") as src, destination.open("wb") as dst:
+		try:
+			fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+		except OSError:
+			dst.close()
+			destination.unlink()
+			raise
+
+
+def place_file(source: Path, destination: Path, link_mode: LinkMode) -> LinkMode:
+	"""
+	Place a file at ``destination`` as a link or copy of ``source``, replacing an existing file.
+	If the link can't be created, the file is copied instead.
+
+	Args:
+		source: The file to place
+		destination: Path to place the file at
+		link_mode: How the file is placed
+
+	Raises:
+		OSError: If the file could neither be linked nor copied
+
+	Returns:
+		LinkMode: The link mode that was used
+	"""
+	destination.parent.mkdir(parents=True, exist_ok=True)
+	# link to a temporary path first, so an existing file is replaced atomically
+	temporary_destination = destination.with_name(f".{destination.name}.link")
+	temporary_destination.unlink(missing_ok=True)
+	try:
+		try:
+			if link_mode == LinkMode.HARDLINK:
+				os.link(source, temporary_destination)
+			elif link_mode == LinkMode.REFLINK:
+				reflink(source, temporary_destination)
+			else:
+				shutil.copyfile(source, temporary_destination)
+		except OSError:
+			if link_mode == LinkMode.COPY:
+				raise
+			link_mode = LinkMode.COPY
+			shutil.copyfile(source, temporary_destination)
+		temporary_destination.replace(destination)
+	finally:
+		temporary_destination.unlink(missing_ok=True)
+	return link_mode
+
+
+class AssetStore:
+	"""
+	Content-addressable store keeping every asset once under its md5 hash.
+
+	Assets are saved at ``{directory}/{md5[:2]}/{md5}`` and placed into the client asset
+	directories according to ``link_mode``. If a link can't be created, the asset is copied instead.
+	The store can be shared by the downloader sessions of multiple clients, concurrent requests
+	for the same asset are serialized by :meth:`lock`.
+	"""
+
+	def __init__(self, directory: Path, link_mode: LinkMode = LinkMode.HARDLINK):
+		"""
+		Args:
+			directory: Root directory of the store
+			link_mode: How stored assets are placed into the client asset directories
+		"""
+		self.directory = directory
+		self.link_mode = link_mode
+		# locks of the assets currently requested, together with the amount of their holders and waiters
+		self._locks: dict[str, tuple[asyncio.Lock, int]] = {}
+		self._fallback_warned = False
+
+	def get_path(self, md5hash: str) -> Path:
+		"""
+		Return the path of an asset inside the store.
+
+		Args:
+			md5hash: The md5 hash of the asset
+
+		Returns:
+			Path: Path of the stored file
+		"""
+		return Path(self.directory, md5hash[:2], md5hash)
+
+	def contains(self, md5hash: str, size: int) -> bool:
+		"""
+		Return whether an asset is in the store. Only verified downloads are saved to the
+		store, so the size is compared to detect truncated files.
+
+		Args:
+			md5hash: The md5 hash of the asset
+			size: Expected size of the asset in bytes
+
+		Returns:
+			bool: True if the asset is stored
+		"""
+		try:
+			return self.get_path(md5hash).stat().st_size == size
+		except FileNotFoundError:
+			return False
+
+	@contextlib.asynccontextmanager
+	async def lock(self, md5hash: str) -> AsyncGenerator[None, None]:
+		"""
+		Hold the lock guarding the download of an asset into the store. The lock is removed
+		once it is neither held nor awaited anymore, so only locks of requested assets are kept.
+
+		Args:
+			md5hash: The md5 hash of the asset
+		"""
+		lock, users = self._locks.get(md5hash, (None, 0))
+		if lock is None:
+			lock = asyncio.Lock()
+		self._locks[md5hash] = (lock, users + 1)
+		try:
+			async with lock:
+				yield
+		finally:
+			lock, users = self._locks[md5hash]
+			if users > 1:
+				self._locks[md5hash] = (lock, users - 1)
+			else:
+				del self._locks[md5hash]
+
+	def add(self, md5hash: str, filepath: Path):
+		"""
+		Place a file into the store as a link or copy according to ``link_mode``, replacing a stored file.
+
+		Args:
+			md5hash: The verified md5 hash of the file
+			filepath: The file to add
+
+		Raises:
+			OSError: If the file could neither be linked nor copied
+		"""
+		place_file(filepath, self.get_path(md5hash), self.link_mode)
+
+	def discard_if_linked(self, md5hash: str, filepath: Path):
+		"""
+		Remove an asset from the store if ``filepath`` is a hardlink to it.
+
+		Used when the content at ``filepath`` doesn't match ``md5hash``: if it shares the
+		stored file, the stored file is corrupt as well and has to be downloaded again.
+
+		Args:
+			md5hash: The expected md5 hash of the file
+			filepath: The file that doesn't match its hash
+		"""
+		stored_path = self.get_path(md5hash)
+		try:
+			if os.path.samefile(stored_path, filepath):
+				stored_path.unlink()
+		except FileNotFoundError:
+			pass
+
+	async def link(self, md5hash: str, destination: Path):
+		"""
+		Place a stored asset at ``destination``, replacing an existing file.
+
+		Args:
+			md5hash: The md5 hash of the asset
+			destination: Path in the client asset directory
+
+		Raises:
+			OSError: If the asset could neither be linked nor copied
+		"""
+		used_link_mode = await asyncio.to_thread(place_file, self.get_path(md5hash), destination, self.link_mode)
+		if used_link_mode != self.link_mode and not self._fallback_warned:
+			print(f"WARN: Assets can't be placed as {self.link_mode.value}, they are copied instead.")
+			self._fallback_warned = True
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from datetime import time as daytime
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+# the active schedule is looked up at most once per interval in seconds
+SCHEDULE_CHECK_INTERVAL = 1.0
+
+
+def parse_time_of_day(value: str | int) -> daytime:
+	"""
+	Parse a time of day in the format ``HH:MM``.
+
+	YAML 1.1 reads unquoted times like ``9:00`` as sexagesimal integers, so integers are
+	accepted as minutes since midnight.
+
+	Args:
+		value: The time of day
+
+	Raises:
+		ValueError: If the value is not a valid time of day
+
+	Returns:
+		datetime.time: The parsed time of day
+	"""
+	if isinstance(value, int):
+		if not 0 <= value < 24 * 60:
+			raise ValueError(f"Invalid time of day '{value}'.")
+		return daytime(value // 60, value % 60)
+	if value in ("24:00", "24:00:00"):
+		return daytime.max
+	return daytime.fromisoformat(value)
+
+
+@dataclass
+class BandwidthSchedule:
+	"""
+	Bandwidth limit active during a time of day, from ``start`` up to ``end``.
+	A schedule ending before it starts continues past midnight, e.g. from 22:00 to 06:00.
+	"""
+
+	start: daytime
+	end: daytime
+	rate: int
+	"""Bytes per second, 0 for unlimited."""
+	days: list[str] = field(default_factory=lambda: list(WEEKDAYS))
+	"""Weekdays the schedule starts on, as abbreviations like ``mon``."""
+
+	def __post_init__(self):
+		self.start = parse_time_of_day(self.start) if not isinstance(self.start, daytime) else self.start
+		self.end = parse_time_of_day(self.end) if not isinstance(self.end, daytime) else self.end
+		self.days = [day.lower()[:3] for day in self.days]
+		for day in self.days:
+			if day not in WEEKDAYS:
+				raise ValueError(f"Invalid weekday '{day}'.")
+
+	def is_active(self, now: datetime) -> bool:
+		"""
+		Return whether the schedule is active at a point in time.
+
+		Args:
+			now: The point in time
+
+		Returns:
+			bool: True if the schedule applies
+		"""
+		current_time = now.time()
+		weekday = WEEKDAYS[now.weekday()]
+		if self.start <= self.end:
+			return weekday in self.days and self.start <= current_time < self.end
+		# past midnight the schedule belongs to the day it started on
+		previous_weekday = WEEKDAYS[(now.weekday() - 1) % 7]
+		return (weekday in self.days and current_time >= self.start) or (
+			previous_weekday in self.days and current_time < self.end
+		)
+
+
+class BandwidthLimiter:
+	"""
+	Asynchronous token bucket limiting the amount of received bytes per second.
+
+	The bucket is refilled with ``rate`` bytes per second up to ``burst`` bytes. Received data is
+	reported with :meth:`consume`, which waits until the bucket has recovered from the taken bytes.
+	The bucket can go into debt, so chunks larger than ``burst`` are possible, and concurrent
+	consumers wait for the debt of each other, which keeps their sum at the rate.
+
+	The rate of the first active ``schedules`` entry replaces the default ``rate`` during its time
+	of day. A rate of 0 disables the limit. Bytes taken from a limiter with a ``parent`` are taken
+	from the parent as well, e.g. a limit of a single client within the limit of all clients.
+	"""
+
+	def __init__(
+		self,
+		rate: int = 0,
+		burst: int = 1_048_576,
+		schedules: list[BandwidthSchedule] | None = None,
+		parent: "BandwidthLimiter | None" = None,
+	):
+		"""
+		Args:
+			rate: Default bytes per second, 0 for unlimited
+			burst: Amount of bytes that can be received at once after an idle period
+			schedules: Rates replacing the default rate during a time of day
+			parent: Limiter the received bytes are also taken from
+		"""
+		self.default_rate = rate
+		self.burst = max(1, burst)
+		self.schedules = schedules or []
+		self.parent = parent
+		self.rate = self._get_scheduled_rate(datetime.now())
+		self._tokens = float(self.burst)
+		self._last_refill = time.monotonic()
+		self._last_schedule_check = self._last_refill
+
+	@property
+	def enabled(self) -> bool:
+		"""Whether any rate limit is configured."""
+		return self.default_rate > 0 or any(schedule.rate > 0 for schedule in self.schedules)
+
+	def _get_scheduled_rate(self, now: datetime) -> int:
+		for schedule in self.schedules:
+			if schedule.is_active(now):
+				return schedule.rate
+		return self.default_rate
+
+	def _update_rate(self, now: float):
+		if now - self._last_schedule_check < SCHEDULE_CHECK_INTERVAL:
+			return
+		self._last_schedule_check = now
+		rate = self._get_scheduled_rate(datetime.now())
+		if rate != self.rate:
+			# debt accumulated under the previous rate doesn't carry over
+			self.rate = rate
+			self._tokens = max(self._tokens, 0.0)
+
+	async def consume(self, nbytes: int):
+		"""
+		Take received bytes from the bucket, waiting until the rate allows them.
+
+		Args:
+			nbytes: Amount of received bytes
+		"""
+		now = time.monotonic()
+		self._update_rate(now)
+		if self.rate <= 0:
+			self._tokens = float(self.burst)
+			self._last_refill = now
+		else:
+			self._tokens = min(float(self.burst), self._tokens + (now - self._last_refill) * self.rate)
+			self._last_refill = now
+			self._tokens -= nbytes
+			if self._tokens < 0:
+				await asyncio.sleep(-self._tokens / self.rate)
+		if self.parent:
+			await self.parent.consume(nbytes)
@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import yaml
+from dataclasses import dataclass
+from importlib.resources import as_file
+from pathlib import Path
+
+from . import config, downloadmgr
+from .classes import Client
+from .simulator import Simulator, SimulatorConfig
+
+
+@dataclass
+class BenchmarkResult:
+	"""
+	Measurements of a single benchmark run.
+	"""
+
+	duration: float
+	files: int
+	failed_files: int
+	received_bytes: int
+	retries: int
+	latencies: list[float]
+
+	@property
+	def files_per_second(self) -> float:
+		return self.files / self.duration if self.duration > 0 else 0.0
+
+	@property
+	def megabytes_per_second(self) -> float:
+		return self.received_bytes / 1_048_576 / self.duration if self.duration > 0 else 0.0
+
+	def get_latency_percentile(self, percentile: float) -> float:
+		"""
+		Return a percentile of the download latencies, the time from sending a request to the completed download.
+
+		Args:
+			percentile: The percentile between 0 and 100
+
+		Returns:
+			float: The latency in seconds, 0 if there were no downloads
+		"""
+		if not self.latencies:
+			return 0.0
+		sorted_latencies = sorted(self.latencies)
+		index = min(len(sorted_latencies) - 1, int(len(sorted_latencies) * percentile / 100))
+		return sorted_latencies[index]
+
+
+def create_benchmark_user_config(simulator: Simulator, client: Client) -> dict:
+	"""
+	Create a user config that downloads ``client`` from the simulator. The settings are taken from
+	the user config in the current working directory, or the template if there is none.
+
+	Args:
+		simulator: The running simulator
+		client: The client downloading from the simulator
+
+	Returns:
+		dict: The yaml user config
+	"""
+	if config.YAML_CONFIG_PATH.exists():
+		with config.YAML_CONFIG_PATH.open("r", encoding="utf8") as f:
+			yamlconfig = yaml.safe_load(f)
+	else:
+		with as_file(config.YAML_TEMPLATE_PATH) as template_path, template_path.open("r", encoding="utf8") as f:
+			yamlconfig = yaml.safe_load(f)
+
+	server = {"gateip": simulator.config.host, "gateport": simulator.config.gate_port, "cdnurl": simulator.cdn_url}
+	clients = yamlconfig.get("clients") or {}
+	client_overrides = (clients.get(client.name) or {}) | {"server": server}
+	return yamlconfig | {
+		"asset-directory": "ClientAssets",
+		"download-folder-listtype": "blacklist",
+		"download-folder-list": [],
+		"asset-store": {"enabled": False},
+		"telemetry": {"enabled": True, "prometheus-directory": None},
+		"clients": clients | {client.name: client_overrides},
+	}
+
+
+async def run_benchmark(simulator: Simulator, client: Client, directory: Path) -> BenchmarkResult | None:
+	"""
+	Download all files of the simulator into an empty directory and measure the download.
+
+	Args:
+		simulator: The running simulator
+		client: The client to download as
+		directory: Working directory of the run, containing the user config
+
+	Returns:
+		BenchmarkResult or None: The measurements of the run, or None if the download failed
+	"""
+	shutil.rmtree(Path(directory, "ClientAssets"), ignore_errors=True)
+	args = argparse.Namespace(
+		clients=[client],
+		extract=False,
+		force_refresh=False,
+		repair=False,
+		check_integrity=False,
+		deep=False,
+		integrity_level=None,
+		time_budget=None,
+		ignore_hashfile=False,
+		skip_unknown_version_error=False,
+	)
+	start_time = time.monotonic()
+	if not await downloadmgr.execute(args):
+		return
+	duration = time.monotonic() - start_time
+
+	telemetry = await asyncio.to_thread(load_telemetry, Path(directory, "ClientAssets", client.name, "telemetry.json"))
+	summary = telemetry["summary"]
+	latencies = [
+		record["ttfb"] + record["transfer_time"]
+		for record in telemetry["files"]
+		if record["error"] is None and record["ttfb"] is not None and record["transfer_time"] is not None
+	]
+	return BenchmarkResult(
+		duration, summary["files"], summary["failed_files"], summary["received_bytes"], summary["retries"], latencies
+	)
+
+
+def load_telemetry(filepath: Path) -> dict:
+	"""
+	Load the download telemetry written by the download manager.
+
+	Args:
+		filepath: Path of the telemetry file
+
+	Returns:
+		dict: The telemetry of the last download
+	"""
+	with filepath.open("r", encoding="utf8") as f:
+		return json.load(f)
+
+
+def print_benchmark_result(run: int, result: BenchmarkResult):
+	print(
+		f"Run {run}: {result.files} files ({result.received_bytes / 1_048_576:.1f} MB) in {result.duration:.2f}s, "
+		f"{result.files_per_second:.1f} files/s, {result.megabytes_per_second:.2f} MB/s, "
+		f"p50 {result.get_latency_percentile(50) * 1000:.0f} ms, p99 {result.get_latency_percentile(99) * 1000:.0f} ms, "
+		f"{result.failed_files} failed, {result.retries} retries"
+	)
+
+
+async def benchmark(simulator_config: SimulatorConfig, client: Client, runs: int) -> list[BenchmarkResult] | None:
+	"""
+	Run the end-to-end download benchmark against a local simulator.
+
+	Every run downloads the complete simulated corpus with the download manager into a
+	temporary directory, using the settings of the user config in the current working directory.
+
+	Args:
+		simulator_config: Settings of the simulator
+		client: The client to download as
+		runs: Amount of runs
+
+	Returns:
+		list[BenchmarkResult] or None: The measurements of all runs, or None if a run failed
+	"""
+	print(f"Generating corpus of {simulator_config.files} files...")
+	simulator = Simulator(simulator_config)
+	results = []
+	working_directory = Path.cwd()
+	async with simulator:
+		with tempfile.TemporaryDirectory(prefix="azlassets-benchmark-") as directory:
+			yamlconfig = create_benchmark_user_config(simulator, client)
+			os.chdir(directory)
+			try:
+				config.YAML_CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
+				with config.YAML_CONFIG_PATH.open("w", encoding="utf8") as f:
+					yaml.safe_dump(yamlconfig, f)
+
+				for run in range(1, runs + 1):
+					result = await run_benchmark(simulator, client, Path(directory))
+					if result is None:
+						print(f"ERROR: Run {run} failed, stopping the benchmark.")
+						return
+					results.append(result)
+					print_benchmark_result(run, result)
+			finally:
+				os.chdir(working_directory)
+	return results
+
+
+def execute_from_args(args):
+	simulator_config = SimulatorConfig(
+		files=args.files,
+		seed=args.seed,
+		latency=args.latency,
+		bandwidth=args.bandwidth,
+		error_rate=args.error_rate,
+		missing_rate=args.missing_rate,
+		cdn_port=args.cdn_port,
+		gate_port=args.gate_port,
+	)
+	if asyncio.run(benchmark(simulator_config, Client[args.client], args.runs)) is None:
+		sys.exit(1)
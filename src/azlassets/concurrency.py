@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import deque
+
+from .retry import CONGESTION_ERRORS, classify_error
+
+# adjustment factors of the AIMD scheme
+INCREASE_STEP = 1
+DECREASE_FACTOR = 0.5
+# throughput of a window may drop by this fraction and still count as an improvement,
+# so measuring noise doesn't prevent the limit from growing
+THROUGHPUT_TOLERANCE = 0.05
+
+
+def is_congestion_error(error: BaseException) -> bool:
+	"""
+	Return whether an error indicates an overloaded connection or server.
+
+	Timeouts, server errors (5xx), rate limiting (429) and broken or reset connections
+	are congestion errors, other HTTP errors like 404 are not.
+
+	Args:
+		error: The error raised during a request
+
+	Returns:
+		bool: True if the concurrency should be reduced
+	"""
+	return classify_error(error) in CONGESTION_ERRORS
+
+
+class AdaptiveLimiter:
+	"""
+	Asynchronous concurrency limiter with an AIMD (additive increase, multiplicative decrease)
+	controlled limit.
+
+	Completed requests are measured in windows of ``limit`` requests. The limit is increased by
+	:data:`INCREASE_STEP` after each window whose throughput did not drop compared to the previous
+	one, and multiplied with :data:`DECREASE_FACTOR` on congestion errors.
+
+	Use as an async context manager around a request and report the outcome using
+	:meth:`record_success` or :meth:`record_failure`.
+	"""
+
+	def __init__(self, initial: int, minimum: int, maximum: int):
+		"""
+		Args:
+			initial: Starting limit
+			minimum: Lowest limit the controller can back off to
+			maximum: Highest limit the controller can grow to
+		"""
+		self.minimum = max(1, minimum)
+		self.maximum = max(self.minimum, maximum)
+		self.limit = float(min(max(initial, self.minimum), self.maximum))
+		self.in_flight = 0
+		self._waiters: deque[asyncio.Future] = deque()
+		self._last_throughput = 0.0
+		self._finished_since_decrease = self.current_limit
+		self._reset_window()
+
+	@property
+	def current_limit(self) -> int:
+		"""The current maximum amount of concurrent requests."""
+		return int(self.limit)
+
+	def _reset_window(self):
+		self._window_start = time.monotonic()
+		self._window_completed = 0
+		self._window_bytes = 0
+
+	def _wake_waiters(self):
+		free_slots = self.current_limit - self.in_flight
+		while free_slots > 0 and self._waiters:
+			waiter = self._waiters.popleft()
+			if not waiter.done():
+				waiter.set_result(None)
+				free_slots -= 1
+
+	async def acquire(self):
+		"""
+		Wait until a request slot is available and take it.
+		"""
+		while self.in_flight >= self.current_limit:
+			waiter = asyncio.get_running_loop().create_future()
+			self._waiters.append(waiter)
+			try:
+				await waiter
+			except asyncio.CancelledError:
+				if waiter.done() and not waiter.cancelled():
+					# pass the slot on to the next waiter
+					self._wake_waiters()
+				raise
+		self.in_flight += 1
+
+	def release(self):
+		"""
+		Give back a request slot taken with :meth:`acquire`.
+		"""
+		self.in_flight -= 1
+		self._wake_waiters()
+
+	async def __aenter__(self) -> "AdaptiveLimiter":
+		await self.acquire()
+		return self
+
+	async def __aexit__(self, *_):
+		self.release()
+
+	def record_success(self, nbytes: int):
+		"""
+		Report a completed request. Increases the limit at the end of a window if the throughput improved.
+
+		Args:
+			nbytes: Amount of bytes transferred by the request
+		"""
+		self._finished_since_decrease += 1
+		self._window_completed += 1
+		self._window_bytes += nbytes
+		if self._window_completed < self.current_limit:
+			return
+
+		elapsed = time.monotonic() - self._window_start
+		throughput = self._window_bytes / elapsed if elapsed > 0 else 0.0
+		if throughput >= self._last_throughput * (1 - THROUGHPUT_TOLERANCE):
+			self.limit = min(self.limit + INCREASE_STEP, self.maximum)
+			self._wake_waiters()
+		self._last_throughput = throughput
+		self._reset_window()
+
+	def record_failure(self, error: BaseException):
+		"""
+		Report a failed request. Congestion errors reduce the limit, but only after as many requests
+		as the limit allows have finished since the last decrease, so a burst of failing requests
+		that were started together only counts once.
+
+		Args:
+			error: The error raised by the request
+		"""
+		self._finished_since_decrease += 1
+		if not is_congestion_error(error) or self._finished_since_decrease < self.current_limit:
+			return
+
+		self.limit = max(self.limit * DECREASE_FACTOR, self.minimum)
+		self._finished_since_decrease = 0
+		self._last_throughput = 0.0
+		self._reset_window()
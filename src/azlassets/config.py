@@ -1,12 +1,18 @@
 import json
 import sys
 import yaml
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from importlib.resources import as_file, files
 from pathlib import Path
 from shutil import copy
 
+from .assetstore import LinkMode
+from .bandwidth import BandwidthSchedule
 from .classes import Client
+from .hasher import HashExecutor
+from .hashindex import HashFileFormat
+from .integrity import IntegrityLevel, SampleMode
+from .scheduler import DownloadOrder
 
 # package-incuded filepaths
 CONFIG_DATA_PATH = files("azlassets").joinpath("config")
@@ -17,6 +23,183 @@ CLIENT_CONFIG_PATH = CONFIG_DATA_PATH.joinpath("client_config.json")
 YAML_CONFIG_PATH = Path("config", "user_config.yml")
 
 
+@dataclass
+class ConcurrencyConfig:
+	"""
+	Limits of the adaptive download concurrency controller.
+
+	The amount of concurrent downloads starts at ``initial`` and is adjusted between
+	``minimum`` and ``maximum``. Files larger than 10 MB are additionally limited by
+	their own controller using the ``large_file_*`` limits.
+	"""
+
+	initial: int = 10
+	minimum: int = 2
+	maximum: int = 40
+	large_file_initial: int = 2
+	large_file_minimum: int = 1
+	large_file_maximum: int = 4
+
+
+@dataclass
+class SegmentConfig:
+	"""
+	Settings of segmented downloads of files larger than 10 MB.
+
+	Files are split into segments of ``size`` bytes, which are fetched over up to
+	``connections`` connections at the same time. A single connection disables segmented downloads.
+	"""
+
+	size: int = 8_388_608
+	connections: int = 4
+
+
+@dataclass
+class WriterConfig:
+	"""
+	Settings of the thread pool writing downloaded files to disk.
+
+	``workers`` threads write files at the same time. Files larger than 128 KB are
+	written in blocks of ``buffer_size`` bytes, and synced to disk with their progress
+	recorded every ``checkpoint_size`` bytes or ``checkpoint_interval`` seconds.
+	"""
+
+	workers: int = 8
+	buffer_size: int = 1_048_576
+	checkpoint_size: int = 16_777_216
+	checkpoint_interval: float = 5.0
+
+
+@dataclass
+class HashingConfig:
+	"""
+	Settings of the worker pool hashing files on disk for integrity checks and repairs.
+
+	``workers`` threads or processes as set in ``executor`` hash files at the same time,
+	0 uses one per CPU core. Files are read in blocks of ``buffer_size`` bytes.
+	"""
+
+	workers: int = 0
+	buffer_size: int = 1_048_576
+	executor: HashExecutor = HashExecutor.THREAD
+
+	def __post_init__(self):
+		self.executor = HashExecutor(self.executor)
+
+
+@dataclass
+class BandwidthConfig:
+	"""
+	Limit of the received bytes per second of all downloads, or of the downloads of a client
+	if set in its ``clients`` section.
+
+	``rate`` applies unless one of the ``schedules`` is active, 0 disables the limit.
+	"""
+
+	rate: int = 0
+	burst: int = 1_048_576
+	schedules: list[BandwidthSchedule] = field(default_factory=list)
+
+	def __post_init__(self):
+		self.schedules = [
+			schedule if isinstance(schedule, BandwidthSchedule) else parse_config_section(schedule, BandwidthSchedule)
+			for schedule in self.schedules or []
+		]
+
+
+@dataclass
+class RetryConfig:
+	"""
+	Settings of the retry policy for failed downloads.
+	"""
+
+	attempts: int = 4
+	base_delay: float = 1.0
+	max_delay: float = 30.0
+	budget: int = 1000
+	requeue_rounds: int = 1
+
+
+@dataclass
+class CircuitBreakerConfig:
+	"""
+	Settings of the circuit breaker that pauses downloads when the error rate spikes.
+
+	Once ``error_threshold`` of the last ``window`` requests failed with a connection error, timeout
+	or 5xx response, downloads wait for ``cooldown`` seconds, then a single probe request decides
+	whether they continue or wait again.
+	"""
+
+	window: int = 50
+	error_threshold: float = 0.8
+	cooldown: float = 60.0
+
+
+@dataclass
+class AssetStoreConfig:
+	"""
+	Settings of the content-addressable asset store shared by all clients.
+
+	If ``directory`` is not set, the store is located at ``AssetStore`` inside the asset directory.
+	"""
+
+	enabled: bool = False
+	directory: str | None = None
+	link_mode: LinkMode = LinkMode.HARDLINK
+
+	def __post_init__(self):
+		self.link_mode = LinkMode(self.link_mode)
+
+
+@dataclass
+class HashCacheConfig:
+	"""
+	Settings of the cache of server hash files in the client directory.
+
+	The latest ``keep`` hash files are kept per version type.
+	"""
+
+	enabled: bool = True
+	keep: int = 2
+
+
+@dataclass
+class IntegrityCheckConfig:
+	"""
+	Settings of ``--check-integrity``.
+
+	The ``level`` selects how files are checked, see :class:`IntegrityLevel`. Sampled checks
+	hash ``sample_percent`` of the files per run, selected as set in ``sample_mode``.
+
+	The progress of a check is saved every ``checkpoint_interval`` seconds, so an interrupted
+	check continues on the next run. With a ``time_budget`` in minutes, a check stops walking
+	files once it is used up and continues on the next run, 0 for no limit.
+	"""
+
+	level: IntegrityLevel = IntegrityLevel.FULL
+	sample_percent: float = 15.0
+	sample_mode: SampleMode = SampleMode.ROTATING
+	checkpoint_interval: float = 60.0
+	time_budget: float = 0.0
+
+	def __post_init__(self):
+		self.level = IntegrityLevel(self.level)
+		self.sample_mode = SampleMode(self.sample_mode)
+
+
+@dataclass
+class TelemetryConfig:
+	"""
+	Settings of the download telemetry export.
+
+	If enabled, the telemetry of each run is written to ``telemetry.json`` in the client directory.
+	If ``prometheus_directory`` is set, a textfile for the node exporter is written there as well.
+	"""
+
+	enabled: bool = False
+	prometheus_directory: str | None = None
+
+
 @dataclass
 class UserConfig:
 	"""
@@ -30,6 +213,24 @@ class UserConfig:
 	extract_filter: list
 	asset_directory: Path
 	extract_directory: Path
+	download_concurrency: ConcurrencyConfig = field(default_factory=ConcurrencyConfig)
+	download_segments: SegmentConfig = field(default_factory=SegmentConfig)
+	download_writer: WriterConfig = field(default_factory=WriterConfig)
+	file_hashing: HashingConfig = field(default_factory=HashingConfig)
+	download_order: DownloadOrder = DownloadOrder.LARGEST_FIRST
+	download_priority_folders: list = field(default_factory=list)
+	download_retry: RetryConfig = field(default_factory=RetryConfig)
+	download_circuit_breaker: CircuitBreakerConfig = field(default_factory=CircuitBreakerConfig)
+	missing_asset_ttl: float = 24.0
+	global_download_concurrency: int = 100
+	download_bandwidth: BandwidthConfig = field(default_factory=BandwidthConfig)
+	asset_store: AssetStoreConfig = field(default_factory=AssetStoreConfig)
+	duplicate_link_mode: LinkMode = LinkMode.COPY
+	telemetry: TelemetryConfig = field(default_factory=TelemetryConfig)
+	hash_cache: HashCacheConfig = field(default_factory=HashCacheConfig)
+	hash_file_format: HashFileFormat = HashFileFormat.CSV
+	integrity_check: IntegrityCheckConfig = field(default_factory=IntegrityCheckConfig)
+	server: dict = field(default_factory=dict)
 
 
 @dataclass
@@ -63,13 +264,56 @@ def create_user_config() -> bool:
 	return False
 
 
-def load_user_config() -> UserConfig:
+def parse_config_section(section: dict | None, datacls: type):
+	"""
+	Create a config dataclass from a yaml section, converting kebab-case keys to field names.
+	Fields missing from the section keep their default values.
+
+	Args:
+		section: The yaml section, may be None if the section is not set
+		datacls: The dataclass to create
+
+	Raises:
+		TypeError: If the section contains an unknown key
+
+	Returns:
+		The created dataclass instance
+	"""
+	return datacls(**{key.replace("-", "_"): value for key, value in (section or {}).items()})
+
+
+def apply_client_overrides(yamlconfig: dict, client: Client) -> dict:
+	"""
+	Merge the settings of the ``clients`` section for ``client`` into the top-level settings.
+	Nested sections are merged key by key, all other values are replaced.
+
+	Args:
+		yamlconfig: The loaded yaml config
+		client: The client whose overrides should be applied
+
+	Returns:
+		dict: The merged yaml config
+	"""
+	overrides = (yamlconfig.get("clients") or {}).get(client.name) or {}
+	merged = dict(yamlconfig)
+	for key, value in overrides.items():
+		if isinstance(value, dict) and isinstance(merged.get(key), dict):
+			merged[key] = merged[key] | value
+		else:
+			merged[key] = value
+	return merged
+
+
+def load_user_config(client: Client | None = None) -> UserConfig:
 	"""
 	Load user configuration from ``config/user_config.yml``.
 
 	Calls :func:`create_user_config` first, so the file is created from the
 	built-in template if it doesn't exist yet.
 
+	Args:
+		client: If set, the client specific settings from the ``clients`` section are applied
+
 	Returns:
 		UserConfig: The loaded user configuration
 	"""
@@ -79,6 +323,9 @@ def load_user_config() -> UserConfig:
 	with YAML_CONFIG_PATH.open("r", encoding="utf8") as file:
 		yamlconfig = yaml.safe_load(file)
 
+	if client is not None:
+		yamlconfig = apply_client_overrides(yamlconfig, client)
+
 	try:
 		userconfig = UserConfig(
 			useragent=yamlconfig["useragent"],
@@ -88,21 +335,41 @@ def load_user_config() -> UserConfig:
 			extract_filter=yamlconfig["extract-folder-list"],
 			asset_directory=yamlconfig["asset-directory"],
 			extract_directory=yamlconfig["extract-directory"],
+			download_concurrency=parse_config_section(yamlconfig.get("download-concurrency"), ConcurrencyConfig),
+			download_segments=parse_config_section(yamlconfig.get("download-segments"), SegmentConfig),
+			download_writer=parse_config_section(yamlconfig.get("download-writer"), WriterConfig),
+			file_hashing=parse_config_section(yamlconfig.get("file-hashing"), HashingConfig),
+			download_order=DownloadOrder(yamlconfig.get("download-order", DownloadOrder.LARGEST_FIRST.value)),
+			download_priority_folders=yamlconfig.get("download-priority-folders") or [],
+			download_retry=parse_config_section(yamlconfig.get("download-retry"), RetryConfig),
+			download_circuit_breaker=parse_config_section(yamlconfig.get("download-circuit-breaker"), CircuitBreakerConfig),
+			missing_asset_ttl=yamlconfig.get("missing-asset-ttl", 24.0),
+			global_download_concurrency=yamlconfig.get("global-download-concurrency", 100),
+			download_bandwidth=parse_config_section(yamlconfig.get("download-bandwidth"), BandwidthConfig),
+			asset_store=parse_config_section(yamlconfig.get("asset-store"), AssetStoreConfig),
+			duplicate_link_mode=LinkMode(yamlconfig.get("duplicate-link-mode", LinkMode.COPY.value)),
+			telemetry=parse_config_section(yamlconfig.get("telemetry"), TelemetryConfig),
+			hash_cache=parse_config_section(yamlconfig.get("hash-cache"), HashCacheConfig),
+			hash_file_format=HashFileFormat(yamlconfig.get("hash-file-format", HashFileFormat.CSV.value)),
+			integrity_check=parse_config_section(yamlconfig.get("integrity-check"), IntegrityCheckConfig),
+			server=yamlconfig.get("server") or {},
 		)
-	except KeyError:
+	except (KeyError, TypeError, ValueError):
 		print("There is an error inside the userconfig file. Delete it or change the wrong values.")
 		sys.exit(1)
 
 	return userconfig
 
 
-def load_client_config(client: Client) -> ClientConfig:
+def load_client_config(client: Client, overrides: dict | None = None) -> ClientConfig:
 	"""
 	Load client configuration for the given client from the built-in
 	``client_config.json``.
 
 	Args:
 		client: The client to load configuration for
+		overrides: Values replacing the built-in configuration, e.g. the ``server`` setting
+			of the user configuration pointing to a local simulator
 
 	Raises:
 		NotImplementedError: If no entry for ``client`` exists in the config file
@@ -116,7 +383,7 @@ def load_client_config(client: Client) -> ClientConfig:
 	if client.name not in configdata:
 		raise NotImplementedError(f"Client {client.name} has not been configured yet.")
 
-	config = configdata[client.name]
+	config = configdata[client.name] | (overrides or {})
 	try:
 		clientconfig = ClientConfig(config["gateip"], config["gateport"], config["cdnurl"])
 	except KeyError:
@@ -1,9 +1,31 @@
 import aiofile
 import aiohttp
+import asyncio
+import contextlib
+import hashlib
 import traceback
+from collections.abc import AsyncGenerator
+from dataclasses import dataclass
 from pathlib import Path
 
-from .versioncontrol import VersionResult
+from .assetstore import AssetStore, LinkMode, place_file
+from .bandwidth import BandwidthLimiter
+from .classes import HashRow
+from .concurrency import AdaptiveLimiter
+from .config import CircuitBreakerConfig, ConcurrencyConfig, HashingConfig, RetryConfig, SegmentConfig, WriterConfig
+from .hashcache import HashFileCache
+from .hasher import FileHasher
+from .negativecache import NegativeCache
+from .retry import AssetIntegrityError, CircuitBreaker, ErrorKind, RetryPolicy, classify_error
+from .scheduler import DownloadOrder, DownloadScheduler
+from .statcache import StatCache
+from .telemetry import DownloadTelemetry, FileRecord
+from .versioncontrol import VersionResult, parse_hash_row
+from .writer import AssetWriter, WriteProgress, get_progress_path, preallocate_partial_file
+
+LARGE_FILE_SIZE = 10_485_760  # 10 MB
+# files up to this size are kept in memory and written at once after their hash is verified
+SMALL_FILE_SIZE = 131_072  # 128 KB
 
 
 def get_chunk_size(file_size: int) -> int:
@@ -25,16 +47,217 @@ def get_chunk_size(file_size: int) -> int:
 	return 1_048_576  # > 4 MB (top ~1% files): -> 1 MB
 
 
+def get_partial_path(save_destination: Path) -> Path:
+	"""
+	Return the path of the ``.part`` sidecar file an asset is downloaded into before
+	it is moved to its final destination.
+
+	Args:
+		save_destination: Final path of the asset
+
+	Returns:
+		Path: Path of the partial download file
+	"""
+	return save_destination.with_name(save_destination.name + ".part")
+
+
+def get_write_progress(partial_destination: Path, expected_file_size: int) -> WriteProgress:
+	"""
+	Return the content that is already downloaded into a partial file.
+
+	Preallocated partial files record their written content in a sidecar, see :class:`WriteProgress`,
+	other partial files are valid up to their size. Partial files that are larger than the expected
+	file size cannot belong to the expected asset and are discarded.
+
+	Args:
+		partial_destination: Path of the partial download file
+		expected_file_size: Expected size of the complete file in bytes
+
+	Returns:
+		WriteProgress: The downloaded byte ranges of the file
+	"""
+	progress_path = get_progress_path(partial_destination)
+	try:
+		partial_size = partial_destination.stat().st_size
+	except FileNotFoundError:
+		progress_path.unlink(missing_ok=True)
+		return WriteProgress(progress_path)
+
+	if partial_size > expected_file_size:
+		partial_destination.unlink()
+		progress_path.unlink(missing_ok=True)
+		return WriteProgress(progress_path)
+
+	progress = WriteProgress.load(progress_path)
+	if progress is None:
+		return WriteProgress(progress_path, [[0, partial_size]] if partial_size > 0 else [])
+	progress.clip(partial_size)
+	return progress
+
+
+def get_resume_offset(partial_destination: Path, expected_file_size: int) -> int:
+	"""
+	Return the byte offset a download can be resumed from, see :func:`get_write_progress`.
+
+	Args:
+		partial_destination: Path of the partial download file
+		expected_file_size: Expected size of the complete file in bytes
+
+	Returns:
+		int: Amount of bytes that are already downloaded, 0 if the download has to start from the beginning
+	"""
+	return get_write_progress(partial_destination, expected_file_size).prefix_size
+
+
+def discard_partial_file(partial_destination: Path):
+	"""
+	Remove a partial download file and its progress sidecar.
+
+	Args:
+		partial_destination: Path of the partial download file
+	"""
+	partial_destination.unlink(missing_ok=True)
+	get_progress_path(partial_destination).unlink(missing_ok=True)
+
+
+async def hash_partial_file(partial_destination: Path, md5, size: int | None = None, chunk_size: int = 1_048_576):
+	"""
+	Feed the already downloaded content of a partial file into a running md5 hash.
+
+	Args:
+		partial_destination: Path of the partial download file
+		md5: The md5 hash object to update
+		size: Amount of bytes from the start of the file to hash, the whole file if None
+		chunk_size: Read chunk size in bytes (default 1 MB)
+	"""
+	remaining = size
+	async with aiofile.async_open(partial_destination, "rb") as f:
+		async for chunk in f.iter_chunked(chunk_size):
+			if remaining is not None:
+				chunk = chunk[:remaining]
+				remaining -= len(chunk)
+			md5.update(chunk)  # pyright: ignore [reportArgumentType]
+			if remaining == 0:
+				break
+
+
+def print_download_error(description: str, error: BaseException, attempts: int):
+	"""
+	Print the error of a failed download to stdout, unexpected errors are printed with their traceback.
+
+	Args:
+		description: Description of the downloaded file
+		error: The error raised by the last attempt
+		attempts: Amount of attempts made
+	"""
+	error_kind = classify_error(error)
+	if error_kind == ErrorKind.OTHER:
+		print(f"ERROR: An unexpected error occured while downloading {description}.")
+		traceback.print_exception(type(error), error, error.__traceback__)
+	else:
+		print(f"ERROR: Downloading {description} failed after {attempts} attempt(s) ({error_kind.value}). {error}")
+
+
+@dataclass
+class DownloadStatistics:
+	"""
+	Accounting of the asset downloads of a downloader session.
+	"""
+
+	downloaded_files: int = 0
+	failed_downloads: int = 0
+	"""Downloads that failed after all attempts, files queued again count once per round."""
+	received_bytes: int = 0
+	retries: int = 0
+	stored_files: int = 0
+	"""Files taken from the asset store instead of downloading them."""
+	coalesced_files: int = 0
+	"""Files placed from another path with the same hash downloaded in the same session."""
+
+
 class AzurlaneAsyncDownloader(aiohttp.ClientSession):
 	"""
 	Async HTTP client for downloading Azur Lane assets and hash files.
 
 	Extends :class:`aiohttp.ClientSession` with a base URL of``{cdn_url}/android/``.
+	Asset downloads are limited by :class:`AdaptiveLimiter` instances configured with ``concurrency``
+	and can be queued on the :class:`DownloadScheduler` of the session. Failed downloads are
+	repeated according to the :class:`RetryPolicy` configured with ``retry`` and rejected while
+	the :class:`CircuitBreaker` is open. Assets recorded in the ``negative_cache`` are skipped. The
+	hashes of placed files are recorded in the ``stat_cache``, see :func:`updater.handle_asset_download`.
+
+	Files larger than :data:`LARGE_FILE_SIZE` are downloaded in segments over multiple connections
+	at the same time as configured with ``segments``. Received files are written to disk by the
+	thread pool of an :class:`AssetWriter` configured with ``writer``. Files on disk are hashed by the
+	worker pool of a :class:`FileHasher` configured with ``hashing``.
+
+	Multiple sessions can share a ``global_limiter``, which caps the amount of concurrent
+	downloads across all of them, and a ``bandwidth_limiter``, which caps their received bytes per second. The ``label`` prefixes the output of sessions running at the
+	same time. Sessions with an ``asset_store`` download assets into the store and link them
+	into the client directory, see :func:`updater.handle_asset_download`.
 	"""
 
-	def __init__(self, cdn_url: str, useragent: str):
+	def __init__(
+		self,
+		cdn_url: str,
+		useragent: str,
+		concurrency: ConcurrencyConfig | None = None,
+		order: DownloadOrder = DownloadOrder.LARGEST_FIRST,
+		priority_folders: list[str] | None = None,
+		retry: RetryConfig | None = None,
+		circuit_breaker: CircuitBreakerConfig | None = None,
+		negative_cache: NegativeCache | None = None,
+		global_limiter: asyncio.Semaphore | None = None,
+		label: str = "",
+		asset_store: AssetStore | None = None,
+		duplicate_link_mode: LinkMode = LinkMode.COPY,
+		segments: SegmentConfig | None = None,
+		bandwidth_limiter: BandwidthLimiter | None = None,
+		writer: WriterConfig | None = None,
+		hash_cache: HashFileCache | None = None,
+		stat_cache: StatCache | None = None,
+		hashing: HashingConfig | None = None,
+	):
+		segments = segments or SegmentConfig()
+		self.segment_size = max(1, segments.size)
+		self.segment_connections = segments.connections
+		self.label = label
+		self.asset_store = asset_store
+		self.duplicate_link_mode = duplicate_link_mode
+		self._asset_downloads: dict[str, asyncio.Future[Path | None]] = {}
+		self.statistics = DownloadStatistics()
+		self.telemetry = DownloadTelemetry()
+		self.global_limiter = global_limiter
+		self.bandwidth_limiter = bandwidth_limiter
+		self.hash_cache = hash_cache
+		self.stat_cache = stat_cache
+		writer = writer or WriterConfig()
+		self.writer = AssetWriter(writer.workers, writer.buffer_size, writer.checkpoint_size, writer.checkpoint_interval)
+		hashing = hashing or HashingConfig()
+		self.hasher = FileHasher(hashing.workers, hashing.buffer_size, hashing.executor)
+		retry = retry or RetryConfig()
+		self.retry_policy = RetryPolicy(retry.attempts, retry.base_delay, retry.max_delay, retry.budget, retry.requeue_rounds)
+		circuit_breaker = circuit_breaker or CircuitBreakerConfig()
+		self.circuit_breaker = CircuitBreaker(circuit_breaker.window, circuit_breaker.error_threshold, circuit_breaker.cooldown)
+		self.negative_cache = negative_cache
+
+		concurrency = concurrency or ConcurrencyConfig()
+		self.limiter = AdaptiveLimiter(concurrency.initial, concurrency.minimum, concurrency.maximum)
+		self.large_file_limiter = AdaptiveLimiter(
+			concurrency.large_file_initial, concurrency.large_file_minimum, concurrency.large_file_maximum
+		)
+		self.scheduler = DownloadScheduler(
+			workers=self.limiter.maximum,
+			large_file_workers=self.large_file_limiter.maximum,
+			large_file_size=LARGE_FILE_SIZE,
+			order=order,
+			priority_folders=priority_folders or [],
+		)
+
 		base_url = f"{cdn_url}/android/"
-		limited_tcp_connector = aiohttp.TCPConnector(limit_per_host=10, enable_cleanup_closed=True)
+		limited_tcp_connector = aiohttp.TCPConnector(
+			limit=self.limiter.maximum, limit_per_host=self.limiter.maximum, enable_cleanup_closed=True
+		)
 		timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=10)
 		super().__init__(base_url=base_url, headers={"user-agent": useragent}, connector=limited_tcp_connector, timeout=timeout)
 
@@ -50,87 +273,426 @@ class AzurlaneAsyncDownloader(aiohttp.ClientSession):
 		"""
 		return await self.get(f"hash/{versionhash}")
 
-	async def get_asset(self, filehash: str) -> aiohttp.ClientResponse:
+	async def get_asset(self, filehash: str, offset: int = 0, end: int | None = None) -> aiohttp.ClientResponse:
 		"""
 		Send a GET request for an asset file at ``resource/{filehash}``.
 
 		Args:
 			filehash: The file hash identifying the asset
+			offset: Byte offset to request the file from using a ``Range`` header
+			end: Byte offset to request the file up to (exclusive), the end of the file if None
 
 		Returns:
 			aiohttp.ClientResponse: The raw response
 		"""
-		return await self.get(f"resource/{filehash}")
+		if end is not None:
+			headers = {"Range": f"bytes={offset}-{end - 1}"}
+		elif offset > 0:
+			headers = {"Range": f"bytes={offset}-"}
+		else:
+			headers = None
+		return await self.get(f"resource/{filehash}", headers=headers)
 
-	async def download_hashes(self, version_result: VersionResult) -> str | None:
+	async def iterate_hashes(self, version_result: VersionResult) -> AsyncGenerator[HashRow, None]:
 		"""
-		Download and return the hash file for a version result.
-		Prints an error and traceback to stdout on any exception.
+		Download the hash file for a version result and yield its rows while it is received.
+
+		Failed requests are repeated according to the retry policy. A repeated request skips
+		the rows that were already yielded, the hash file of a version doesn't change.
+		If the session has a ``hash_cache``, a cached hash file of the version is used instead
+		of requesting it, and a received hash file is added to the cache once it is complete.
 
 		Args:
 			version_result: The version result whose hash file should be fetched
 
+		Raises:
+			Exception: The error of the last attempt, after it was printed to stdout
+
+		Yields:
+			HashRow: The rows of the hash file in the order of the file
+		"""
+		if self.hash_cache:
+			cached_lines = await asyncio.to_thread(self.hash_cache.load, version_result)
+			if cached_lines is not None:
+				for line in cached_lines:
+					yield parse_hash_row(line)
+				return
+
+		with contextlib.ExitStack() as stack:
+			cache_entry = stack.enter_context(self.hash_cache.create_entry(version_result)) if self.hash_cache else None
+			yielded_rows = 0
+			attempt = 0
+			while True:
+				try:
+					async with await self.get_hashes(version_result.rawstring) as response:
+						response: aiohttp.ClientResponse
+						response.raise_for_status()  # raises error on bad HTTP status
+
+						rows = 0
+						async for line in response.content:
+							line = line.decode("utf8").rstrip("\r\n")
+							if not line:
+								continue
+							rows += 1
+							if rows > yielded_rows:
+								yielded_rows = rows
+								hashrow = parse_hash_row(line)
+								if cache_entry:
+									cache_entry.write(line)
+								yield hashrow
+
+					if cache_entry:
+						cache_entry.commit()
+					return
+
+				except Exception as e:
+					if self.retry_policy.should_retry(e, attempt):
+						await self.retry_policy.wait(e, attempt)
+						attempt += 1
+						continue
+					print_download_error(f"'{version_result.version_type.name}' hashfile", e, attempt + 1)
+					raise
+
+	def is_known_missing(self, filehash: str) -> bool:
+		"""
+		Return whether an asset is recorded as missing on the server in the negative cache.
+
+		Args:
+			filehash: The md5 hash identifying the asset
+
 		Returns:
-			str or None: The full hash file text on success, None on failure
+			bool: True if requests for the asset are skipped
 		"""
-		try:
-			async with await self.get_hashes(version_result.rawstring) as response:
-				response: aiohttp.ClientResponse
-				response.raise_for_status()  # raises error on bad HTTP status
+		return self.negative_cache is not None and self.negative_cache.is_missing(filehash)
+
+	def is_segmented(self, file_size: int) -> bool:
+		"""
+		Return whether a file is downloaded in segments over multiple connections.
 
-				hashes = await response.text()
-				return hashes
+		Args:
+			file_size: Size of the file in bytes
+
+		Returns:
+			bool: True if the file is downloaded in segments
+		"""
+		return self.segment_connections > 1 and file_size > max(LARGE_FILE_SIZE, self.segment_size)
 
-		except Exception as e:
-			print(f"ERROR: An unexpected error occured while downloading '{version_result.version_type.name}' hashfile.")
-			traceback.print_exception(type(e), e, e.__traceback__)
-			return
+	def _get_limiters(self, file_size: int) -> list[AdaptiveLimiter]:
+		if self.is_segmented(file_size):
+			# each segment acquires the regular limiter on its own
+			return [self.large_file_limiter]
+		if file_size > LARGE_FILE_SIZE:
+			return [self.large_file_limiter, self.limiter]
+		return [self.limiter]
 
-	async def download_asset(self, filehash: str, save_destination: Path, expected_file_size: int, _retry_count: int = 0) -> bool:
+	async def download_asset(self, filehash: str, save_destination: Path, expected_file_size: int) -> bool:
 		"""
 		Download an asset file and write it to disk.
-		Prints an error and traceback to stdout on any exception.
+		Failed downloads are repeated according to the retry policy, the error of the
+		last attempt is printed to stdout.
+
+		The file is written to a ``.part`` sidecar next to ``save_destination`` and only moved
+		to its final path once complete and its md5 hash matches ``filehash``. An existing
+		partial file is resumed using a ``Range`` request, both on retries and on later runs.
+
+		Assets the server responded to with 404 are recorded in the negative cache and
+		not requested again while the entry is valid.
 
 		Args:
-			filehash: The file hash identifying the asset
+			filehash: The md5 hash identifying the asset, used to verify the received content
 			save_destination: Path where the file will be written
-			expected_file_size: Expected ``Content-Length`` in bytes; mismatch aborts the download
+			expected_file_size: Expected size of the complete file in bytes; mismatch aborts the download
 
 		Returns:
 			bool: True on success, False otherwise
 		"""
+		if self.negative_cache and self.is_known_missing(filehash):
+			self.negative_cache.skipped.add(filehash)
+			return False
+
+		record = self.telemetry.start_file(filehash, expected_file_size)
+		attempt = 0
+		while True:
+			# segmented downloads can be turned off by a previous attempt
+			segmented = self.is_segmented(expected_file_size)
+			limiters = self._get_limiters(expected_file_size)
+			try:
+				await self.circuit_breaker.wait()
+
+				# Large files acquire their own limiter first to prevent them from saturating
+				# the connection pool and starving each other.
+				async with contextlib.AsyncExitStack() as stack:
+					for limiter in limiters:
+						# prevent queueing into connection pool, since wait time in pool counts towards timeout
+						await stack.enter_async_context(limiter)
+					if segmented:
+						record.start_attempt()
+						received_size = await self._download_asset_segmented(
+							filehash, save_destination, expected_file_size, record
+						)
+					else:
+						# the global limit is acquired last, so waiting for a slot of this session doesn't block other sessions
+						if self.global_limiter:
+							await stack.enter_async_context(self.global_limiter)
+						record.start_attempt()
+						received_size = await self._download_asset(filehash, save_destination, expected_file_size, record)
+
+				for limiter in limiters:
+					limiter.record_success(received_size)
+				self.circuit_breaker.record_success()
+				if self.negative_cache:
+					self.negative_cache.remove(filehash)
+				self.statistics.downloaded_files += 1
+				self.statistics.received_bytes += received_size
+				self.telemetry.finish_file(record, received_size)
+				return True
+			except Exception as e:
+				for limiter in limiters:
+					limiter.record_failure(e)
+				self.circuit_breaker.record_failure(e)
+
+				error_kind = classify_error(e)
+				if error_kind == ErrorKind.NOT_FOUND and self.negative_cache:
+					self.negative_cache.add(filehash)
+
+				# the request slot is given back while waiting for the next attempt
+				if self.retry_policy.should_retry(e, attempt):
+					self.statistics.retries += 1
+					await self.retry_policy.wait(e, attempt)
+					attempt += 1
+					continue
+				print_download_error(f"'{filehash}' to '{save_destination}'", e, attempt + 1)
+				self.statistics.failed_downloads += 1
+				self.telemetry.finish_file(record, error=error_kind.value)
+				return False
+
+	async def download_asset_once(self, filehash: str, save_destination: Path, expected_file_size: int) -> bool:
+		"""
+		Download an asset file like :meth:`download_asset`, but only once per session.
+
+		If the same hash is requested for another path while or after it is downloaded, the
+		request waits for that download and places a link or copy of the downloaded file as set by
+		``duplicate_link_mode``. If that download failed, the next request downloads the asset itself.
+
+		Args:
+			filehash: The md5 hash identifying the asset
+			save_destination: Path where the file will be written
+			expected_file_size: Expected size of the complete file in bytes
+
+		Returns:
+			bool: True on success, False otherwise
+		"""
+		while first_download := self._asset_downloads.get(filehash):
+			source = await asyncio.shield(first_download)
+			if source is None:
+				continue
+			if source == save_destination:
+				return True
+			try:
+				await asyncio.to_thread(place_file, source, save_destination, self.duplicate_link_mode)
+				self.statistics.coalesced_files += 1
+				return True
+			except OSError:
+				# the downloaded file was removed since, download the asset again
+				if self._asset_downloads.get(filehash) is first_download:
+					del self._asset_downloads[filehash]
+
+		download = asyncio.get_running_loop().create_future()
+		self._asset_downloads[filehash] = download
+		download_success = False
 		try:
-			async with await self.get_asset(filehash) as response:
+			download_success = await self.download_asset(filehash, save_destination, expected_file_size)
+		finally:
+			download.set_result(save_destination if download_success else None)
+			if not download_success:
+				del self._asset_downloads[filehash]
+		return download_success
+
+	async def _download_asset(
+		self, filehash: str, save_destination: Path, expected_file_size: int, record: FileRecord | None = None
+	) -> int:
+		"""
+		Make a single attempt to download an asset file, see :meth:`download_asset`.
+		The arrival of the response is reported to the telemetry ``record``.
+
+		Files up to :data:`SMALL_FILE_SIZE` are received into memory and written with a single
+		operation once their hash is verified, larger files are streamed into a preallocated partial file.
+
+		Raises:
+			AssetIntegrityError: If the received size or md5 hash is wrong
+
+		Returns:
+			int: Amount of bytes received
+		"""
+		partial_destination = get_partial_path(save_destination)
+
+		# the digest is computed while streaming, so content of resumed downloads has to be hashed first
+		md5 = hashlib.md5()
+		received_size = 0
+		offset = get_resume_offset(partial_destination, expected_file_size)
+		if offset > 0:
+			await hash_partial_file(partial_destination, md5, offset)
+
+		if offset < expected_file_size or expected_file_size == 0:
+			async with await self.get_asset(filehash, offset) as response:
+				if record:
+					record.response_received(response.status)
 				response.raise_for_status()  # raises error on bad HTTP status
 
+				# server ignored the range request and sends the whole file
+				if offset > 0 and response.status != 206:
+					offset = 0
+					md5 = hashlib.md5()
+
 				# reject response if response size doesn't match expected size
 				response_size = response.content_length
-				if expected_file_size != response_size:
-					print(
-						f"ERROR: Received asset '{filehash}' with target '{save_destination}' has wrong size ({response_size}/{expected_file_size})."
-					)
-					return False
+				if expected_file_size - offset != response_size:
+					raise AssetIntegrityError(filehash, f"Received wrong size ({response_size}/{expected_file_size - offset}).")
 
 				save_destination.parent.mkdir(parents=True, exist_ok=True)
-				async with aiofile.async_open(save_destination, "wb") as file:
-					# adjust chunksize based on filesize to reduce over-buffer for small files
-					# and syscalls for large files
-					chunksize = get_chunk_size(expected_file_size)
+				# adjust chunksize based on filesize to reduce over-buffer for small files
+				# and syscalls for large files
+				chunksize = get_chunk_size(expected_file_size)
+				if offset == 0 and expected_file_size <= SMALL_FILE_SIZE:
+					content = bytearray()
+					async for chunk in response.content.iter_chunked(chunksize):
+						md5.update(chunk)
+						content += chunk
+						received_size += len(chunk)
+						if self.bandwidth_limiter:
+							await self.bandwidth_limiter.consume(len(chunk))
+
+					received_hash = md5.hexdigest()
+					if received_hash != filehash:
+						raise AssetIntegrityError(filehash, f"Received content with md5 hash {received_hash}.")
+					await self.writer.write_file(partial_destination, save_destination, bytes(content))
+					return received_size
+
+				async with self.writer.open_partial(partial_destination, expected_file_size, offset) as file:
 					async for chunk in response.content.iter_chunked(chunksize):
+						md5.update(chunk)
 						await file.write(chunk)
+						received_size += len(chunk)
+						if self.bandwidth_limiter:
+							await self.bandwidth_limiter.consume(len(chunk))
 
-			return True
-		except TimeoutError:
-			if _retry_count < 2:
-				return await self.download_asset(filehash, save_destination, expected_file_size, _retry_count + 1)
-			print(
-				f"ERROR: Connection timed out 3 times while downloading '{filehash}' to '{save_destination}'. Aborting file download."
-			)
-			return False
-		except Exception as e:
-			print(f"ERROR: An unexpected error occured while downloading '{filehash}' to '{save_destination}'.")
-			traceback.print_exception(type(e), e, e.__traceback__)
-			return False
+		# reject corrupted content, the partial file can't be resumed and is discarded
+		received_hash = md5.hexdigest()
+		if received_hash != filehash:
+			discard_partial_file(partial_destination)
+			raise AssetIntegrityError(filehash, f"Received content with md5 hash {received_hash}.")
+
+		partial_destination.replace(save_destination)
+		get_progress_path(partial_destination).unlink(missing_ok=True)
+		return received_size
+
+	async def _download_asset_segmented(
+		self, filehash: str, save_destination: Path, expected_file_size: int, record: FileRecord | None = None
+	) -> int:
+		"""
+		Make a single attempt to download a large asset file in segments fetched over multiple
+		connections at the same time, see :meth:`download_asset`. The arrival of the responses is
+		reported to the telemetry ``record``.
+
+		The partial file is preallocated and every segment is written at its offset. Each completed
+		segment is synced and recorded in the :class:`WriteProgress` of the file, so a failed or
+		interrupted attempt, also by a crash, is resumed by fetching only the missing ranges.
+
+		Raises:
+			AssetIntegrityError: If the received size or md5 hash is wrong
+
+		Returns:
+			int: Amount of bytes received
+		"""
+		partial_destination = get_partial_path(save_destination)
+		progress = get_write_progress(partial_destination, expected_file_size)
+		segments = [
+			(start, min(start + self.segment_size, missing_end))
+			for missing_start, missing_end in progress.get_missing_ranges(expected_file_size)
+			for start in range(missing_start, missing_end, self.segment_size)
+		]
+
+		save_destination.parent.mkdir(parents=True, exist_ok=True)
+		await self.writer.run(preallocate_partial_file, partial_destination, expected_file_size, progress)
+		connections = asyncio.Semaphore(self.segment_connections)
+
+		async def fetch_segment(start: int, end: int, file: aiofile.AIOFile):
+			async with connections:
+				async with contextlib.AsyncExitStack() as stack:
+					await stack.enter_async_context(self.limiter)
+					if self.global_limiter:
+						await stack.enter_async_context(self.global_limiter)
+					try:
+						await self._download_segment(filehash, file, start, end, record)
+					except Exception as e:
+						self.limiter.record_failure(e)
+						raise
+				self.limiter.record_success(end - start)
+			await file.fsync()
+			progress.add(start, end)
+			await self.writer.run(progress.save)
+
+		async with aiofile.AIOFile(partial_destination, "r+b") as file:
+			tasks = [asyncio.create_task(fetch_segment(start, end, file)) for start, end in segments]
+			try:
+				await asyncio.gather(*tasks)
+			finally:
+				for task in tasks:
+					task.cancel()
+				await asyncio.gather(*tasks, return_exceptions=True)
+
+		# segments arrive out of order, so the digest is computed from the complete file
+		md5 = hashlib.md5()
+		await hash_partial_file(partial_destination, md5)
+		received_hash = md5.hexdigest()
+		if received_hash != filehash:
+			discard_partial_file(partial_destination)
+			raise AssetIntegrityError(filehash, f"Received content with md5 hash {received_hash}.")
+
+		partial_destination.replace(save_destination)
+		progress.remove()
+		return sum(end - start for start, end in segments)
+
+	async def _download_segment(
+		self, filehash: str, file: aiofile.AIOFile, start: int, end: int, record: FileRecord | None = None
+	):
+		"""
+		Download the byte range from ``start`` to ``end`` (exclusive) of an asset file and
+		write it at the same offset into ``file``.
+
+		Raises:
+			AssetIntegrityError: If the server ignored the range or the received size is wrong
+		"""
+		async with await self.get_asset(filehash, start, end) as response:
+			if record:
+				record.response_received(response.status)
+			response.raise_for_status()  # raises error on bad HTTP status
+
+			if response.status != 206:
+				# the server doesn't support range requests, download files as a whole from now on
+				self.segment_connections = 1
+				raise AssetIntegrityError(filehash, "Server ignored the range request of a segment.")
+
+			response_size = response.content_length
+			if end - start != response_size:
+				raise AssetIntegrityError(filehash, f"Received wrong segment size ({response_size}/{end - start}).")
+
+			position = start
+			async for chunk in response.content.iter_chunked(get_chunk_size(end - start)):
+				await file.write(chunk, offset=position)
+				position += len(chunk)
+				if self.bandwidth_limiter:
+					await self.bandwidth_limiter.consume(len(chunk))
+
+	async def close(self):
+		await self.scheduler.close()
+		if self.negative_cache:
+			self.negative_cache.save()
+		if self.stat_cache:
+			self.stat_cache.save()
+		await super().close()
+		await asyncio.to_thread(self.writer.close)
+		await asyncio.to_thread(self.hasher.close)
 
 	# override return type from superclass
 	async def __aenter__(self) -> "AzurlaneAsyncDownloader":
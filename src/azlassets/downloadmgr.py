@@ -1,9 +1,17 @@
 import asyncio
 import sys
+import time
+import traceback
 from pathlib import Path
 
 from . import config, downloader, extractor, protobuf, repair, updater
-from .classes import Client
+from .assetstore import AssetStore
+from .bandwidth import BandwidthLimiter
+from .classes import Client, UpdateResult
+from .hashcache import HashFileCache
+from .integrity import IntegrityCheckpoint, IntegrityLevel, IntegritySampler, get_scan_id
+from .negativecache import NegativeCache
+from .statcache import StatCache
 from .versioncontrol import UnknownVersionTypeError, VersionController, VersionResult, VersionType, parse_version_string
 
 
@@ -32,30 +40,268 @@ def try_parse_version_string(vstring: str, skip_error: bool = False) -> VersionR
 			raise
 
 
-async def execute(args):
+def create_downloader_session(
+	clientconfig: config.ClientConfig,
+	userconfig: config.UserConfig,
+	versioncontroller: VersionController,
+	global_limiter: asyncio.Semaphore | None = None,
+	label: str = "",
+	asset_store: AssetStore | None = None,
+	bandwidth_limiter: BandwidthLimiter | None = None,
+) -> downloader.AzurlaneAsyncDownloader:
 	"""
-	Main async entry point for the download manager.
+	Create a downloader session for a client configured with the user configuration.
+
+	Args:
+		clientconfig: Configuration of the client to download from
+		userconfig: The user configuration
+		versioncontroller: Version controller of the client, locates the negative cache, hash cache and stat cache
+		global_limiter: Limits the amount of concurrent downloads shared with other sessions
+		label: Prefix of the output of the session
+		asset_store: Asset store shared with other sessions
+		bandwidth_limiter: Limits the received bytes per second shared with other sessions
+
+	Returns:
+		downloader.AzurlaneAsyncDownloader: The downloader session
+	"""
+	negative_cache = NegativeCache.load(versioncontroller.get_negative_cache_path(), userconfig.missing_asset_ttl * 3600)
+	hash_cache = None
+	if userconfig.hash_cache.enabled:
+		hash_cache = HashFileCache(versioncontroller.get_hash_cache_directory(), userconfig.hash_cache.keep)
+	stat_cache = StatCache.load(versioncontroller.get_stat_cache_path())
+	return downloader.AzurlaneAsyncDownloader(
+		clientconfig.cdnurl,
+		useragent=userconfig.useragent,
+		concurrency=userconfig.download_concurrency,
+		segments=userconfig.download_segments,
+		writer=userconfig.download_writer,
+		hashing=userconfig.file_hashing,
+		hash_cache=hash_cache,
+		stat_cache=stat_cache,
+		order=userconfig.download_order,
+		priority_folders=userconfig.download_priority_folders,
+		retry=userconfig.download_retry,
+		circuit_breaker=userconfig.download_circuit_breaker,
+		negative_cache=negative_cache,
+		global_limiter=global_limiter,
+		label=label,
+		asset_store=asset_store,
+		duplicate_link_mode=userconfig.duplicate_link_mode,
+		bandwidth_limiter=bandwidth_limiter,
+	)
+
+
+def create_asset_store(userconfig: config.UserConfig) -> AssetStore | None:
+	"""
+	Create the asset store configured in the user configuration.
+
+	Args:
+		userconfig: The user configuration
+
+	Returns:
+		AssetStore or None: The asset store, or None if it is disabled
+	"""
+	store_config = userconfig.asset_store
+	if not store_config.enabled:
+		return
+	directory = Path(store_config.directory or Path(userconfig.asset_directory, "AssetStore"))
+	return AssetStore(directory, store_config.link_mode)
+
+
+def create_bandwidth_limiter(userconfig: config.UserConfig, parent: BandwidthLimiter | None = None) -> BandwidthLimiter | None:
+	"""
+	Create the bandwidth limiter configured in the user configuration.
+
+	Args:
+		userconfig: The user configuration
+		parent: Limiter shared with other clients, the received bytes are also taken from it
+
+	Returns:
+		BandwidthLimiter or None: The bandwidth limiter, or ``parent`` if no limit is set
+	"""
+	bandwidth_config = userconfig.download_bandwidth
+	bandwidth_limiter = BandwidthLimiter(bandwidth_config.rate, bandwidth_config.burst, bandwidth_config.schedules, parent)
+	if bandwidth_limiter.enabled:
+		return bandwidth_limiter
+	return parent
+
+
+def create_client_bandwidth_limiter(
+	userconfig: config.UserConfig, client: Client, shared_limiter: BandwidthLimiter | None
+) -> BandwidthLimiter | None:
+	"""
+	Create the bandwidth limiter of a client. A client overriding ``download-bandwidth`` in the
+	``clients`` section gets a limiter of its own, which is also bound by the limiter shared by all clients.
+
+	Args:
+		userconfig: The user configuration without client overrides
+		client: The client
+		shared_limiter: Limiter shared by all clients, see :func:`create_bandwidth_limiter`
+
+	Returns:
+		BandwidthLimiter or None: The bandwidth limiter of the client
+	"""
+	client_userconfig = config.load_user_config(client)
+	if client_userconfig.download_bandwidth == userconfig.download_bandwidth:
+		return shared_limiter
+	return create_bandwidth_limiter(client_userconfig, shared_limiter)
+
+
+def print_skipped_assets(downloader_session: downloader.AzurlaneAsyncDownloader):
+	"""
+	Print the amount of assets that were skipped because they are known to be missing on the server.
+
+	Args:
+		downloader_session: The downloader session after all downloads completed
+	"""
+	negative_cache = downloader_session.negative_cache
+	if negative_cache and negative_cache.skipped:
+		print_prefix = f"{downloader_session.label}: " if downloader_session.label else ""
+		print(
+			f"{print_prefix}Skipped {len(negative_cache.skipped)} assets the server did not provide within the last {negative_cache.ttl / 3600:g} hours."
+		)
+
+
+def print_download_statistics(downloader_session: downloader.AzurlaneAsyncDownloader, elapsed: float):
+	"""
+	Print the amount of downloaded files and bytes of a session.
+
+	Args:
+		downloader_session: The downloader session after all downloads completed
+		elapsed: Time in seconds the update took
+	"""
+	statistics = downloader_session.statistics
+	print_prefix = f"{downloader_session.label}: " if downloader_session.label else ""
+	print(
+		f"{print_prefix}Downloaded {statistics.downloaded_files} files ({statistics.received_bytes / 1_048_576:.1f} MB) "
+		f"in {elapsed:.1f}s, {statistics.failed_downloads} failed downloads, {statistics.retries} retries."
+	)
+	if statistics.coalesced_files:
+		print(f"{print_prefix}Placed {statistics.coalesced_files} files from other paths with the same hash.")
+	if statistics.stored_files:
+		print(f"{print_prefix}Placed {statistics.stored_files} files from the asset store without downloading them.")
+
+
+def write_telemetry(
+	downloader_session: downloader.AzurlaneAsyncDownloader,
+	userconfig: config.UserConfig,
+	versioncontroller: VersionController,
+	client: Client,
+):
+	"""
+	Export the download telemetry of a session, if enabled in the user configuration.
+
+	Args:
+		downloader_session: The downloader session after all downloads completed
+		userconfig: The user configuration
+		versioncontroller: Version controller of the client, locates the telemetry file
+		client: The client of the session
+	"""
+	telemetry_config = userconfig.telemetry
+	if not telemetry_config.enabled:
+		return
+	downloader_session.telemetry.write_json(versioncontroller.get_telemetry_path())
+	if telemetry_config.prometheus_directory:
+		prometheus_path = Path(telemetry_config.prometheus_directory, f"azlassets_{client.name}.prom")
+		downloader_session.telemetry.write_prometheus(prometheus_path, {"client": client.name})
+
+
+async def update_version_type(
+	args,
+	vresult: VersionResult,
+	downloader_session: downloader.AzurlaneAsyncDownloader,
+	userconfig: config.UserConfig,
+	versioncontroller: VersionController,
+) -> list[UpdateResult] | None:
+	"""
+	Update or repair a single version type and save its difflog.
+
+	Args:
+		args: The parsed command line arguments
+		vresult: The version to update to
+		downloader_session: Active downloader session
+		userconfig: The user configuration
+		versioncontroller: The version controller
+
+	Returns:
+		list[UpdateResult] or None: List of update results, or None if nothing was updated
+	"""
+	if args.repair:
+		update_results = await repair.repair_hashfile(vresult, downloader_session, userconfig, versioncontroller, args.deep)
+	else:
+		update_results = await updater.update(
+			vresult, downloader_session, userconfig, versioncontroller, args.force_refresh, args.ignore_hashfile
+		)
+
+	if update_results:
+		versioncontroller.update_difflog(vresult, update_results, is_latest=True)
+	return update_results
+
+
+async def execute_client(
+	args,
+	client: Client,
+	global_limiter: asyncio.Semaphore | None = None,
+	label: str = "",
+	asset_store: AssetStore | None = None,
+	bandwidth_limiter: BandwidthLimiter | None = None,
+) -> downloader.DownloadStatistics | None:
+	"""
+	Update, repair or check the assets of a single client.
+
+	Args:
+		args: The parsed command line arguments
+		client: The client to update
+		global_limiter: Limits the amount of concurrent downloads shared with other clients
+		label: Prefix of the output, distinguishes clients updated at the same time
+		asset_store: Asset store shared with other clients
+		bandwidth_limiter: Limits the received bytes per second of the client, see :func:`create_client_bandwidth_limiter`
+
+	Returns:
+		downloader.DownloadStatistics or None: Statistics of the downloads, or None if the server
+			did not respond to the version request
 	"""
+	print_prefix = f"{label}: " if label else ""
+	start_time = time.monotonic()
+
 	# load config data from files
-	userconfig = config.load_user_config()
-	clientconfig = config.load_client_config(args.client)
+	userconfig = config.load_user_config(client)
+	clientconfig = config.load_client_config(client, userconfig.server)
 
-	CLIENT_ASSET_DIR = Path(userconfig.asset_directory, args.client.name)
+	CLIENT_ASSET_DIR = Path(userconfig.asset_directory, client.name)
 	CLIENT_ASSET_DIR.mkdir(parents=True, exist_ok=True)
-	versioncontroller = VersionController(CLIENT_ASSET_DIR)
+	versioncontroller = VersionController(CLIENT_ASSET_DIR, userconfig.hash_file_format)
 
 	if args.check_integrity:
-		async with downloader.AzurlaneAsyncDownloader(clientconfig.cdnurl, useragent=userconfig.useragent) as downloader_session:
-			update_assets = await repair.repair(downloader_session, versioncontroller)
-			return
+		async with create_downloader_session(
+			clientconfig, userconfig, versioncontroller, global_limiter, label, asset_store, bandwidth_limiter
+		) as downloader_session:
+			level = IntegrityLevel(args.integrity_level) if args.integrity_level else userconfig.integrity_check.level
+			sampler = IntegritySampler.load(
+				versioncontroller.get_integrity_sampler_path(),
+				userconfig.integrity_check.sample_percent,
+				userconfig.integrity_check.sample_mode,
+			)
+			checkpoint = IntegrityCheckpoint.load(
+				versioncontroller.get_integrity_checkpoint_path(),
+				get_scan_id(level, args.deep, sampler),
+				userconfig.integrity_check.checkpoint_interval,
+			)
+			time_budget = args.time_budget if args.time_budget is not None else userconfig.integrity_check.time_budget
+			await repair.repair(downloader_session, versioncontroller, args.deep, level, sampler, checkpoint, time_budget * 60)
+			print_skipped_assets(downloader_session)
+		print_download_statistics(downloader_session, time.monotonic() - start_time)
+		write_telemetry(downloader_session, userconfig, versioncontroller, client)
+		return downloader_session.statistics
 
 	if args.force_refresh and not args.repair:
-		print("All asset types will be checked for different hashes.")
+		print(f"{print_prefix}All asset types will be checked for different hashes.")
 
-	version_response = protobuf.get_version_response(clientconfig.gateip, clientconfig.gateport)
+	# the gate connection is blocking, run it in a thread so the handshakes of all clients overlap
+	version_response = await asyncio.to_thread(protobuf.get_version_response, clientconfig.gateip, clientconfig.gateport)
 	if not version_response:
-		print("Server did not return a response to version request.")
-		sys.exit(1)
+		print(f"{print_prefix}Server did not return a response to version request.")
+		return
 
 	# parse version response
 	version_response_string: list[str] = version_response.pb.version
@@ -70,27 +316,89 @@ async def execute(args):
 	except FileNotFoundError:
 		azl_latest_version_with_difflog = None
 
-	async with downloader.AzurlaneAsyncDownloader(clientconfig.cdnurl, useragent=userconfig.useragent) as downloader_session:
-		for vresult in parsed_version_response.values():
-			if args.repair:
-				update_assets = await repair.repair_hashfile(vresult, downloader_session, userconfig, versioncontroller)
-			else:
-				update_assets = await updater.update(
-					vresult, downloader_session, userconfig, versioncontroller, args.force_refresh, args.ignore_hashfile
+	async with create_downloader_session(
+		clientconfig, userconfig, versioncontroller, global_limiter, label, asset_store, bandwidth_limiter
+	) as downloader_session:
+		# all version types are updated at the same time, their downloads share the scheduler of the session
+		async with asyncio.TaskGroup() as taskgroup:
+			update_tasks = {
+				vresult: taskgroup.create_task(
+					update_version_type(args, vresult, downloader_session, userconfig, versioncontroller)
 				)
+				for vresult in parsed_version_response.values()
+			}
 
-			if update_assets:
-				versioncontroller.update_difflog(vresult, update_assets, is_latest=True)
-
+		# link versions in the order of the version response, as if they were updated one after another
+		for vresult, update_task in update_tasks.items():
+			if update_task.result():
 				if vresult.version_type == VersionType.AZL:
 					azl_latest_version_with_difflog = vresult
 				elif azl_latest_version_with_difflog is not None:
 					versioncontroller.set_as_linked(vresult, azl_latest_version_with_difflog)
 
+		print_skipped_assets(downloader_session)
+
+	print_download_statistics(downloader_session, time.monotonic() - start_time)
+	write_telemetry(downloader_session, userconfig, versioncontroller, client)
+	return downloader_session.statistics
+
+
+async def execute(args) -> bool:
+	"""
+	Main async entry point for the download manager.
+
+	All clients are updated at the same time in the same event loop. Their downloads share the
+	global concurrency and bandwidth limits of the user configuration, a bandwidth limit set for
+	a single client in the ``clients`` section applies to its downloads in addition.
+
+	Returns:
+		bool: True if all clients were updated, False if any client failed
+	"""
+	userconfig = config.load_user_config()
+	global_limiter = asyncio.Semaphore(userconfig.global_download_concurrency)
+	asset_store = create_asset_store(userconfig)
+	bandwidth_limiter = create_bandwidth_limiter(userconfig)
+	start_time = time.monotonic()
+
+	clients: list[Client] = args.clients
+	multiple_clients = len(clients) > 1
+	results = await asyncio.gather(
+		*(
+			execute_client(
+				args,
+				client,
+				global_limiter,
+				client.name if multiple_clients else "",
+				asset_store,
+				create_client_bandwidth_limiter(userconfig, client, bandwidth_limiter),
+			)
+			for client in clients
+		),
+		return_exceptions=True,
+	)
+
+	updated_clients = []
+	for client, result in zip(clients, results):
+		if isinstance(result, BaseException):
+			if not isinstance(result, Exception):
+				raise result
+			print(f"ERROR: Updating client {client.name} failed.")
+			traceback.print_exception(type(result), result, result.__traceback__)
+		elif result is not None:
+			updated_clients.append(client)
+
+	if multiple_clients:
+		print(f"Updated {len(updated_clients)} of {len(clients)} clients in {time.monotonic() - start_time:.1f}s.")
+
 	if args.extract:
-		extractor.extract_latest_client(args.client, with_linked_versions=True)
+		for client in updated_clients:
+			extractor.extract_latest_client(client, with_linked_versions=True)
+
+	return len(updated_clients) == len(clients)
 
 
 def execute_from_args(args):
-	args.client = Client[args.client]
-	asyncio.run(execute(args))
+	# a client given more than once is only updated once
+	args.clients = [Client[client] for client in dict.fromkeys(args.client)]
+	if not asyncio.run(execute(args)):
+		sys.exit(1)
@@ -7,6 +7,7 @@ from pathlib import Path
 from . import imgrecon
 from .classes import BundlePath, Client, CompareType
 from .config import UserConfig, load_user_config
+from .pathfilter import PathFilter
 from .versioncontrol import DiffLog, SimpleVersionResult, VersionController, VersionType
 
 
@@ -163,7 +164,7 @@ class ClientExtractor:
 		self.client_asset_directory = Path(userconfig.asset_directory, client.name)
 		self.client_extract_directory = Path(userconfig.extract_directory, client.name)
 		if not vcontroller:
-			vcontroller = VersionController(self.client_asset_directory)
+			vcontroller = VersionController(self.client_asset_directory, userconfig.hash_file_format)
 		self.vcontroller = vcontroller
 
 	def get_difflog_success_files(self, difflog: DiffLog) -> list[BundlePath]:
@@ -222,17 +223,10 @@ class ClientExtractor:
 		for svr, success_files in file_collection.items():
 			print(f"* {svr}: {len(success_files)}")
 
-		extract_filter_dirs = self.userconfig.extract_filter
-		is_blacklist = self.userconfig.extract_isblacklist
-
-		def _filter(bpath: BundlePath) -> bool:
-			if bpath.inner.split("/")[0] in extract_filter_dirs:
-				return not is_blacklist
-			return is_blacklist
-
+		path_filter = PathFilter(self.userconfig.extract_filter, self.userconfig.extract_isblacklist)
 		filtered_file_collection = {}
 		for svr, success_files in file_collection.items():
-			if filtered_files := list(filter(_filter, success_files)):
+			if filtered_files := [bpath for bpath in success_files if path_filter.is_included(bpath.inner)]:
 				filtered_file_collection[svr] = filtered_files
 
 		print("Amount of files to be extracted after applying userconfig filter:")
@@ -0,0 +1,169 @@
+import hashlib
+import os
+from pathlib import Path
+
+from .versioncontrol import VersionResult
+
+
+class HashFileCacheEntry:
+	"""
+	A server hash file being written into the :class:`HashFileCache` while it is received.
+
+	Lines are written to a temporary file, which only becomes a cache entry on :meth:`commit`.
+	Use as a context manager, an entry that wasn't committed is discarded on exit.
+	"""
+
+	def __init__(self, cache: "HashFileCache", version_result: VersionResult):
+		"""
+		Args:
+			cache: The cache the entry belongs to
+			version_result: Version of the hash file
+		"""
+		self.cache = cache
+		self.version_result = version_result
+		self.filepath = cache.get_path(version_result)
+		self.temporary_filepath = self.filepath.with_name(self.filepath.name + ".tmp")
+		self._md5 = hashlib.md5()
+		self._file = None
+
+	def __enter__(self) -> "HashFileCacheEntry":
+		self.filepath.parent.mkdir(parents=True, exist_ok=True)
+		self._file = self.temporary_filepath.open("wb")
+		return self
+
+	def __exit__(self, *_):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+			self.temporary_filepath.unlink(missing_ok=True)
+
+	def write(self, line: str):
+		"""
+		Add a line of the hash file.
+
+		Args:
+			line: The line without line break
+		"""
+		assert self._file is not None
+		data = line.encode("utf8") + b"\n"
+		self._md5.update(data)
+		self._file.write(data)
+
+	def commit(self):
+		"""
+		Complete the entry after the whole hash file was written.
+		"""
+		assert self._file is not None
+		self._file.close()
+		self._file = None
+		self.cache.get_checksum_path(self.version_result).write_text(self._md5.hexdigest(), encoding="utf8")
+		self.temporary_filepath.replace(self.filepath)
+		self.cache.prune(self.version_result)
+
+
+class HashFileCache:
+	"""
+	Cache of the hash files received from the game server, keyed by their version hash.
+
+	The hash file of a version hash never changes, so a cached file can replace the request
+	for it. Each entry is saved as ``{hashname}-{vhash}.csv`` together with the md5 hash of its
+	content, entries that don't match it are discarded. The latest ``keep`` entries are kept
+	per version type.
+	"""
+
+	def __init__(self, directory: Path, keep: int = 2):
+		"""
+		Args:
+			directory: Directory of the cached files
+			keep: Amount of hash files kept per version type
+		"""
+		self.directory = directory
+		self.keep = max(1, keep)
+
+	def get_path(self, version_result: VersionResult) -> Path:
+		"""
+		Return the path of the cached hash file of a version.
+
+		Args:
+			version_result: The version
+
+		Returns:
+			Path: Path of the cached hash file
+		"""
+		return Path(self.directory, f"{version_result.version_type.hashname}-{version_result.vhash}.csv")
+
+	def get_checksum_path(self, version_result: VersionResult) -> Path:
+		"""
+		Return the path of the file containing the md5 hash of a cached hash file.
+
+		Args:
+			version_result: The version
+
+		Returns:
+			Path: Path of the checksum file
+		"""
+		return self.get_path(version_result).with_suffix(".md5")
+
+	def load(self, version_result: VersionResult) -> list[str] | None:
+		"""
+		Load the lines of a cached hash file. A file that doesn't match its checksum is removed.
+
+		Args:
+			version_result: The version
+
+		Returns:
+			list[str] or None: The non-blank lines of the hash file, or None if it isn't cached
+		"""
+		filepath = self.get_path(version_result)
+		checksum_path = self.get_checksum_path(version_result)
+		try:
+			data = filepath.read_bytes()
+			checksum = checksum_path.read_text(encoding="utf8").strip()
+		except FileNotFoundError:
+			return
+
+		if hashlib.md5(data).hexdigest() != checksum:
+			print(f"WARN: Cached hashfile '{filepath.name}' is corrupt and will be downloaded again.")
+			self.remove(version_result)
+			return
+		# mark the entry as recently used, so it isn't pruned
+		os.utime(filepath)
+		return [line for line in data.decode("utf8").splitlines() if line]
+
+	def create_entry(self, version_result: VersionResult) -> HashFileCacheEntry:
+		"""
+		Create the entry of a hash file that is received, see :class:`HashFileCacheEntry`.
+
+		Args:
+			version_result: Version of the hash file
+
+		Returns:
+			HashFileCacheEntry: The entry, to be used as a context manager
+		"""
+		return HashFileCacheEntry(self, version_result)
+
+	def remove(self, version_result: VersionResult):
+		"""
+		Remove a hash file from the cache.
+
+		Args:
+			version_result: The version
+		"""
+		self.get_path(version_result).unlink(missing_ok=True)
+		self.get_checksum_path(version_result).unlink(missing_ok=True)
+
+	def prune(self, version_result: VersionResult):
+		"""
+		Remove all but the latest ``keep`` hash files of the version type of a version.
+
+		Args:
+			version_result: The version whose version type is pruned
+		"""
+		cached_files = sorted(
+			self.directory.glob(f"{version_result.version_type.hashname}-*.csv"),
+			key=lambda filepath: filepath.stat().st_mtime,
+			reverse=True,
+		)
+		for filepath in cached_files[self.keep :]:
+			filepath.unlink(missing_ok=True)
+			filepath.with_suffix(".md5").unlink(missing_ok=True)
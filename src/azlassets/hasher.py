@@ -0,0 +1,88 @@
+import asyncio
+import hashlib
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from enum import Enum
+from pathlib import Path
+
+
+class HashExecutor(Enum):
+	"""
+	Kind of worker pool hashing files.
+	"""
+
+	THREAD = "thread"
+	"""Threads of the running process, hashlib releases the GIL while hashing large blocks."""
+	PROCESS = "process"
+	"""Separate processes, avoids the GIL entirely at the cost of starting them."""
+
+
+def hash_file(filepath: Path, buffer_size: int = 1_048_576) -> str:
+	"""
+	Calculate the md5 hash of a file, reading it into a reused buffer of ``buffer_size`` bytes.
+
+	Args:
+		filepath: Path of the file
+		buffer_size: Amount of bytes read and hashed at once
+
+	Returns:
+		str: The md5 hash as lowercase hexadecimal string
+	"""
+	md5 = hashlib.md5()
+	buffer = bytearray(buffer_size)
+	view = memoryview(buffer)
+	with filepath.open("rb", buffering=0) as f:
+		while size := f.readinto(buffer):
+			md5.update(view[:size])
+	return md5.hexdigest()
+
+
+class FileHasher:
+	"""
+	Calculates the md5 hashes of files in a pool of workers, so hashing is spread over all CPU
+	cores and doesn't block the event loop.
+
+	The amount of ``workers`` also limits the amount of files open at the same time.
+	"""
+
+	def __init__(self, workers: int = 0, buffer_size: int = 1_048_576, executor: HashExecutor = HashExecutor.THREAD):
+		"""
+		Args:
+			workers: Amount of files hashed at the same time, 0 for one per CPU core
+			buffer_size: Amount of bytes read and hashed at once
+			executor: Whether the workers are threads or processes
+		"""
+		self.workers = workers if workers > 0 else os.cpu_count() or 1
+		self.buffer_size = max(1, buffer_size)
+		self.executor = executor
+		self._executor: Executor | None = None
+
+	def _get_executor(self) -> Executor:
+		# the pool is started on first use, most sessions never hash files
+		if self._executor is None:
+			if self.executor == HashExecutor.PROCESS:
+				self._executor = ProcessPoolExecutor(self.workers)
+			else:
+				self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="azlassets-hasher")
+		return self._executor
+
+	async def hash(self, filepath: Path) -> str:
+		"""
+		Calculate the md5 hash of a file in the worker pool, see :func:`hash_file`.
+
+		Args:
+			filepath: Path of the file
+
+		Returns:
+			str: The md5 hash as lowercase hexadecimal string
+		"""
+		future = self._get_executor().submit(hash_file, filepath, self.buffer_size)
+		return await asyncio.wrap_future(future)
+
+	def close(self):
+		"""
+		Shut down the worker pool after all pending hashes completed.
+		"""
+		if self._executor is not None:
+			self._executor.shutdown(wait=True)
+			self._executor = None
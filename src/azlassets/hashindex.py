@@ -0,0 +1,234 @@
+import bisect
+import mmap
+import os
+import struct
+from collections.abc import Iterable, Iterator
+from enum import Enum
+from pathlib import Path
+
+from .classes import HashRow
+
+MAGIC = b"AZLHIDX1"
+# magic, amount of rows, size of the string table
+HEADER = struct.Struct("<8sII")
+# offset and length of the path in the string table, file size, binary md5 hash
+RECORD = struct.Struct("<IIQ16s")
+DIGEST_SIZE = 16
+
+
+def encode_md5hash(md5hash: str) -> bytes | None:
+	"""
+	Convert a md5 hash to its binary digest.
+
+	Args:
+		md5hash: The md5 hash as lowercase hexadecimal string
+
+	Returns:
+		bytes or None: The 16 byte digest, or None if the hash can't be restored from it,
+			e.g. because it is empty or not lowercase
+	"""
+	if len(md5hash) != DIGEST_SIZE * 2:
+		return
+	try:
+		digest = bytes.fromhex(md5hash)
+	except ValueError:
+		return
+	if digest.hex() == md5hash:
+		return digest
+
+
+class HashFileFormat(Enum):
+	"""
+	On-disk format of the local hash files.
+	"""
+
+	CSV = "csv"
+	"""Text file with one ``path,size,md5hash`` line per file."""
+	INDEX = "index"
+	"""Binary :class:`HashIndex`, sorted by path."""
+
+
+class HashIndexError(ValueError):
+	"""Raised when a file is not a valid hash index."""
+
+
+class HashIndex:
+	"""
+	Read-only binary hash file with rows sorted by path.
+
+	The file starts with a header, followed by one fixed-width record per row and a string table
+	containing the utf8 encoded paths. A record contains the offset and length of its path in
+	the string table, the file size and the md5 hash as 16 bytes. The file is memory-mapped, so
+	opening it doesn't read the rows and iterating unpacks the records without parsing text.
+	:meth:`find` and :meth:`get` look up a path with a binary search over the sorted paths, which
+	are read once on the first lookup, rows are only decoded when they are returned.
+	"""
+
+	def __init__(self, data: bytes | mmap.mmap):
+		"""
+		Args:
+			data: Content of the hash index
+
+		Raises:
+			HashIndexError: If the content is not a valid hash index
+		"""
+		if len(data) < HEADER.size:
+			raise HashIndexError("Hash index is truncated.")
+		magic, self.row_count, string_table_size = HEADER.unpack_from(data, 0)
+		if magic != MAGIC:
+			raise HashIndexError("File is not a hash index.")
+		self._string_table_offset = HEADER.size + self.row_count * RECORD.size
+		if len(data) != self._string_table_offset + string_table_size:
+			raise HashIndexError("Hash index is truncated.")
+		self._data = data
+		self._paths: list[bytes] | None = None
+
+	@staticmethod
+	def open(filepath: Path) -> "HashIndex":
+		"""
+		Open a hash index file. The file is memory-mapped where mapped files can be replaced,
+		otherwise it is read into memory.
+
+		Args:
+			filepath: Path of the hash index
+
+		Raises:
+			HashIndexError: If the file is not a valid hash index
+
+		Returns:
+			HashIndex: The opened hash index
+		"""
+		with filepath.open("rb") as f:
+			# a mapped file can't be replaced on windows
+			if os.name == "nt":
+				return HashIndex(f.read())
+			return HashIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+	def __len__(self) -> int:
+		return self.row_count
+
+	def _get_row(self, index: int) -> HashRow:
+		path_offset, path_length, size, md5hash = RECORD.unpack_from(self._data, HEADER.size + index * RECORD.size)
+		start = self._string_table_offset + path_offset
+		return HashRow(self._data[start : start + path_length].decode("utf8"), size, md5hash.hex())
+
+	def __getitem__(self, index: int) -> HashRow:
+		if not 0 <= index < self.row_count:
+			raise IndexError("Hash index row out of range.")
+		return self._get_row(index)
+
+	def __iter__(self) -> Iterator[HashRow]:
+		for path, size, md5hash in self.iter_records():
+			yield HashRow(path.decode("utf8"), size, md5hash.hex())
+
+	def iter_records(self) -> Iterator[tuple[bytes, int, bytes]]:
+		"""
+		Iterate over the rows without creating :class:`HashRow` objects.
+
+		Yields:
+			tuple[bytes, int, bytes]: The utf8 encoded path, the size and the binary md5 hash of a row
+		"""
+		data = self._data
+		string_table_offset = self._string_table_offset
+		records_end = HEADER.size + self.row_count * RECORD.size
+		for path_offset, path_length, size, md5hash in RECORD.iter_unpack(data[HEADER.size : records_end]):
+			start = string_table_offset + path_offset
+			yield data[start : start + path_length], size, md5hash
+
+	def find(self, filepath: str) -> int | None:
+		"""
+		Find the row index of a path using a binary search.
+
+		Args:
+			filepath: The path of the row
+
+		Returns:
+			int or None: Index of the row, or None if the path is not in the index
+		"""
+		# the paths are read into a list once, so each lookup is a binary search in C
+		if self._paths is None:
+			self._paths = [path for path, _, _ in self.iter_records()]
+		key = filepath.encode("utf8")
+		index = bisect.bisect_left(self._paths, key)
+		if index < self.row_count and self._paths[index] == key:
+			return index
+
+	def get(self, filepath: str) -> HashRow | None:
+		"""
+		Find the row of a path using a binary search, see :meth:`find`.
+
+		Args:
+			filepath: The path of the row
+
+		Returns:
+			HashRow or None: The row, or None if the path is not in the index
+		"""
+		index = self.find(filepath)
+		if index is not None:
+			return self._get_row(index)
+
+	def matches(self, index: int, hashrow: HashRow) -> bool:
+		"""
+		Return whether a row has the same size and md5 hash as ``hashrow``, without decoding it.
+
+		Args:
+			index: Index of the row, e.g. found with :meth:`find` for the path of ``hashrow``
+			hashrow: The row to compare to
+
+		Returns:
+			bool: True if the size and md5 hash are equal
+		"""
+		_, _, size, md5hash = RECORD.unpack_from(self._data, HEADER.size + index * RECORD.size)
+		return size == hashrow.size and md5hash.hex() == hashrow.md5hash
+
+	def __contains__(self, filepath: str) -> bool:
+		return self.get(filepath) is not None
+
+	def close(self):
+		"""
+		Unmap the file of the hash index. Rows can't be read afterwards.
+		"""
+		if isinstance(self._data, mmap.mmap):
+			self._data.close()
+
+
+def build_hash_index(hashrows: Iterable[HashRow]) -> bytes:
+	"""
+	Serialize hash rows into the hash index format, sorted by path.
+
+	Rows without a valid md5 hash, e.g. of files missing on disk, are left out. Like a changed
+	hash, a missing row makes the next update download the file again.
+
+	Args:
+		hashrows: The rows
+
+	Returns:
+		bytes: Content of the hash index
+	"""
+	encoded_rows = []
+	for row in hashrows:
+		md5hash = encode_md5hash(row.md5hash.lower())
+		if md5hash is not None:
+			encoded_rows.append((row.filepath.encode("utf8"), row.size, md5hash))
+	encoded_rows.sort(key=lambda item: item[0])
+	records = bytearray(len(encoded_rows) * RECORD.size)
+	string_table = bytearray()
+	for index, (path, size, md5hash) in enumerate(encoded_rows):
+		RECORD.pack_into(records, index * RECORD.size, len(string_table), len(path), size, md5hash)
+		string_table += path
+	return HEADER.pack(MAGIC, len(encoded_rows), len(string_table)) + records + string_table
+
+
+def write_hash_index(filepath: Path, hashrows: Iterable[HashRow]):
+	"""
+	Write hash rows to a hash index file. The file is replaced atomically.
+
+	Args:
+		filepath: Path of the hash index
+		hashrows: The rows
+	"""
+	content = build_hash_index(hashrows)
+	filepath.parent.mkdir(parents=True, exist_ok=True)
+	temporary_filepath = filepath.with_name(filepath.name + ".tmp")
+	temporary_filepath.write_bytes(content)
+	temporary_filepath.replace(filepath)
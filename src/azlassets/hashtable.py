@@ -0,0 +1,215 @@
+from array import array
+from collections.abc import Iterable, Iterator
+
+from .classes import HashRow
+from .hashindex import DIGEST_SIZE, HashIndex, encode_md5hash
+
+
+class HashTableBuilder:
+	"""
+	Collects rows sorted by path into the columns of a :class:`HashTable`.
+	A row with the same path as the previous row replaces it.
+	"""
+
+	def __init__(self):
+		self.paths = bytearray()
+		self.path_offsets = array("Q", [0])
+		self.sizes = array("Q")
+		self.digests = bytearray()
+		self.raw_hashes: dict[int, str] = {}
+		self._last_path = None
+
+	def add(self, path: bytes, size: int, digest: bytes | None, md5hash: str | None = None):
+		"""
+		Append a row. Rows have to be added in ascending order of their path.
+
+		Args:
+			path: The utf8 encoded path
+			size: The file size
+			digest: The binary md5 hash, None if it is kept as ``md5hash``
+			md5hash: The md5 hash as string, only used if there is no ``digest``
+		"""
+		if path == self._last_path:
+			index = len(self.sizes) - 1
+			self.sizes[index] = size
+			self.digests[index * DIGEST_SIZE :] = digest or bytes(DIGEST_SIZE)
+			self.raw_hashes.pop(index, None)
+		else:
+			index = len(self.sizes)
+			self.paths += path
+			self.path_offsets.append(len(self.paths))
+			self.sizes.append(size)
+			self.digests += digest or bytes(DIGEST_SIZE)
+			self._last_path = path
+		if digest is None:
+			self.raw_hashes[index] = md5hash or ""
+
+	def build(self) -> "HashTable":
+		"""
+		Returns:
+			HashTable: The table of the added rows
+		"""
+		return HashTable(self.paths, self.path_offsets, self.sizes, self.digests, self.raw_hashes)
+
+
+class HashTable:
+	"""
+	Compact, read-only set of hash rows sorted by path.
+
+	The rows are stored as columns instead of one :class:`HashRow` per file: the utf8 encoded
+	paths in a single buffer with an array of their offsets, an array of the sizes and a buffer of
+	the 16 byte md5 digests. Hashes that aren't valid md5 hashes, e.g. of missing files, are kept
+	as strings. :class:`HashRow` objects are only created when rows are accessed, so tables of all
+	version types fit into a fraction of the memory of their rows.
+	"""
+
+	__slots__ = ("_digests", "_path_offsets", "_paths", "_raw_hashes", "_sizes")
+
+	def __init__(self, paths: bytearray, path_offsets: array, sizes: array, digests: bytearray, raw_hashes: dict[int, str]):
+		"""
+		Use :meth:`from_rows` or :class:`HashTableBuilder` to create a table.
+
+		Args:
+			paths: The concatenated utf8 encoded paths in ascending order
+			path_offsets: Start offset of each path in ``paths``, followed by the length of ``paths``
+			sizes: File size of each row
+			digests: The concatenated binary md5 hashes
+			raw_hashes: md5 hash strings of rows that have no valid digest, by row index
+		"""
+		self._paths = paths
+		self._path_offsets = path_offsets
+		self._sizes = sizes
+		self._digests = digests
+		self._raw_hashes = raw_hashes
+
+	@staticmethod
+	def from_rows(hashrows: Iterable[HashRow]) -> "HashTable":
+		"""
+		Create a table of hash rows in any order. Of multiple rows with the same path, the last one is kept.
+
+		Args:
+			hashrows: The rows, a :class:`HashIndex` is read without creating rows
+
+		Returns:
+			HashTable: The table
+		"""
+		if isinstance(hashrows, HashTable):
+			return hashrows
+		if isinstance(hashrows, HashIndex):
+			return HashTable.from_index(hashrows)
+
+		# collect the columns unsorted, then add them in the order of a sorted permutation.
+		# utf8 preserves the order of code points, so the paths are sorted as strings
+		paths = []
+		sizes = array("Q")
+		digests = bytearray()
+		raw_hashes = {}
+		for row in hashrows:
+			digest = encode_md5hash(row.md5hash)
+			if digest is None:
+				raw_hashes[len(paths)] = row.md5hash
+			paths.append(row.filepath)
+			sizes.append(row.size)
+			digests += digest or bytes(DIGEST_SIZE)
+
+		# the sort is stable, so duplicate paths stay in order and the last one replaces the others
+		builder = HashTableBuilder()
+		for index in sorted(range(len(paths)), key=paths.__getitem__):
+			path = paths[index].encode("utf8")
+			if index in raw_hashes:
+				builder.add(path, sizes[index], None, raw_hashes[index])
+			else:
+				builder.add(path, sizes[index], digests[index * DIGEST_SIZE : (index + 1) * DIGEST_SIZE])
+		return builder.build()
+
+	@staticmethod
+	def from_index(hash_index: HashIndex) -> "HashTable":
+		"""
+		Create a table of a hash index, which is already sorted by path.
+
+		Args:
+			hash_index: The hash index
+
+		Returns:
+			HashTable: The table
+		"""
+		builder = HashTableBuilder()
+		for path, size, digest in hash_index.iter_records():
+			builder.add(path, size, digest)
+		return builder.build()
+
+	def __len__(self) -> int:
+		return len(self._sizes)
+
+	def get_path(self, index: int) -> str:
+		"""
+		Args:
+			index: Index of the row
+
+		Returns:
+			str: The path of the row
+		"""
+		return self._paths[self._path_offsets[index] : self._path_offsets[index + 1]].decode("utf8")
+
+	def get_size(self, index: int) -> int:
+		"""
+		Args:
+			index: Index of the row
+
+		Returns:
+			int: The file size of the row
+		"""
+		return self._sizes[index]
+
+	def find(self, path: str) -> int | None:
+		"""
+		Find the row of a path using a binary search.
+
+		Args:
+			path: The path of the row
+
+		Returns:
+			int or None: Index of the row, or None if the path is not in the table
+		"""
+		key = path.encode("utf8")
+		paths, offsets = self._paths, self._path_offsets
+		low, high = 0, len(self._sizes)
+		while low < high:
+			middle = (low + high) // 2
+			if paths[offsets[middle] : offsets[middle + 1]] < key:
+				low = middle + 1
+			else:
+				high = middle
+		if low < len(self._sizes) and paths[offsets[low] : offsets[low + 1]] == key:
+			return low
+
+	def get_md5hash(self, index: int) -> str:
+		"""
+		Args:
+			index: Index of the row
+
+		Returns:
+			str: The md5 hash of the row as hexadecimal string
+		"""
+		if (md5hash := self._raw_hashes.get(index)) is not None:
+			return md5hash
+		return self._digests[index * DIGEST_SIZE : (index + 1) * DIGEST_SIZE].hex()
+
+	def __getitem__(self, index: int) -> HashRow:
+		if not 0 <= index < len(self._sizes):
+			raise IndexError("Hash table row out of range.")
+		return HashRow(self.get_path(index), self._sizes[index], self.get_md5hash(index))
+
+	def __iter__(self) -> Iterator[HashRow]:
+		for index in range(len(self._sizes)):
+			yield self[index]
+
+	@property
+	def nbytes(self) -> int:
+		"""Approximate amount of memory used by the columns in bytes."""
+		return (
+			len(self._paths)
+			+ self._path_offsets.itemsize * len(self._path_offsets)
+			+ self._sizes.itemsize * len(self._sizes)
+			+ len(self._digests)
+		)
@@ -3,18 +3,21 @@ import io
 import itertools
 import json
 import re
-import shutil
 import sys
 from collections import defaultdict
 from collections.abc import Callable
 from dataclasses import dataclass
 from pathlib import Path
 from tqdm import tqdm
+from typing import IO
 from zipfile import ZipFile
 
-from . import updater
+from . import downloadmgr, updater
+from .assetstore import AssetStore, place_file
 from .classes import BundlePath, Client, CompareType, DownloadType, UpdateResult
 from .config import load_user_config
+from .downloader import get_partial_path
+from .statcache import StatCache
 from .versioncontrol import SimpleVersionResult, VersionController, VersionType, compare_version_string, parse_hash_rows
 
 
@@ -45,7 +48,9 @@ def unpack(zipfile: ZipFile, client: Client):
 	userconfig = load_user_config()
 	CLIENT_ASSET_DIR = Path(userconfig.asset_directory, client.name)
 	CLIENT_ASSET_DIR.mkdir(parents=True, exist_ok=True)
-	versioncontroller = VersionController(CLIENT_ASSET_DIR)
+	versioncontroller = VersionController(CLIENT_ASSET_DIR, userconfig.hash_file_format)
+	stat_cache = StatCache.load(versioncontroller.get_stat_cache_path())
+	asset_store = downloadmgr.create_asset_store(userconfig)
 
 	# create {filename: filesize} dict for later recovery of missed files
 	file_info_list = {f.filename: f.file_size for f in zipfile.filelist if not f.is_dir()}
@@ -92,7 +97,14 @@ def unpack(zipfile: ZipFile, client: Client):
 				for result in update_files:
 					if result.compare_type in [CompareType.New, CompareType.Changed]:
 						assetpath = BundlePath.construct(assetbasepath, result.new_hash.filepath)  # pyright: ignore [reportOptionalMemberAccess]
-						if pathresult := extract_asset(zipfile, assetpath.inner, assetpath.full):
+						if pathresult := extract_asset(
+							zipfile,
+							assetpath.inner,
+							assetpath.full,
+							stat_cache,
+							asset_store,
+							result.new_hash.md5hash,  # pyright: ignore [reportOptionalMemberAccess]
+						):
 							file_info_list.pop(pathresult)
 							update_results.append(
 								UpdateResult(
@@ -104,6 +116,7 @@ def unpack(zipfile: ZipFile, client: Client):
 					elif result.compare_type == CompareType.Deleted:
 						assetpath = BundlePath.construct(assetbasepath, result.current_hash.filepath)  # pyright: ignore [reportOptionalMemberAccess]
 						updater.delete_asset_safe(assetpath.full)
+						stat_cache.remove(assetpath.inner)
 						update_results.append(UpdateResult(result, DownloadType.Removed, assetpath))
 					progressbar.update()
 
@@ -125,16 +138,18 @@ def unpack(zipfile: ZipFile, client: Client):
 								zipf_md5hash = calc_md5hash(zipf_data)
 								if result.new_hash.md5hash != zipf_md5hash:
 									continue
-								with open(assetpath.full, "wb") as f:
-									f.write(zipf_data)
-									update_results.append(
-										UpdateResult(
-											result,
-											DownloadType.Success if assetpath.full.exists() else DownloadType.Failed,
-											assetpath,
-										)
+								write_asset(io.BytesIO(zipf_data), assetpath.full)
+								if asset_store:
+									store_asset(asset_store, zipf_md5hash, assetpath.full)
+								stat_cache.record(assetpath.inner, assetpath.full, zipf_md5hash)
+								update_results.append(
+									UpdateResult(
+										result,
+										DownloadType.Success if assetpath.full.exists() else DownloadType.Failed,
+										assetpath,
 									)
-									break
+								)
+								break
 						# else:
 						# print( LOG ERROR MESSAGE HERE )
 						progressbar.update()
@@ -143,16 +158,73 @@ def unpack(zipfile: ZipFile, client: Client):
 		version = SimpleVersionResult(version=obbversion, version_type=versiontype)
 		hashes_updated = updater.filter_hashes(update_results)
 		versioncontroller.update_version_diffdata(version, hashes_updated, update_results)
+	stat_cache.save()
 
 
-def extract_asset(zipfile: ZipFile, filepath: str, target: Path) -> str | None:
+def write_asset(source: IO[bytes], target: Path) -> str:
 	"""
-	Extract a single asset from the archive to ``target``.
+	Write an asset to ``target``. The asset is written to a ``.part`` file first, which then
+	replaces ``target``, so a file at ``target`` that is linked to the asset store is never
+	overwritten in place.
+
+	Args:
+		source: File object the asset is read from
+		target: Destination path of the asset
+
+	Returns:
+		str: The md5 hash of the written asset
+	"""
+	partial_target = get_partial_path(target)
+	md5 = hashlib.md5()
+	try:
+		with partial_target.open("wb") as f:
+			while chunk := source.read(1_048_576):
+				md5.update(chunk)
+				f.write(chunk)
+		partial_target.replace(target)
+	finally:
+		partial_target.unlink(missing_ok=True)
+	return md5.hexdigest()
+
+
+def store_asset(asset_store: AssetStore, md5hash: str, filepath: Path):
+	"""
+	Add an imported asset to the asset store. If the store already contains the asset, the file
+	is replaced by a link to the stored file instead, like a downloaded asset.
+
+	Args:
+		asset_store: The asset store
+		md5hash: The verified md5 hash of the asset
+		filepath: Path of the imported asset in the client directory
+	"""
+	try:
+		if asset_store.contains(md5hash, filepath.stat().st_size):
+			place_file(asset_store.get_path(md5hash), filepath, asset_store.link_mode)
+		else:
+			asset_store.add(md5hash, filepath)
+	except OSError as e:
+		print(f"WARN: Adding imported asset '{md5hash}' to the asset store failed. {e}")
+
+
+def extract_asset(
+	zipfile: ZipFile,
+	filepath: str,
+	target: Path,
+	stat_cache: StatCache | None = None,
+	asset_store: AssetStore | None = None,
+	md5hash: str = "",
+) -> str | None:
+	"""
+	Extract a single asset from the archive to ``target``, see :func:`write_asset`. The md5 hash
+	of the extracted file is calculated while it is written and recorded in ``stat_cache``.
 
 	Args:
 		zipfile: Open archive to extract from
 		filepath: Asset path relative to ``assets/AssetBundles/``
 		target: Destination path to save the extracted file to
+		stat_cache: Cache of the hashes of the files in the client directory
+		asset_store: Asset store the extracted file is added to if it matches ``md5hash``
+		md5hash: The expected md5 hash of the asset
 
 	Returns:
 		str or None: The resolved in-archive path on success, None if not found
@@ -165,11 +237,15 @@ def extract_asset(zipfile: ZipFile, filepath: str, target: Path) -> str | None:
 		assetpath = "assets/AssetBundles/" + filepath + ".ys"
 
 	try:
-		with zipfile.open(assetpath, "r") as zf, open(target, "wb") as f:
-			shutil.copyfileobj(zf, f)
-			return assetpath
+		with zipfile.open(assetpath, "r") as zf:
+			written_md5hash = write_asset(zf, target)
 	except KeyError:
-		pass
+		return
+	if asset_store and written_md5hash == md5hash:
+		store_asset(asset_store, written_md5hash, target)
+	if stat_cache is not None:
+		stat_cache.record(filepath, target, written_md5hash)
+	return assetpath
 
 
 def extract_obb(path: Path, fallback_client: Client | None = None):
@@ -0,0 +1,244 @@
+import json
+import math
+import os
+import random
+import time
+import zlib
+from enum import Enum
+from pathlib import Path
+
+
+class IntegrityLevel(Enum):
+	"""
+	How thoroughly ``--check-integrity`` verifies the files on disk.
+	"""
+
+	FAST = "fast"
+	"""Only compare the existence and size of the files with the hash files."""
+	SAMPLED = "sampled"
+	"""Hash a part of the files, see :class:`IntegritySampler`, compare the others like ``FAST``."""
+	FULL = "full"
+	"""Hash all files."""
+
+
+class SampleMode(Enum):
+	"""
+	How the files hashed by a sampled integrity check are selected.
+	"""
+
+	ROTATING = "rotating"
+	"""Each run hashes the next part of the files, all files are hashed after ``100 / percent`` runs."""
+	RANDOM = "random"
+	"""Each run hashes randomly selected files."""
+
+
+class IntegritySampler:
+	"""
+	Selects the files hashed by a sampled integrity check.
+
+	In rotating mode, files are assigned to one of ``ceil(100 / percent)`` rounds by a checksum of
+	their path, so the assignment is stable while files are added or removed. Each run checks
+	the files of one round and the next run continues with the following round, which is saved
+	to a file in the client directory.
+	"""
+
+	def __init__(self, filepath: Path, percent: float, mode: SampleMode = SampleMode.ROTATING, round_index: int = 0):
+		"""
+		Args:
+			filepath: Path of the JSON file the next round is saved to
+			percent: Share of the files hashed per run
+			mode: How the files are selected
+			round_index: The round checked by this run
+		"""
+		self.filepath = filepath
+		self.percent = min(max(percent, 0.0), 100.0)
+		self.mode = mode
+		self.rounds = math.ceil(100 / self.percent) if self.percent > 0 else 0
+		self.round_index = round_index % self.rounds if self.rounds else 0
+
+	@staticmethod
+	def load(filepath: Path, percent: float, mode: SampleMode = SampleMode.ROTATING) -> "IntegritySampler":
+		"""
+		Load the round of a sampler from file. Starts with the first round if the file does not exist.
+
+		Args:
+			filepath: Path of the JSON file
+			percent: Share of the files hashed per run
+			mode: How the files are selected
+
+		Returns:
+			IntegritySampler: The loaded sampler
+		"""
+		try:
+			with filepath.open("r", encoding="utf8") as f:
+				round_index = int(json.load(f).get("round", 0))
+		except (FileNotFoundError, ValueError, AttributeError):
+			round_index = 0
+		return IntegritySampler(filepath, percent, mode, round_index)
+
+	def save(self):
+		"""
+		Save the round following the current one to the file of the sampler.
+		"""
+		if self.mode != SampleMode.ROTATING or not self.rounds:
+			return
+		self.filepath.parent.mkdir(parents=True, exist_ok=True)
+		with self.filepath.open("w", encoding="utf8") as f:
+			json.dump({"round": (self.round_index + 1) % self.rounds, "rounds": self.rounds}, f)
+
+	def is_sampled(self, path: str) -> bool:
+		"""
+		Return whether a file is hashed in this run.
+
+		Args:
+			path: Path of the file relative to ``AssetBundles``
+
+		Returns:
+			bool: True if the file is hashed
+		"""
+		if not self.rounds:
+			return False
+		if self.mode == SampleMode.RANDOM:
+			return random.random() * 100 < self.percent
+		return zlib.crc32(path.encode("utf8")) % self.rounds == self.round_index
+
+
+def get_scan_id(level: IntegrityLevel, deep: bool = False, sampler: IntegritySampler | None = None) -> str:
+	"""
+	Identify the kind of an integrity check, so a checkpoint is only continued by the same kind of check.
+
+	Args:
+		level: Level of the check
+		deep: Whether all files are hashed, also files unchanged since they were last hashed
+		sampler: Sampler of a ``SAMPLED`` check
+
+	Returns:
+		str: The scan id, e.g. ``full``, ``full-deep`` or ``sampled-3``
+	"""
+	if level == IntegrityLevel.SAMPLED and sampler is not None:
+		return f"{level.value}-{sampler.round_index}"
+	if level == IntegrityLevel.FULL and deep:
+		return f"{level.value}-deep"
+	return level.value
+
+
+class IntegrityCheckpoint:
+	"""
+	Progress of an integrity check, saved periodically to a file in the client directory so an
+	interrupted check, or one that ran out of its time budget, continues where it stopped.
+
+	The checkpoint records the md5 hash of each file verified so far together with its inode, size
+	and modification time, like :class:`StatCache`. A continued check trusts the recorded hash of a
+	file as long as all of them are unchanged, files changed since are checked again. The recorded
+	hashes are compared to the hash files again, so files are still replaced if the hash files are
+	updated in between. A checkpoint is only continued by a check with the same ``scan_id``, e.g.
+	of the same level and sample round.
+	"""
+
+	def __init__(self, filepath: Path, scan_id: str, interval: float = 60.0, entries: dict[str, list] | None = None):
+		"""
+		Args:
+			filepath: Path of the JSON file the checkpoint is saved to
+			scan_id: Identifies the kind of check the checkpoint belongs to
+			interval: Minimum amount of seconds between periodic saves
+			entries: Mapping of the verified paths to their ``[inode, size, mtime_ns, md5hash]``
+		"""
+		self.filepath = filepath
+		self.scan_id = scan_id
+		self.interval = interval
+		self.entries = entries or {}
+		self.resumed_files = len(self.entries)
+		"""Amount of files verified by previous runs of the check."""
+		self._last_save = time.monotonic()
+
+	@staticmethod
+	def load(filepath: Path, scan_id: str, interval: float = 60.0) -> "IntegrityCheckpoint":
+		"""
+		Load the checkpoint of a check. Starts a new checkpoint if the file does not exist or
+		belongs to another kind of check.
+
+		Args:
+			filepath: Path of the JSON file
+			scan_id: Identifies the kind of check
+			interval: Minimum amount of seconds between periodic saves
+
+		Returns:
+			IntegrityCheckpoint: The loaded checkpoint
+		"""
+		try:
+			with filepath.open("r", encoding="utf8") as f:
+				data = json.load(f)
+			entries = data["files"] if data.get("scan") == scan_id else {}
+			# entries of another format can't be verified and are checked again
+			entries = {path: entry for path, entry in entries.items() if isinstance(entry, list) and len(entry) == 4}
+		except (FileNotFoundError, ValueError, AttributeError, KeyError):
+			entries = {}
+		return IntegrityCheckpoint(filepath, scan_id, interval, entries)
+
+	def get(self, path: str, stat: os.stat_result) -> str | None:
+		"""
+		Return the md5 hash of a file verified by a previous run, if its inode, size and modification time are unchanged.
+
+		Args:
+			path: Path of the file relative to ``AssetBundles``
+			stat: Current stat of the file
+
+		Returns:
+			str or None: The md5 hash, or None if the file wasn't verified or has changed
+		"""
+		entry = self.entries.get(path)
+		if entry is None:
+			return
+		inode, size, mtime_ns, md5hash = entry
+		if inode != stat.st_ino or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+			return
+		return md5hash
+
+	def add(self, path: str, stat: os.stat_result, md5hash: str):
+		"""
+		Record a verified file and save the checkpoint if ``interval`` passed since it was last saved.
+
+		Args:
+			path: Path of the file relative to ``AssetBundles``
+			stat: Stat of the file the hash belongs to
+			md5hash: The md5 hash of the file
+		"""
+		self.entries[path] = [stat.st_ino, stat.st_size, stat.st_mtime_ns, md5hash]
+		if time.monotonic() - self._last_save >= self.interval:
+			self.save()
+
+	def record(self, path: str, filepath: Path, size: int, md5hash: str):
+		"""
+		Record a verified file with its current stat, see :meth:`add`. Files that were removed or
+		changed their size since they were verified are not recorded.
+
+		Args:
+			path: Path of the file relative to ``AssetBundles``
+			filepath: Full path of the file
+			size: Size of the file when it was verified
+			md5hash: The md5 hash of the file
+		"""
+		try:
+			stat = filepath.stat()
+		except FileNotFoundError:
+			return
+		if stat.st_size == size:
+			self.add(path, stat, md5hash)
+
+	def save(self):
+		"""
+		Save the checkpoint to its file.
+		"""
+		self.filepath.parent.mkdir(parents=True, exist_ok=True)
+		temporary_filepath = self.filepath.with_name(self.filepath.name + ".tmp")
+		with temporary_filepath.open("w", encoding="utf8") as f:
+			json.dump({"scan": self.scan_id, "files": self.entries}, f)
+		temporary_filepath.replace(self.filepath)
+		self._last_save = time.monotonic()
+
+	def clear(self):
+		"""
+		Remove the checkpoint after the check completed, so the next check starts from the beginning.
+		"""
+		self.entries = {}
+		self.filepath.unlink(missing_ok=True)
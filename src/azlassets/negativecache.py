@@ -0,0 +1,87 @@
+import json
+import time
+from pathlib import Path
+
+
+class NegativeCache:
+	"""
+	Persistent record of assets the server responded to with 404, keyed by their md5 hash.
+
+	Entries expire after ``ttl`` seconds, so assets that become available on the server later
+	are requested again eventually.
+	"""
+
+	def __init__(self, filepath: Path, ttl: float, entries: dict[str, float] | None = None):
+		"""
+		Args:
+			filepath: Path of the JSON file the cache is saved to
+			ttl: Time in seconds after which an entry expires
+			entries: Mapping of md5 hashes to the time they were last reported missing
+		"""
+		self.filepath = filepath
+		self.ttl = ttl
+		self.entries = entries or {}
+		self.skipped: set[str] = set()
+		"""Hashes of assets whose requests were skipped because of a cached entry."""
+
+	@staticmethod
+	def load(filepath: Path, ttl: float) -> "NegativeCache":
+		"""
+		Load a negative cache from file, dropping expired entries.
+		Returns an empty cache if the file does not exist.
+
+		Args:
+			filepath: Path of the JSON file
+			ttl: Time in seconds after which an entry expires
+
+		Returns:
+			NegativeCache: The loaded cache
+		"""
+		try:
+			with filepath.open("r", encoding="utf8") as f:
+				entries = json.load(f)
+		except FileNotFoundError:
+			entries = {}
+
+		now = time.time()
+		entries = {md5hash: timestamp for md5hash, timestamp in entries.items() if now - timestamp < ttl}
+		return NegativeCache(filepath, ttl, entries)
+
+	def save(self):
+		"""
+		Save the cache to its file.
+		"""
+		self.filepath.parent.mkdir(parents=True, exist_ok=True)
+		with self.filepath.open("w", encoding="utf8") as f:
+			json.dump(self.entries, f)
+
+	def is_missing(self, md5hash: str) -> bool:
+		"""
+		Return whether an asset is known to be missing on the server.
+
+		Args:
+			md5hash: The md5 hash of the asset
+
+		Returns:
+			bool: True if the asset was reported missing within the ttl
+		"""
+		timestamp = self.entries.get(md5hash)
+		return timestamp is not None and time.time() - timestamp < self.ttl
+
+	def add(self, md5hash: str):
+		"""
+		Record an asset as missing on the server.
+
+		Args:
+			md5hash: The md5 hash of the asset
+		"""
+		self.entries[md5hash] = time.time()
+
+	def remove(self, md5hash: str):
+		"""
+		Remove an asset from the cache, if it is present.
+
+		Args:
+			md5hash: The md5 hash of the asset
+		"""
+		self.entries.pop(md5hash, None)
@@ -0,0 +1,172 @@
+import fnmatch
+import re
+from collections.abc import Iterable
+
+GLOB_CHARACTERS = frozenset("*?[")
+
+
+class PathTrieNode:
+	"""
+	Node of the :class:`PathFilter` trie, representing one path component of its rules.
+	"""
+
+	__slots__ = ("children", "globs", "matches_any", "prefix_children", "prefix_lengths", "recursive", "rule")
+
+	def __init__(self, matches_any: bool = False):
+		"""
+		Args:
+			matches_any: Whether the node is a ``**`` component, which stays active for any further component
+		"""
+		self.matches_any = matches_any
+		self.children: dict[str, PathTrieNode] = {}
+		"""Child nodes of literal components."""
+		self.prefix_children: dict[str, PathTrieNode] = {}
+		"""Child nodes of literal components that also match components starting with them."""
+		self.prefix_lengths: set[int] = set()
+		"""Lengths of the keys of ``prefix_children``."""
+		self.globs: list[tuple[re.Pattern, PathTrieNode]] = []
+		"""Child nodes of components with glob characters, with their compiled pattern."""
+		self.recursive: PathTrieNode | None = None
+		"""Child node of a ``**`` component, matching any amount of components."""
+		self.rule: int | None = None
+		"""Index of the rule ending at this node."""
+
+	def get_child(self, component: str, match_prefix: bool = False) -> "PathTrieNode":
+		"""
+		Return the child node of a rule component, creating it if it doesn't exist.
+
+		Args:
+			component: The rule component, may contain glob characters or be ``**``
+			match_prefix: Whether a literal component also matches components starting with it
+
+		Returns:
+			PathTrieNode: The child node
+		"""
+		if component == "**":
+			if self.recursive is None:
+				self.recursive = PathTrieNode(matches_any=True)
+			return self.recursive
+		if GLOB_CHARACTERS.isdisjoint(component):
+			if match_prefix:
+				self.prefix_lengths.add(len(component))
+				return self.prefix_children.setdefault(component, PathTrieNode())
+			return self.children.setdefault(component, PathTrieNode())
+
+		pattern = re.compile(fnmatch.translate(component))
+		for glob_pattern, child in self.globs:
+			if glob_pattern.pattern == pattern.pattern:
+				return child
+		child = PathTrieNode()
+		self.globs.append((pattern, child))
+		return child
+
+
+class PathFilter:
+	"""
+	Compiled allow and deny rules for relative asset paths, e.g. of hash rows or asset bundles.
+
+	Each rule is a path like ``painting`` or ``char/abc``, which matches the path itself and
+	everything below it. Components may contain the globs ``*``, ``?`` and ``[...]``, and a ``**``
+	component matches any amount of components, e.g. ``**/*_tex``. The rules are compiled into a
+	trie of their components, so a path is matched against all of them in a single walk over its
+	components.
+
+	With ``match_prefix``, a rule matches all paths starting with it like a plain string prefix,
+	e.g. ``char`` also matches ``character/abc``, unless the rule ends with ``/``. The download
+	filter has always matched paths this way.
+
+	In a blacklist, paths matching a rule are excluded, in a whitelist only paths matching a
+	rule are included. Rules prefixed with ``!`` do the opposite, e.g. ``!painting/abc`` in a
+	blacklist containing ``painting`` includes that file again. If multiple rules match a path,
+	the last one decides.
+	"""
+
+	def __init__(self, rules: Iterable[str], isblacklist: bool, match_prefix: bool = False):
+		"""
+		Args:
+			rules: The rules in order of precedence, later rules override earlier ones
+			isblacklist: Whether the rules exclude the paths they match
+			match_prefix: Whether the last component of a rule also matches components starting with it
+		"""
+		self.isblacklist = isblacklist
+		self.match_prefix = match_prefix
+		self.root = PathTrieNode()
+		self._includes: list[bool] = []
+		for rule in rules:
+			self.add_rule(rule)
+
+	def add_rule(self, rule: str):
+		"""
+		Add a rule with a higher precedence than all previous rules.
+
+		Args:
+			rule: The rule, prefixed with ``!`` to invert it
+		"""
+		inverted = rule.startswith("!")
+		components = [component for component in rule.removeprefix("!").split("/") if component]
+		if not components:
+			return
+
+		node = self.root
+		for component in components[:-1]:
+			node = node.get_child(component)
+		node = node.get_child(components[-1], self.match_prefix and not rule.endswith("/"))
+		node.rule = len(self._includes)
+		self._includes.append(self.isblacklist == inverted)
+
+	def _expand(self, nodes: list[PathTrieNode]) -> list[PathTrieNode]:
+		# a ** component also matches no component at all
+		expanded = []
+		for node in nodes:
+			while node is not None and node not in expanded:
+				expanded.append(node)
+				node = node.recursive
+		return expanded
+
+	def get_matching_rule(self, path: str) -> int | None:
+		"""
+		Return the rule deciding whether a path is included.
+
+		Args:
+			path: The relative path with ``/`` as separator
+
+		Returns:
+			int or None: Index of the last rule matching the path, None if no rule matches
+		"""
+		matching_rule = -1
+		nodes = self._expand([self.root])
+		for component in path.split("/"):
+			next_nodes = []
+			for node in nodes:
+				if child := node.children.get(component):
+					next_nodes.append(child)
+				for length in node.prefix_lengths:
+					if child := node.prefix_children.get(component[:length]):
+						next_nodes.append(child)
+				for pattern, child in node.globs:
+					if pattern.match(component):
+						next_nodes.append(child)
+				if node.matches_any:
+					next_nodes.append(node)
+			nodes = self._expand(next_nodes)
+			if not nodes:
+				break
+			for node in nodes:
+				if node.rule is not None and node.rule > matching_rule:
+					matching_rule = node.rule
+		return matching_rule if matching_rule >= 0 else None
+
+	def is_included(self, path: str) -> bool:
+		"""
+		Return whether a path passes the filter.
+
+		Args:
+			path: The relative path with ``/`` as separator
+
+		Returns:
+			bool: True if the path is included
+		"""
+		matching_rule = self.get_matching_rule(path)
+		if matching_rule is None:
+			return self.isblacklist
+		return self._includes[matching_rule]
@@ -1,125 +1,429 @@
-import aiofile
 import asyncio
-import hashlib
+import contextlib
 import itertools
+import os
+import time
+from collections.abc import AsyncIterator, Callable
 from pathlib import Path
+from tqdm import tqdm
 from tqdm.asyncio import tqdm_asyncio
 
 from . import downloader, updater
-from .classes import BundlePath, CompareType, DownloadType, HashRow, UpdateResult
+from .classes import BundlePath, CompareResult, CompareType, DownloadType, HashRow, UpdateResult
 from .config import UserConfig
+from .hasher import FileHasher, hash_file
+from .hashtable import HashTable
+from .integrity import IntegrityCheckpoint, IntegrityLevel, IntegritySampler
+from .statcache import StatCache
 from .versioncontrol import VersionController, VersionResult, VersionType
 
-semaphore_concurrent_files = asyncio.Semaphore(16)
 
-
-async def calc_md5hash(filepath: Path, chunk_size: int = 65536) -> str:
+async def calc_md5hash(filepath: Path, hasher: FileHasher | None = None) -> str:
 	"""
-	Compute the MD5 hex digest of a file asynchronously.
+	Compute the MD5 hex digest of a file without blocking the event loop.
 
 	Args:
 		filepath: Path to the file to hash
-		chunk_size: Read chunk size in bytes (default 64 KB)
+		hasher: Worker pool calculating the hash, a thread of the default executor if not set
 
 	Returns:
 		str: The MD5 hash as a lowercase hexadecimal string
 	"""
-	md5 = hashlib.md5()
-	async with semaphore_concurrent_files:
-		async with aiofile.async_open(filepath, "rb") as f:
-			async for chunk in f.iter_chunked(chunk_size):
-				md5.update(chunk)  # pyright: ignore [reportArgumentType]
-	return md5.hexdigest()
-
-
-async def get_filedata(filepath: Path) -> tuple[str, int]:
+	if hasher is None:
+		return await asyncio.to_thread(hash_file, filepath)
+	return await hasher.hash(filepath)
+
+
+async def get_filedata(
+	filepath: Path,
+	stat_cache: StatCache | None = None,
+	cache_key: str = "",
+	deep: bool = False,
+	hasher: FileHasher | None = None,
+) -> tuple[str, int]:
 	"""
 	Return the MD5 hash and size of a file, or empty defaults if it doesn't exist.
 
+	With a ``stat_cache``, the hash of a file that is unchanged since it was recorded is taken
+	from the cache instead of reading the file, unless ``deep`` is set. Calculated hashes are
+	recorded in the cache.
+
 	Args:
 		filepath: Path to the file
+		stat_cache: Cache of the hashes of the files in the client directory
+		cache_key: Path of the file in the cache, relative to ``AssetBundles``
+		deep: Whether to calculate the hash even if the file is unchanged
+		hasher: Worker pool calculating the hash
 
 	Returns:
 		tuple[str, int]: ``(md5_hex, size_in_bytes)``, or ``("", 0)`` if the file is absent
 	"""
-	if filepath.exists():
-		current_md5 = await calc_md5hash(filepath)
-		current_size = filepath.stat().st_size
-		return current_md5, current_size
-	else:
+	try:
+		stat = filepath.stat()
+	except FileNotFoundError:
 		return "", 0
 
+	if stat_cache is not None and not deep and (cached_md5 := stat_cache.get(cache_key, stat)):
+		return cached_md5, stat.st_size
+	current_md5 = await calc_md5hash(filepath, hasher)
+	if stat_cache is not None:
+		stat_cache.add(cache_key, stat, current_md5)
+	return current_md5, stat.st_size
+
 
-async def hashrow_from_file(assetbasepath: Path, filepath: Path) -> HashRow:
+def get_expected_filedata(
+	filepath: Path, expected_hashes: HashTable, stat_cache: StatCache | None = None, cache_key: str = ""
+) -> tuple[str, int]:
+	"""
+	Return the MD5 hash and size of a file without reading it, for checks that only compare sizes.
+
+	The hash is taken from ``stat_cache`` if the file is unchanged since it was recorded. Otherwise
+	the expected hash is assumed if the size matches the expected size, files of another size get
+	an empty hash.
+
+	Args:
+		filepath: Path to the file
+		expected_hashes: The hashes the files are compared to
+		stat_cache: Cache of the hashes of the files in the client directory
+		cache_key: Path of the file in the cache and in ``expected_hashes``, relative to ``AssetBundles``
+
+	Returns:
+		tuple[str, int]: ``(md5_hex, size_in_bytes)``, or ``("", 0)`` if the file is absent
+	"""
+	try:
+		stat = filepath.stat()
+	except FileNotFoundError:
+		return "", 0
+
+	if stat_cache is not None and (cached_md5 := stat_cache.get(cache_key, stat)):
+		return cached_md5, stat.st_size
+	index = expected_hashes.find(cache_key)
+	if index is not None and expected_hashes.get_size(index) == stat.st_size:
+		return expected_hashes.get_md5hash(index), stat.st_size
+	return "", stat.st_size
+
+
+async def hashrow_from_file(
+	assetbasepath: Path,
+	filepath: Path,
+	stat_cache: StatCache | None = None,
+	deep: bool = False,
+	hasher: FileHasher | None = None,
+	expected_hashes: HashTable | None = None,
+) -> HashRow:
 	"""
 	Build a HashRow for a file using its absolute path.
 
 	Args:
 		assetbasepath: Root asset bundle directory, used to compute the relative path
 		filepath: Absolute path to the file
+		stat_cache: Cache of the hashes of the files, see :func:`get_filedata`
+		deep: Whether to calculate the hash even if the file is unchanged
+		hasher: Worker pool calculating the hash
+		expected_hashes: If set, the file isn't read but compared by size, see :func:`get_expected_filedata`
 
 	Returns:
 		HashRow: File info containing the relative path, size, and MD5 hash
 	"""
-	current_md5, current_size = await get_filedata(filepath)
 	clean_filepath = str(filepath.relative_to(assetbasepath)).replace("\\", "/")
+	if expected_hashes is not None:
+		current_md5, current_size = get_expected_filedata(filepath, expected_hashes, stat_cache, clean_filepath)
+	else:
+		current_md5, current_size = await get_filedata(filepath, stat_cache, clean_filepath, deep, hasher)
 	return HashRow(clean_filepath, current_size, current_md5)
 
 
-async def hashrow_from_relative_file(assetbasepath: Path, relative_filepath: str) -> HashRow:
+async def hashrow_from_relative_file(
+	assetbasepath: Path,
+	relative_filepath: str,
+	stat_cache: StatCache | None = None,
+	deep: bool = False,
+	hasher: FileHasher | None = None,
+	expected_hashes: HashTable | None = None,
+) -> HashRow:
 	"""
 	Build a HashRow for a file using a path relative to ``assetbasepath``.
 
 	Args:
 		assetbasepath: Root asset bundle directory
 		relative_filepath: File path relative to ``assetbasepath``
+		stat_cache: Cache of the hashes of the files, see :func:`get_filedata`
+		deep: Whether to calculate the hash even if the file is unchanged
+		hasher: Worker pool calculating the hash
+		expected_hashes: If set, the file isn't read but compared by size, see :func:`get_expected_filedata`
 
 	Returns:
 		HashRow: File info containing the relative path, size, and MD5 hash
 	"""
-	current_md5, current_size = await get_filedata(Path(assetbasepath, relative_filepath))
+	filepath = Path(assetbasepath, relative_filepath)
+	if expected_hashes is not None:
+		current_md5, current_size = get_expected_filedata(filepath, expected_hashes, stat_cache, relative_filepath)
+	else:
+		current_md5, current_size = await get_filedata(filepath, stat_cache, relative_filepath, deep, hasher)
 	return HashRow(relative_filepath, current_size, current_md5)
 
 
-async def hashrows_from_files(client_directory: Path) -> list[HashRow]:
+def hashrow_from_checkpoint(assetbasepath: Path, relative_filepath: str, checkpoint: IntegrityCheckpoint) -> HashRow | None:
 	"""
-	Compute HashRows for every file under ``{client_directory}/AssetBundles/``.
+	Build a HashRow for a file verified by a previous run of an integrity check, without reading it.
 
 	Args:
-		client_directory: Client root directory
+		assetbasepath: Root asset bundle directory
+		relative_filepath: File path relative to ``assetbasepath``
+		checkpoint: Checkpoint of the previous runs, see :meth:`IntegrityCheckpoint.get`
 
 	Returns:
-		list[HashRow]: List of hash rows
+		HashRow or None: File info with the recorded MD5 hash, or None if the file wasn't verified or has changed
+	"""
+	try:
+		stat = Path(assetbasepath, relative_filepath).stat()
+	except FileNotFoundError:
+		return
+	if md5hash := checkpoint.get(relative_filepath, stat):
+		return HashRow(relative_filepath, stat.st_size, md5hash)
+
+
+async def iterate_asset_files(assetbasepath: Path) -> AsyncIterator[str]:
+	"""
+	Walk all files under ``assetbasepath`` with :func:`os.scandir`, one directory at a time.
+	Control is returned to the event loop after each directory, so queued downloads progress
+	while the walk continues.
+
+	Args:
+		assetbasepath: Root asset bundle directory
+
+	Yields:
+		str: Path of each file relative to ``assetbasepath``, separated by "/"
 	"""
-	assetbasepath = Path(client_directory, "AssetBundles")
-	print("Loading list of all files... ", end="")
-	filepaths = [fp for fp in assetbasepath.rglob("*") if fp.is_file()]
-	tasks = [hashrow_from_file(assetbasepath, fp) for fp in filepaths]
-	print("Done.\nChecking all files...")
-	return await tqdm_asyncio.gather(*tasks, desc="File Progress", unit="files")
+	directories = [""]
+	while directories:
+		relative_directory = directories.pop()
+		try:
+			with os.scandir(Path(assetbasepath, relative_directory)) as entries:
+				for entry in entries:
+					relative_filepath = f"{relative_directory}/{entry.name}" if relative_directory else entry.name
+					if entry.is_dir(follow_symlinks=False):
+						directories.append(relative_filepath)
+					# partial downloads and their progress are resumed by the downloader and not part of the asset tree
+					elif entry.is_file() and not entry.name.endswith((".part", ".part.progress")):
+						yield relative_filepath
+		except (FileNotFoundError, NotADirectoryError):
+			pass
+		await asyncio.sleep(0)
+
+
+async def iterate_hashrows_from_files(
+	assetbasepath: Path,
+	stat_cache: StatCache | None = None,
+	deep: bool = False,
+	hasher: FileHasher | None = None,
+	expected_hashes: HashTable | None = None,
+	should_hash: Callable[[str], bool] | None = None,
+	max_pending: int = 0,
+	checkpoint: IntegrityCheckpoint | None = None,
+) -> AsyncIterator[HashRow]:
+	"""
+	Compute HashRows for every file under ``assetbasepath`` while walking it, see :func:`iterate_asset_files`.
+
+	At most ``max_pending`` files are hashed at the same time, the walk only continues once one
+	of them is done. Rows are yielded in the order their hashes complete, so memory stays flat
+	independent of the amount of files.
+
+	Files that are unchanged since their hash was recorded in ``stat_cache`` are not read,
+	unless ``deep`` is set. With ``expected_hashes``, only the files selected by ``should_hash``
+	are hashed, the other files are compared by size, see :func:`get_expected_filedata`.
+	Files verified by a previous run of the check are taken from ``checkpoint``, see :func:`hashrow_from_checkpoint`.
+
+	Args:
+		assetbasepath: Root asset bundle directory
+		stat_cache: Cache of the hashes of the files, see :func:`get_filedata`
+		deep: Whether to calculate the hashes of all files
+		hasher: Worker pool calculating the hashes
+		expected_hashes: The hashes files that are not hashed are compared to
+		should_hash: Whether a file, by its path relative to ``AssetBundles``, is hashed, all files if not set
+		max_pending: Amount of files processed at the same time, 0 for four per hasher worker
+		checkpoint: Checkpoint of previous runs of the check
+
+	Yields:
+		HashRow: Hash row of each file
+	"""
+	if max_pending <= 0:
+		max_pending = 4 * (hasher.workers if hasher is not None else os.cpu_count() or 1)
+
+	pending = set()
+	try:
+		async for relative_filepath in iterate_asset_files(assetbasepath):
+			if checkpoint is not None and (hashrow := hashrow_from_checkpoint(assetbasepath, relative_filepath, checkpoint)):
+				yield hashrow
+				continue
+
+			file_expected_hashes = None
+			if expected_hashes is not None and should_hash is not None and not should_hash(relative_filepath):
+				file_expected_hashes = expected_hashes
+			pending.add(
+				asyncio.ensure_future(
+					hashrow_from_relative_file(assetbasepath, relative_filepath, stat_cache, deep, hasher, file_expected_hashes)
+				)
+			)
+			if len(pending) >= max_pending:
+				done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+				for task in done:
+					yield task.result()
+
+		while pending:
+			done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+			for task in done:
+				yield task.result()
+	finally:
+		for task in pending:
+			task.cancel()
 
 
 async def repair(
-	downloader_session: downloader.AzurlaneAsyncDownloader, versioncontroller: VersionController
+	downloader_session: downloader.AzurlaneAsyncDownloader,
+	versioncontroller: VersionController,
+	deep: bool = False,
+	level: IntegrityLevel = IntegrityLevel.FULL,
+	sampler: IntegritySampler | None = None,
+	checkpoint: IntegrityCheckpoint | None = None,
+	time_budget: float = 0,
 ) -> list[UpdateResult]:
 	"""
-	Full integrity repair: hash all files on disk and re-download anything that
+	Full integrity repair: check all files on disk and re-download anything that
 	doesn't match the stored hash files.
 
+	The ``level`` selects how the files are checked: ``FULL`` hashes all files, files that are
+	unchanged since they were last hashed are trusted unless ``deep`` is set. ``FAST`` only compares
+	the existence and size of the files. ``SAMPLED`` hashes the files selected by ``sampler``
+	and compares the others like ``FAST``.
+
+	The files are compared to the hash files as they are walked, see :func:`iterate_hashrows_from_files`,
+	and the download of each changed file is queued immediately. Files not in any hash file are
+	deleted as they are found, files missing on disk are downloaded once the walk is complete.
+
+	The verified files are recorded in ``checkpoint``, which is saved periodically and if the
+	check is interrupted, so the next run continues from there. Once ``time_budget`` is used up,
+	the walk stops and the queued downloads are completed. Files missing on disk are only
+	downloaded by the run that completes the walk.
+
 	Args:
 		downloader_session: Active downloader session
 		versioncontroller: The version controller
+		deep: Whether to calculate the hashes of all files instead of trusting the stat cache of the session
+		level: How thoroughly the files are checked
+		sampler: Selects the hashed files of a ``SAMPLED`` check, its next round is saved afterwards
+		checkpoint: Checkpoint of previous runs of the check, continued and updated by this run
+		time_budget: Seconds after which the walk stops, 0 for no limit
 
 	Returns:
-		list[UpdateResult]: List of update results
+		list[UpdateResult]: List of update results of the downloaded files
 	"""
-	current_hashes = await hashrows_from_files(versioncontroller.client_directory)
-	expected_hashes = itertools.chain.from_iterable(
-		filter(None, [versioncontroller.load_hash_file(vtype) for vtype in VersionType])
+	assetbasepath = Path(versioncontroller.client_directory, "AssetBundles")
+	expected_hashes = HashTable.from_rows(
+		itertools.chain.from_iterable(filter(None, (versioncontroller.load_hash_file(vtype) for vtype in VersionType)))
 	)
-	comparison_results = updater.compare_hashes(current_hashes, expected_hashes)
-	update_results = await updater.update_assets(downloader_session, comparison_results, versioncontroller.client_directory)
-	return update_results
+	should_hash = None
+	if level == IntegrityLevel.FAST:
+		should_hash = lambda path: False
+		print("Comparing the size of all files...")
+	elif level == IntegrityLevel.SAMPLED and sampler is not None:
+		should_hash = sampler.is_sampled
+		# the sampled files are hashed to find changes that keep the size and modification time
+		deep = True
+		print(f"Hashing {sampler.percent:g}% of the files, comparing the size of the others...")
+	else:
+		print("Checking all files...")
+	if checkpoint is not None and checkpoint.resumed_files:
+		print(f"Continuing the previous check, {checkpoint.resumed_files} files were already verified.")
+
+	stat_cache = downloader_session.stat_cache
+	# rows of the hash files that were found on disk, the others are downloaded after the walk
+	found_rows = bytearray(len(expected_hashes))
+	if stat_cache is not None:
+		stat_cache.start_walk()
+	walked_files = 0
+	deleted_files = 0
+	complete = False
+	download_start = time.monotonic()
+	deadline = download_start + time_budget if time_budget > 0 else None
+
+	with (
+		tqdm(total=len(expected_hashes), desc="File Progress", unit="files") as file_progressbar,
+		tqdm(total=0, desc="Download Progress", unit="files") as download_progressbar,
+	):
+		download_batch = updater.create_download_batch(download_progressbar)
+
+		def queue_download(result: CompareResult):
+			updater.queue_asset_download(downloader_session, assetbasepath, result, download_batch)
+			download_progressbar.total += 1
+
+		hashrows = iterate_hashrows_from_files(
+			assetbasepath, stat_cache, deep, downloader_session.hasher, expected_hashes, should_hash, checkpoint=checkpoint
+		)
+		try:
+			async with contextlib.aclosing(hashrows):
+				async for hashrow in hashrows:
+					resumed = checkpoint is not None and hashrow.filepath in checkpoint.entries
+					walked_files += 1
+					file_progressbar.update()
+					if stat_cache is not None:
+						stat_cache.mark(hashrow.filepath)
+
+					index = expected_hashes.find(hashrow.filepath)
+					if index is None:
+						# files not in any hash file are deleted as they are found
+						updater.delete_asset_safe(Path(assetbasepath, hashrow.filepath))
+						if stat_cache is not None:
+							stat_cache.remove(hashrow.filepath)
+						deleted_files += 1
+					else:
+						found_rows[index] = 1
+						expected_hash = expected_hashes[index]
+						if hashrow != expected_hash:
+							queue_download(CompareResult(hashrow, expected_hash, CompareType.Changed))
+						elif checkpoint is not None:
+							checkpoint.record(
+								hashrow.filepath, Path(assetbasepath, hashrow.filepath), hashrow.size, hashrow.md5hash
+							)
+
+					# the budget is only checked after files verified by this run, so each run makes progress
+					if deadline is not None and not resumed and time.monotonic() >= deadline:
+						break
+				else:
+					complete = True
+		finally:
+			if checkpoint is not None and not complete:
+				checkpoint.save()
+
+		if complete:
+			for index in (i for i, found in enumerate(found_rows) if not found):
+				queue_download(CompareResult(None, expected_hashes[index], CompareType.New))
+		download_results = await download_batch.wait()
+
+	if not complete:
+		print(
+			f"Stopped after {walked_files} files, the time budget of {time_budget / 60:g} minutes is used up. "
+			"The check continues from here on the next run."
+		)
+
+	if deleted_files:
+		print(f"Deleted {deleted_files} files that are not in any hash file.")
+
+	if stat_cache is not None and complete:
+		stat_cache.remove_unmarked()
+		if level == IntegrityLevel.FULL and not deep:
+			print(f"{stat_cache.hits} of {walked_files} files are unchanged since they were last hashed.")
+
+	if download_results:
+		await updater.requeue_failed_downloads(downloader_session, assetbasepath, download_results)
+		updater.record_download_telemetry(downloader_session, download_results, time.monotonic() - download_start)
+
+	if complete:
+		if checkpoint is not None:
+			checkpoint.clear()
+		if level == IntegrityLevel.SAMPLED and sampler is not None:
+			sampler.save()
+	return download_results
 
 
 async def repair_hashfile(
@@ -127,6 +431,7 @@ async def repair_hashfile(
 	downloader_session: downloader.AzurlaneAsyncDownloader,
 	userconfig: UserConfig,
 	versioncontroller: VersionController,
+	deep: bool = False,
 ) -> list[UpdateResult]:
 	"""
 	Repair a single version type by reconciling local, disk, and server hashes.
@@ -136,6 +441,7 @@ async def repair_hashfile(
 		downloader_session: Active downloader session
 		userconfig: The user configuration
 		versioncontroller: The version controller
+		deep: Whether to calculate the hashes of all files instead of trusting the stat cache of the session
 
 	Returns:
 		list[UpdateResult]: List of update results
@@ -150,11 +456,14 @@ async def repair_hashfile(
 	# parse hashes from all files stored on disk, but only check files that are expected based on the new hashes
 	# this skips deletion on unneeded files
 	print("Generating hashes for all files on disk...")
-	diskhashes_tasks = [hashrow_from_relative_file(assetbasepath, hrow.filepath) for hrow in serverhashes]
+	diskhashes_tasks = [
+		hashrow_from_relative_file(assetbasepath, hrow.filepath, downloader_session.stat_cache, deep, downloader_session.hasher)
+		for hrow in serverhashes
+	]
 	diskhashes = await tqdm_asyncio.gather(*diskhashes_tasks, desc="File Progress", unit="files")
 
 	# compare localhashes to diskhashes to determine which files have already been successfully downloaded
-	compare_results_disk = updater.compare_hashes(localhashes, diskhashes)
+	compare_results_disk = updater.compare_hashes(localhashes, diskhashes, include_unchanged=False)
 	_COMPARE_TO_DOWNLOAD_TYPE = {
 		CompareType.Changed: (DownloadType.Success, "new_hash"),
 		CompareType.New: (DownloadType.Success, "new_hash"),
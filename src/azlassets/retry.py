@@ -0,0 +1,257 @@
+import aiohttp
+import asyncio
+import contextlib
+import random
+import time
+from collections import deque
+from enum import Enum
+
+
+class AssetIntegrityError(Exception):
+	"""Raised when a downloaded asset does not match its expected size or md5 hash."""
+
+	def __init__(self, filehash: str, message: str, *args):
+		super().__init__(message, *args)
+		self.filehash = filehash
+
+
+class ErrorKind(Enum):
+	"""
+	Classification of errors raised while downloading.
+	"""
+
+	TIMEOUT = "timeout"
+	CONNECTION = "connection"
+	SERVER_ERROR = "server error"
+	RATE_LIMITED = "rate limited"
+	NOT_FOUND = "not found"
+	CLIENT_ERROR = "client error"
+	CORRUPT = "corrupt"
+	OTHER = "other"
+
+
+RETRYABLE_ERRORS = {ErrorKind.TIMEOUT, ErrorKind.CONNECTION, ErrorKind.SERVER_ERROR, ErrorKind.RATE_LIMITED, ErrorKind.CORRUPT}
+"""Errors that can succeed when the request is repeated."""
+CONGESTION_ERRORS = {ErrorKind.TIMEOUT, ErrorKind.CONNECTION, ErrorKind.SERVER_ERROR, ErrorKind.RATE_LIMITED}
+"""Errors that indicate an overloaded connection or server."""
+UNAVAILABLE_ERRORS = {ErrorKind.TIMEOUT, ErrorKind.CONNECTION, ErrorKind.SERVER_ERROR}
+"""Errors that indicate the server is unavailable, the only failures counted by the :class:`CircuitBreaker`."""
+
+
+def classify_error(error: BaseException) -> ErrorKind:
+	"""
+	Classify an error raised while downloading.
+
+	Args:
+		error: The raised error
+
+	Returns:
+		ErrorKind: The kind of the error
+	"""
+	if isinstance(error, AssetIntegrityError):
+		return ErrorKind.CORRUPT
+	if isinstance(error, aiohttp.ClientResponseError):
+		if error.status == 404:
+			return ErrorKind.NOT_FOUND
+		if error.status == 429:
+			return ErrorKind.RATE_LIMITED
+		if error.status >= 500:
+			return ErrorKind.SERVER_ERROR
+		return ErrorKind.CLIENT_ERROR
+	if isinstance(error, TimeoutError):
+		return ErrorKind.TIMEOUT
+	if isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, ConnectionError)):
+		return ErrorKind.CONNECTION
+	return ErrorKind.OTHER
+
+
+def get_retry_after(error: BaseException) -> float | None:
+	"""
+	Return the delay in seconds requested by the ``Retry-After`` header of an error response.
+
+	Args:
+		error: The raised error
+
+	Returns:
+		float or None: The requested delay, or None if the error has no valid ``Retry-After`` header
+	"""
+	if isinstance(error, aiohttp.ClientResponseError) and error.headers:
+		try:
+			return float(error.headers.get("Retry-After", ""))
+		except ValueError:
+			return
+
+
+class RetryPolicy:
+	"""
+	Decides whether and when failed requests are repeated.
+
+	Retryable errors are repeated up to ``attempts`` times in total, waiting an exponentially
+	growing, fully jittered delay between attempts. All retries of a run share a budget, so a
+	broken connection can't multiply the amount of requests. Files that still failed are
+	queued again ``requeue_rounds`` times at the end of a run.
+	"""
+
+	def __init__(self, attempts: int, base_delay: float, max_delay: float, budget: int, requeue_rounds: int):
+		"""
+		Args:
+			attempts: Maximum amount of attempts per request
+			base_delay: Upper bound of the delay in seconds before the first retry, doubled for each further retry
+			max_delay: Upper bound of the delay in seconds between two attempts
+			budget: Maximum amount of retries in total
+			requeue_rounds: Amount of times failed files are queued again at the end of a run
+		"""
+		self.attempts = max(1, attempts)
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.budget = budget
+		self.requeue_rounds = requeue_rounds
+
+	def should_retry(self, error: BaseException, attempt: int) -> bool:
+		"""
+		Return whether a failed request should be repeated and consume one retry of the budget if so.
+
+		Args:
+			error: The error raised by the request
+			attempt: Index of the failed attempt, starting at 0
+
+		Returns:
+			bool: True if the request should be repeated
+		"""
+		if classify_error(error) not in RETRYABLE_ERRORS or attempt + 1 >= self.attempts:
+			return False
+		if self.budget <= 0:
+			if self.budget == 0:
+				print("WARN: The retry budget of this run is exhausted, failed requests will not be repeated anymore.")
+				self.budget -= 1
+			return False
+		self.budget -= 1
+		return True
+
+	def get_delay(self, error: BaseException, attempt: int) -> float:
+		"""
+		Return the delay before the next attempt.
+
+		Args:
+			error: The error raised by the request
+			attempt: Index of the failed attempt, starting at 0
+
+		Returns:
+			float: Delay in seconds
+		"""
+		if (retry_after := get_retry_after(error)) is not None:
+			return min(retry_after, self.max_delay)
+		return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+	async def wait(self, error: BaseException, attempt: int):
+		"""
+		Sleep for the delay before the next attempt.
+
+		Args:
+			error: The error raised by the request
+			attempt: Index of the failed attempt, starting at 0
+		"""
+		await asyncio.sleep(self.get_delay(error, attempt))
+
+
+class CircuitBreaker:
+	"""
+	Pauses requests for a while once too many of the recent requests failed.
+
+	The outcomes of the last ``window`` requests are tracked. When the share of failures reaches
+	``error_threshold``, the breaker opens and requests wait for ``cooldown`` seconds. Afterwards
+	a single probe request is let through while the others keep waiting: if it succeeds, the
+	breaker closes again with an empty window, otherwise it opens for another cooldown.
+	Only connection errors, timeouts and 5xx responses are counted as failures. Other errors,
+	e.g. a 404 or a corrupt response for a single asset, show the server is available.
+	"""
+
+	def __init__(self, window: int, error_threshold: float, cooldown: float):
+		"""
+		Args:
+			window: Amount of recent requests the error rate is calculated over
+			error_threshold: Share of failed requests that opens the breaker, between 0 and 1
+			cooldown: Time in seconds requests wait for after the breaker opened
+		"""
+		self.window = window
+		self.error_threshold = error_threshold
+		self.cooldown = cooldown
+		self._outcomes: deque[bool] = deque(maxlen=window)
+		self._opened_at: float | None = None
+		self._probe_started_at: float | None = None
+		self._probe_finished = asyncio.Event()
+
+	@property
+	def is_open(self) -> bool:
+		"""Whether requests are currently waiting for the end of the cooldown or the outcome of a probe."""
+		return self._opened_at is not None
+
+	async def wait(self):
+		"""
+		Wait until a request may be sent. Returns immediately while the breaker is closed.
+		"""
+		while self._opened_at is not None:
+			remaining = self._opened_at + self.cooldown - time.monotonic()
+			if remaining > 0:
+				await asyncio.sleep(remaining)
+				continue
+			# a probe that didn't report its outcome within a cooldown is replaced by a new one
+			if self._probe_started_at is not None and time.monotonic() - self._probe_started_at < self.cooldown:
+				with contextlib.suppress(TimeoutError):
+					await asyncio.wait_for(self._probe_finished.wait(), self.cooldown)
+				continue
+			self._probe_started_at = time.monotonic()
+			self._probe_finished.clear()
+			return
+
+	def _close(self):
+		if self._opened_at is None:
+			return
+		print("Requests succeed again, downloads are resumed.")
+		self._opened_at = None
+		self._probe_started_at = None
+		self._outcomes.clear()
+		self._probe_finished.set()
+
+	def _open(self, message: str):
+		print(f"WARN: {message} Downloads are paused for {self.cooldown} seconds.")
+		self._opened_at = time.monotonic()
+		self._probe_started_at = None
+		self._outcomes.clear()
+		self._probe_finished.set()
+
+	def record_success(self):
+		"""
+		Report a successful request, closing the breaker if it was a probe.
+		"""
+		if self._probe_started_at is not None:
+			self._close()
+		self._outcomes.append(True)
+
+	def record_failure(self, error: BaseException):
+		"""
+		Report a failed request, opening the breaker if the error rate reaches the threshold or a probe failed.
+		Errors that are not in ``UNAVAILABLE_ERRORS`` are not counted.
+
+		Args:
+			error: The error raised by the request
+		"""
+		error_kind = classify_error(error)
+		if error_kind not in UNAVAILABLE_ERRORS:
+			# a response from the server is all a probe has to show
+			if self._probe_started_at is not None and error_kind != ErrorKind.OTHER:
+				self._close()
+			return
+		if self._probe_started_at is not None:
+			self._open("The probe request after the cooldown failed.")
+			return
+		if self._opened_at is not None:
+			# requests sent before the breaker opened
+			return
+		self._outcomes.append(False)
+		if len(self._outcomes) < self.window:
+			return
+
+		failures = self._outcomes.count(False)
+		if failures / self.window >= self.error_threshold:
+			self._open(f"{failures} of the last {self.window} requests failed.")
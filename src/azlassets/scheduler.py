@@ -0,0 +1,216 @@
+import asyncio
+import itertools
+from collections.abc import Awaitable, Callable, Iterable
+from enum import Enum
+from typing import Generic, TypeVar
+
+from .classes import HashRow
+
+T = TypeVar("T")
+
+
+class DownloadOrder(Enum):
+	"""
+	Order in which queued files are downloaded.
+	"""
+
+	HASHFILE = "hashfile"
+	"""Order of the server hash file."""
+	LARGEST_FIRST = "largest-first"
+	"""Largest files first, avoids a long tail of large downloads at the end."""
+	SMALLEST_FIRST = "smallest-first"
+	"""Smallest files first, completes as many files as possible early."""
+
+
+class JobBatch(Generic[T]):
+	"""
+	Group of jobs submitted to a :class:`DownloadScheduler` whose results are awaited together.
+
+	The results are stored in a list in the order the jobs were submitted, so a queued job only
+	takes a slot in that list instead of a future of its own. If a job fails or the batch is
+	cancelled, the jobs of the batch that are still queued are skipped.
+	"""
+
+	def __init__(self, on_done: Callable[[], None] | None = None):
+		"""
+		Args:
+			on_done: Called whenever a job of the batch completed
+		"""
+		self.on_done = on_done
+		self.results: list[T | None] = []
+		self._pending = 0
+		self._done = asyncio.Event()
+		self._done.set()
+		self._error: BaseException | None = None
+
+	@property
+	def cancelled(self) -> bool:
+		"""Whether the batch failed or was cancelled, its queued jobs are skipped."""
+		return self._error is not None
+
+	def _add(self) -> int:
+		self.results.append(None)
+		self._pending += 1
+		self._done.clear()
+		return len(self.results) - 1
+
+	def _set_result(self, index: int, result: T):
+		self.results[index] = result
+		self._pending -= 1
+		if self.on_done:
+			self.on_done()
+		if self._pending == 0:
+			self._done.set()
+
+	def _set_exception(self, error: BaseException):
+		if self._error is None:
+			self._error = error
+		self._done.set()
+
+	def cancel(self):
+		"""
+		Skip the jobs of the batch that are still queued.
+		"""
+		self._set_exception(asyncio.CancelledError())
+
+	async def wait(self) -> list[T]:
+		"""
+		Wait until all jobs of the batch completed.
+
+		Raises:
+			Exception: The error of the first failed job, the remaining jobs are skipped
+			asyncio.CancelledError: If the batch was cancelled
+
+		Returns:
+			list[T]: The results of the jobs, in the order they were submitted
+		"""
+		try:
+			await self._done.wait()
+		except asyncio.CancelledError:
+			self.cancel()
+			raise
+		if self._error is not None:
+			raise self._error
+		return self.results  # pyright: ignore [reportReturnType]
+
+
+class DownloadScheduler:
+	"""
+	Fixed pool of workers executing download jobs taken from priority queues.
+
+	Jobs are submitted together with the :class:`HashRow` of the file they download, which
+	determines their priority: files inside one of the ``priority_folders`` come first, after
+	that files are ordered by ``order``. Files larger than ``large_file_size`` are processed by
+	a separate, smaller pool of workers, so they can't occupy all workers at once.
+
+	The results of the jobs are collected in a :class:`JobBatch` per caller, so multiple updates
+	can share the scheduler. Workers are started on the first submitted job and stopped by
+	:meth:`close`.
+	"""
+
+	def __init__(
+		self,
+		workers: int,
+		large_file_workers: int,
+		large_file_size: int,
+		order: DownloadOrder = DownloadOrder.LARGEST_FIRST,
+		priority_folders: Iterable[str] = (),
+	):
+		"""
+		Args:
+			workers: Amount of workers for regular files
+			large_file_workers: Amount of workers for large files
+			large_file_size: Files larger than this size in bytes are considered large
+			order: Order of files within the same priority tier
+			priority_folders: Folders whose files are downloaded before all other files
+		"""
+		self.workers = workers
+		self.large_file_workers = large_file_workers
+		self.large_file_size = large_file_size
+		self.order = order
+		self.priority_folders = [folder.strip("/") for folder in priority_folders]
+
+		self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+		self._large_file_queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+		self._sequence = itertools.count()
+		self._worker_tasks: list[asyncio.Task] = []
+
+	def is_priority_file(self, hashrow: HashRow) -> bool:
+		"""
+		Return whether a file is inside one of the priority folders.
+
+		Args:
+			hashrow: Hash row of the file
+
+		Returns:
+			bool: True if the file is inside a priority folder
+		"""
+		return any(hashrow.filepath.startswith(folder + "/") for folder in self.priority_folders)
+
+	def get_priority(self, hashrow: HashRow) -> tuple[int, int]:
+		"""
+		Return the queue priority of a file, lower values are processed first.
+
+		Args:
+			hashrow: Hash row of the file
+
+		Returns:
+			tuple[int, int]: The priority tier and the order within the tier
+		"""
+		tier = 0 if self.is_priority_file(hashrow) else 1
+		if self.order == DownloadOrder.LARGEST_FIRST:
+			return tier, -hashrow.size
+		if self.order == DownloadOrder.SMALLEST_FIRST:
+			return tier, hashrow.size
+		return tier, 0
+
+	def submit(self, hashrow: HashRow, job: Callable[[], Awaitable[T]], batch: JobBatch[T]):
+		"""
+		Queue a download job, its result is stored in ``batch``.
+
+		Args:
+			hashrow: Hash row of the file downloaded by the job
+			job: Function creating the coroutine of the job once a worker is available
+			batch: Batch collecting the result of the job
+		"""
+		self._start_workers()
+		queue = self._large_file_queue if hashrow.size > self.large_file_size else self._queue
+		queue.put_nowait((self.get_priority(hashrow), next(self._sequence), job, batch, batch._add()))
+
+	def _start_workers(self):
+		if self._worker_tasks:
+			return
+		for _ in range(self.workers):
+			self._worker_tasks.append(asyncio.create_task(self._worker(self._queue)))
+		for _ in range(self.large_file_workers):
+			self._worker_tasks.append(asyncio.create_task(self._worker(self._large_file_queue)))
+
+	async def _worker(self, queue: asyncio.PriorityQueue):
+		while True:
+			_, _, job, batch, index = await queue.get()
+			try:
+				if batch.cancelled:
+					continue
+				batch._set_result(index, await job())
+			except (asyncio.CancelledError, KeyboardInterrupt, SystemExit) as e:
+				batch._set_exception(e)
+				raise
+			except Exception as e:  # noqa: BLE001
+				# the error is raised by JobBatch.wait, the worker continues with the next job
+				batch._set_exception(e)
+			finally:
+				queue.task_done()
+
+	async def close(self):
+		"""
+		Stop all workers. The batches of jobs that are still queued are cancelled.
+		"""
+		for task in self._worker_tasks:
+			task.cancel()
+		await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+		self._worker_tasks.clear()
+
+		for queue in (self._queue, self._large_file_queue):
+			while not queue.empty():
+				_, _, _, batch, _ = queue.get_nowait()
+				batch.cancel()
@@ -0,0 +1,333 @@
+import asyncio
+import hashlib
+import random
+from aiohttp import web
+from dataclasses import dataclass
+
+from . import protobuf
+from .classes import HashRow
+from .versioncontrol import VersionType
+
+# file content is cut from a repeated random block, so the corpus doesn't have to be kept in memory
+CONTENT_BLOCK_SIZE = 1_048_576
+CONTENT_HEADER_SIZE = 16
+STREAM_CHUNK_SIZE = 65_536
+
+# share of files and range of file sizes in bytes, modelled after the distribution of the game assets
+FILE_SIZE_DISTRIBUTION = (
+	(0.50, 1_024, 16_384),
+	(0.35, 16_384, 131_072),
+	(0.14, 131_072, 4_194_304),
+	(0.01, 4_194_304, 33_554_432),
+)
+# share of files per version type
+VERSION_TYPE_DISTRIBUTION = ((VersionType.AZL, 0.8), (VersionType.CV, 0.1), (VersionType.PIC, 0.1))
+
+
+@dataclass
+class SimulatorConfig:
+	"""
+	Settings of the simulated game servers.
+	"""
+
+	files: int = 2000
+	"""Amount of asset files in the corpus."""
+	seed: int = 0
+	"""Seed of the generated corpus, the same seed always generates the same files."""
+	latency: float = 0.02
+	"""Delay in seconds before a response is sent."""
+	bandwidth: int = 0
+	"""Bytes per second sent per response, 0 for unlimited."""
+	error_rate: float = 0.0
+	"""Share of asset requests that are answered with 500."""
+	missing_rate: float = 0.0
+	"""Share of files that are listed in the hash files, but answered with 404."""
+	host: str = "127.0.0.1"
+	cdn_port: int = 8080
+	gate_port: int = 8081
+
+
+@dataclass(frozen=True)
+class SimulatedFile:
+	"""
+	A file of the simulated corpus, its content is generated from ``index`` on request.
+	"""
+
+	index: int
+	size: int
+	offset: int
+
+
+class SimulatedCorpus:
+	"""
+	Deterministic synthetic asset corpus with hash files for multiple version types.
+	"""
+
+	def __init__(self, files: int, seed: int = 0, missing_rate: float = 0.0):
+		"""
+		Args:
+			files: Amount of asset files
+			seed: Seed of the random generator
+			missing_rate: Share of files that are marked as missing on the server
+		"""
+		rng = random.Random(seed)
+		self._block = rng.randbytes(CONTENT_BLOCK_SIZE) * 2
+		self.files: dict[str, SimulatedFile] = {}
+		self.missing: set[str] = set()
+		self.hashfiles: dict[VersionType, list[HashRow]] = {version_type: [] for version_type, _ in VERSION_TYPE_DISTRIBUTION}
+
+		version_types, version_type_weights = zip(*VERSION_TYPE_DISTRIBUTION)
+		size_weights = [share for share, _, _ in FILE_SIZE_DISTRIBUTION]
+		for index in range(files):
+			_, min_size, max_size = rng.choices(FILE_SIZE_DISTRIBUTION, size_weights)[0]
+			simulated_file = SimulatedFile(index, rng.randint(min_size, max_size), rng.randrange(CONTENT_BLOCK_SIZE))
+			md5hash = hashlib.md5(self.get_content(simulated_file)).hexdigest()
+			self.files[md5hash] = simulated_file
+			if rng.random() < missing_rate:
+				self.missing.add(md5hash)
+
+			version_type = rng.choices(version_types, version_type_weights)[0]
+			filepath = f"{version_type.name.lower()}/folder{index % 50}/file{index}"
+			self.hashfiles[version_type].append(HashRow(filepath, simulated_file.size, md5hash))
+
+	def get_content(self, simulated_file: SimulatedFile) -> bytes:
+		"""
+		Generate the content of a file.
+
+		Args:
+			simulated_file: The file
+
+		Returns:
+			bytes: The content of the file
+		"""
+		header = simulated_file.index.to_bytes(CONTENT_HEADER_SIZE, "big")
+		remaining = simulated_file.size - CONTENT_HEADER_SIZE
+		parts = [header]
+		offset = simulated_file.offset
+		while remaining > 0:
+			part = self._block[offset : offset + min(remaining, CONTENT_BLOCK_SIZE)]
+			parts.append(part)
+			remaining -= len(part)
+			offset = 0
+		return b"".join(parts)[: simulated_file.size]
+
+	def get_version_string(self, version_type: VersionType) -> str:
+		"""
+		Return the version string of a version type, as sent by the gate server.
+
+		Args:
+			version_type: The version type
+
+		Returns:
+			str: The version string
+		"""
+		vhash = f"simulated{version_type.suffix}"
+		if version_type == VersionType.AZL:
+			return f"${version_type.hashname}$1$0$0${vhash}"
+		return f"${version_type.hashname}$1${vhash}"
+
+	def get_version_strings(self) -> list[str]:
+		"""
+		Return the version strings of all version types.
+
+		Returns:
+			list[str]: The version strings
+		"""
+		return [self.get_version_string(version_type) for version_type in self.hashfiles]
+
+	def get_hashfile(self, version_type: VersionType) -> str:
+		"""
+		Return the hash file of a version type.
+
+		Args:
+			version_type: The version type
+
+		Returns:
+			str: The hash file in the format of the game server
+		"""
+		return "\n".join(f"{row.filepath},{row.size},{row.md5hash}" for row in self.hashfiles[version_type])
+
+
+class Simulator:
+	"""
+	Local stand-in for the gate server and the CDN of a game client.
+
+	The CDN serves ``/android/hash/<raw>`` and ``/android/resource/<md5>`` of a
+	:class:`SimulatedCorpus` with configurable latency, bandwidth and injected errors, and
+	supports ``Range`` requests. The gate server answers command 10800 with the version
+	strings of the corpus.
+	"""
+
+	def __init__(self, simulator_config: SimulatorConfig):
+		"""
+		Args:
+			simulator_config: Settings of the simulator
+		"""
+		self.config = simulator_config
+		self.corpus = SimulatedCorpus(simulator_config.files, simulator_config.seed, simulator_config.missing_rate)
+		self.requests = 0
+		self._rng = random.Random(simulator_config.seed)
+		self._hashfiles = {
+			self.corpus.get_version_string(version_type): self.corpus.get_hashfile(version_type)
+			for version_type in self.corpus.hashfiles
+		}
+		self._runner: web.AppRunner | None = None
+		self._gate_server: asyncio.Server | None = None
+
+	@property
+	def cdn_url(self) -> str:
+		"""Base url of the simulated CDN."""
+		return f"http://{self.config.host}:{self.config.cdn_port}"
+
+	async def start(self):
+		"""
+		Start the simulated CDN and gate server.
+		"""
+		app = web.Application()
+		app.router.add_get("/android/hash/{raw}", self.handle_hashes)
+		app.router.add_get("/android/resource/{md5hash}", self.handle_resource)
+		self._runner = web.AppRunner(app, access_log=None)
+		await self._runner.setup()
+		await web.TCPSite(self._runner, self.config.host, self.config.cdn_port).start()
+		self._gate_server = await asyncio.start_server(self.handle_gate, self.config.host, self.config.gate_port)
+
+	async def close(self):
+		"""
+		Stop the simulated CDN and gate server.
+		"""
+		if self._gate_server:
+			self._gate_server.close()
+			await self._gate_server.wait_closed()
+		if self._runner:
+			await self._runner.cleanup()
+
+	async def __aenter__(self) -> "Simulator":
+		await self.start()
+		return self
+
+	async def __aexit__(self, *_):
+		await self.close()
+
+	async def handle_gate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		try:
+			header = await reader.readexactly(protobuf.ADV_HEADER_LEN)
+			payload_size, command_id, index = protobuf.deserialize_header(header)
+			await reader.readexactly(payload_size)
+			if command_id != 10800:
+				return
+
+			command = protobuf.BasicCommand(10801, index)
+			command.pb.gateway_ip = self.config.host
+			command.pb.gateway_port = self.config.gate_port
+			command.pb.url = self.cdn_url
+			command.pb.is_ts = 0
+			command.pb.timestamp = 0
+			command.pb.monday_0oclock_timestamp = 0
+			command.pb.version.extend(self.corpus.get_version_strings())
+			writer.write(protobuf.serialize_pb(command))
+			await writer.drain()
+		except (asyncio.IncompleteReadError, ConnectionError, protobuf.InvalidHeaderError):
+			pass
+		finally:
+			writer.close()
+
+	async def handle_hashes(self, request: web.Request) -> web.Response:
+		await asyncio.sleep(self.config.latency)
+		hashfile = self._hashfiles.get(request.match_info["raw"])
+		if hashfile is None:
+			raise web.HTTPNotFound()
+		return web.Response(text=hashfile)
+
+	async def handle_resource(self, request: web.Request) -> web.StreamResponse:
+		self.requests += 1
+		await asyncio.sleep(self.config.latency)
+
+		md5hash = request.match_info["md5hash"]
+		simulated_file = self.corpus.files.get(md5hash)
+		if simulated_file is None or md5hash in self.corpus.missing:
+			raise web.HTTPNotFound()
+		if self._rng.random() < self.config.error_rate:
+			raise web.HTTPInternalServerError()
+
+		content = self.corpus.get_content(simulated_file)
+		status = 200
+		headers = {"Accept-Ranges": "bytes"}
+		if range_header := request.headers.get("Range"):
+			try:
+				start, end = parse_range(range_header, len(content))
+			except ValueError:
+				raise web.HTTPRequestRangeNotSatisfiable()
+			headers["Content-Range"] = f"bytes {start}-{end - 1}/{len(content)}"
+			content = content[start:end]
+			status = 206
+		headers["Content-Length"] = str(len(content))
+
+		response = web.StreamResponse(status=status, headers=headers)
+		await response.prepare(request)
+		for chunk_start in range(0, len(content), STREAM_CHUNK_SIZE):
+			chunk = content[chunk_start : chunk_start + STREAM_CHUNK_SIZE]
+			await response.write(chunk)
+			if self.config.bandwidth > 0:
+				await asyncio.sleep(len(chunk) / self.config.bandwidth)
+		await response.write_eof()
+		return response
+
+
+def parse_range(range_header: str, size: int) -> tuple[int, int]:
+	"""
+	Parse a single ``bytes=start-end`` range of a ``Range`` header.
+
+	Args:
+		range_header: Value of the ``Range`` header
+		size: Size of the requested file
+
+	Raises:
+		ValueError: If the range is malformed or not satisfiable
+
+	Returns:
+		tuple[int, int]: Start and end (exclusive) of the range
+	"""
+	unit, _, byte_range = range_header.partition("=")
+	start_string, _, end_string = byte_range.partition("-")
+	if unit != "bytes" or not start_string:
+		raise ValueError(f"Unsupported range '{range_header}'.")
+	start = int(start_string)
+	end = min(int(end_string) + 1, size) if end_string else size
+	if start >= end:
+		raise ValueError(f"Range '{range_header}' is not satisfiable.")
+	return start, end
+
+
+async def run(simulator_config: SimulatorConfig):
+	"""
+	Run the simulator until it is cancelled.
+
+	Args:
+		simulator_config: Settings of the simulator
+	"""
+	async with Simulator(simulator_config) as simulator:
+		total_size = sum(simulated_file.size for simulated_file in simulator.corpus.files.values())
+		print(f"Simulating {len(simulator.corpus.files)} files ({total_size / 1_048_576:.1f} MB).")
+		print(f"CDN: {simulator.cdn_url}, gate: {simulator_config.host}:{simulator_config.gate_port}")
+		print("Add the following to a client in the clients section of the user config to download it from the simulator:")
+		print(
+			f'  server: {{gateip: {simulator_config.host}, gateport: {simulator_config.gate_port}, cdnurl: "{simulator.cdn_url}"}}'
+		)
+		await asyncio.Event().wait()
+
+
+def execute_from_args(args):
+	simulator_config = SimulatorConfig(
+		files=args.files,
+		seed=args.seed,
+		latency=args.latency,
+		bandwidth=args.bandwidth,
+		error_rate=args.error_rate,
+		missing_rate=args.missing_rate,
+		cdn_port=args.cdn_port,
+		gate_port=args.gate_port,
+	)
+	try:
+		asyncio.run(run(simulator_config))
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,154 @@
+import json
+import os
+from pathlib import Path
+
+
+class StatCache:
+	"""
+	Persistent record of the md5 hashes of the files in a client directory, keyed by their path
+	relative to ``AssetBundles``.
+
+	Each entry is stored with the inode, size and modification time of the file when it was
+	hashed or written. As long as the file still has the same inode, size and modification time,
+	it is assumed to be unchanged and its hash doesn't have to be calculated again.
+
+	Entries of removed files are pruned after a walk of all files: each walk gets a new generation,
+	which is stored in the entries of the files it finds, see :meth:`start_walk`.
+	"""
+
+	def __init__(self, filepath: Path, entries: dict[str, list] | None = None):
+		"""
+		Args:
+			filepath: Path of the JSON file the cache is saved to
+			entries: Mapping of paths to their ``[inode, size, mtime_ns, md5hash, generation]``,
+				the generation of the last walk that found the file is optional
+		"""
+		self.filepath = filepath
+		self.entries = entries or {}
+		self.hits = 0
+		"""Amount of lookups that returned a hash."""
+		self._changed = False
+		self._generation = 0
+
+	@staticmethod
+	def load(filepath: Path) -> "StatCache":
+		"""
+		Load a stat cache from file. Returns an empty cache if the file does not exist or is invalid.
+
+		Args:
+			filepath: Path of the JSON file
+
+		Returns:
+			StatCache: The loaded cache
+		"""
+		try:
+			with filepath.open("r", encoding="utf8") as f:
+				entries = json.load(f)
+		except FileNotFoundError:
+			entries = {}
+		except ValueError:
+			print(f"WARN: Stat cache '{filepath}' is invalid, all files will be hashed again.")
+			entries = {}
+		return StatCache(filepath, entries)
+
+	def save(self):
+		"""
+		Save the cache to its file, if it has changed since it was loaded.
+		"""
+		if not self._changed:
+			return
+		self.filepath.parent.mkdir(parents=True, exist_ok=True)
+		temporary_filepath = self.filepath.with_name(self.filepath.name + ".tmp")
+		with temporary_filepath.open("w", encoding="utf8") as f:
+			json.dump(self.entries, f)
+		temporary_filepath.replace(self.filepath)
+		self._changed = False
+
+	def get(self, path: str, stat: os.stat_result) -> str | None:
+		"""
+		Return the md5 hash of a file, if the file is unchanged since it was recorded.
+
+		Args:
+			path: Path of the file relative to ``AssetBundles``
+			stat: Current stat of the file
+
+		Returns:
+			str or None: The md5 hash, or None if the file isn't recorded or has changed
+		"""
+		entry = self.entries.get(path)
+		if entry is None:
+			return
+		inode, size, mtime_ns, md5hash, *_ = entry
+		if inode != stat.st_ino or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+			return
+		self.hits += 1
+		return md5hash
+
+	def add(self, path: str, stat: os.stat_result, md5hash: str):
+		"""
+		Record the md5 hash of a file.
+
+		Args:
+			path: Path of the file relative to ``AssetBundles``
+			stat: Stat of the file the hash was calculated of
+			md5hash: The md5 hash of the file
+		"""
+		self.entries[path] = [stat.st_ino, stat.st_size, stat.st_mtime_ns, md5hash, self._generation]
+		self._changed = True
+
+	def record(self, path: str, filepath: Path, md5hash: str):
+		"""
+		Record the md5 hash of a file that was just written, e.g. after its download was verified.
+
+		Args:
+			path: Path of the file relative to ``AssetBundles``
+			filepath: Full path of the file
+			md5hash: The md5 hash of the file
+		"""
+		try:
+			self.add(path, filepath.stat(), md5hash)
+		except FileNotFoundError:
+			self.remove(path)
+
+	def remove(self, path: str):
+		"""
+		Remove a file from the cache, if it is present.
+
+		Args:
+			path: Path of the file relative to ``AssetBundles``
+		"""
+		if self.entries.pop(path, None) is not None:
+			self._changed = True
+
+	def start_walk(self):
+		"""
+		Start a new generation for a walk of all files. Files found by the walk are marked with
+		:meth:`mark`, files hashed or written during the walk are marked by :meth:`add`, and
+		:meth:`remove_unmarked` removes the other files once the walk is complete.
+		"""
+		self._generation = 1 + max((entry[4] for entry in self.entries.values() if len(entry) > 4), default=0)
+
+	def mark(self, path: str):
+		"""
+		Mark a file as found by the current walk, see :meth:`start_walk`.
+
+		Args:
+			path: Path of the file relative to ``AssetBundles``
+		"""
+		entry = self.entries.get(path)
+		if entry is None:
+			return
+		if len(entry) > 4:
+			entry[4] = self._generation
+		else:
+			entry.append(self._generation)
+
+	def remove_unmarked(self):
+		"""
+		Remove all files from the cache that were not found by the current walk, see :meth:`start_walk`.
+		"""
+		removed_paths = [path for path, entry in self.entries.items() if len(entry) <= 4 or entry[4] != self._generation]
+		for path in removed_paths:
+			del self.entries[path]
+		if removed_paths:
+			self._changed = True
@@ -0,0 +1,306 @@
+import json
+import time
+from bisect import bisect_left
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+# upper bounds of the histogram buckets
+TTFB_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TRANSFER_TIME_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FILE_SIZE_BUCKETS = (16_384, 131_072, 1_048_576, 4_194_304, 16_777_216, 67_108_864, 268_435_456)
+
+
+class Histogram:
+	"""
+	Histogram with fixed buckets, following the Prometheus histogram semantics.
+	"""
+
+	def __init__(self, buckets: tuple[float, ...]):
+		"""
+		Args:
+			buckets: Sorted upper bounds of the buckets, an implicit ``+Inf`` bucket is added
+		"""
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value: float):
+		"""
+		Add a value to the histogram.
+
+		Args:
+			value: The observed value
+		"""
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	def cumulative_counts(self) -> list[tuple[str, int]]:
+		"""
+		Return the cumulative amount of values per bucket.
+
+		Returns:
+			list[tuple[str, int]]: Pairs of the upper bound as string and the amount of values less or equal to it
+		"""
+		bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+		cumulative = []
+		total = 0
+		for bound, count in zip(bounds, self.counts):
+			total += count
+			cumulative.append((bound, total))
+		return cumulative
+
+	def to_dict(self) -> dict:
+		return {"buckets": dict(self.cumulative_counts()), "sum": self.sum, "count": self.count}
+
+
+@dataclass
+class FileRecord:
+	"""
+	Measurements of the download of a single asset file.
+
+	``ttfb`` and ``transfer_time`` refer to the last attempt: the time from sending the request
+	to receiving the response headers, and from there to the completed download.
+	"""
+
+	filehash: str
+	size: int
+	attempts: int = 0
+	status: int | None = None
+	error: str | None = None
+	received_bytes: int = 0
+	ttfb: float | None = None
+	transfer_time: float | None = None
+	_attempt_start: float = field(default=0.0, repr=False)
+	_first_response: float | None = field(default=None, repr=False)
+
+	def start_attempt(self):
+		"""
+		Mark the start of a download attempt.
+		"""
+		self.attempts += 1
+		self.ttfb = None
+		self.transfer_time = None
+		self._attempt_start = time.monotonic()
+		self._first_response = None
+
+	def response_received(self, status: int):
+		"""
+		Mark the arrival of the response headers of the current attempt. Only the first response
+		of an attempt is timed, later ones belong to further segments of the same file.
+
+		Args:
+			status: HTTP status code of the response
+		"""
+		self.status = status
+		if self._first_response is None:
+			self._first_response = time.monotonic()
+			self.ttfb = self._first_response - self._attempt_start
+
+	def to_dict(self) -> dict:
+		return {key: value for key, value in asdict(self).items() if not key.startswith("_")}
+
+
+@dataclass
+class UpdateRecord:
+	"""
+	Summary of the downloads of a single version type update.
+	"""
+
+	label: str
+	files: int
+	failed_files: int
+	duration: float
+
+
+class DownloadTelemetry:
+	"""
+	Collects measurements of all asset downloads of a downloader session.
+
+	The measurements are aggregated into histograms and counters and can be exported as JSON
+	and as a Prometheus textfile for the node exporter textfile collector.
+	"""
+
+	def __init__(self):
+		self.started_at = time.time()
+		self.files: list[FileRecord] = []
+		self.updates: list[UpdateRecord] = []
+		self.ttfb = Histogram(TTFB_BUCKETS)
+		self.transfer_time = Histogram(TRANSFER_TIME_BUCKETS)
+		self.file_size = Histogram(FILE_SIZE_BUCKETS)
+		self.status_codes: dict[str, int] = {}
+		self.errors: dict[str, int] = {}
+		self.retries = 0
+		self.received_bytes = 0
+
+	def start_file(self, filehash: str, size: int) -> FileRecord:
+		"""
+		Create the record of a file download.
+
+		Args:
+			filehash: The md5 hash identifying the asset
+			size: Expected size of the file in bytes
+
+		Returns:
+			FileRecord: The record, updated during the download and passed to :meth:`finish_file`
+		"""
+		return FileRecord(filehash, size)
+
+	def finish_file(self, record: FileRecord, received_bytes: int = 0, error: str | None = None):
+		"""
+		Add the record of a finished file download to the measurements.
+
+		Args:
+			record: The record created by :meth:`start_file`
+			received_bytes: Amount of bytes received by the last attempt
+			error: Kind of the error of the last attempt, None if the download succeeded
+		"""
+		if record._first_response is not None:
+			record.transfer_time = time.monotonic() - record._first_response
+		record.received_bytes = received_bytes
+		record.error = error
+		self.files.append(record)
+
+		self.retries += max(0, record.attempts - 1)
+		self.received_bytes += received_bytes
+		if record.status is not None:
+			self.status_codes[str(record.status)] = self.status_codes.get(str(record.status), 0) + 1
+		if error is not None:
+			self.errors[error] = self.errors.get(error, 0) + 1
+			return
+
+		self.file_size.observe(record.size)
+		if record.ttfb is not None:
+			self.ttfb.observe(record.ttfb)
+		if record.transfer_time is not None:
+			self.transfer_time.observe(record.transfer_time)
+
+	def record_update(self, label: str, files: int, failed_files: int, duration: float):
+		"""
+		Add the summary of the downloads of a version type update.
+
+		Args:
+			label: Label of the update, e.g. the version type
+			files: Amount of files that were downloaded
+			failed_files: Amount of files that failed to download
+			duration: Time in seconds the downloads took
+		"""
+		self.updates.append(UpdateRecord(label, files, failed_files, duration))
+
+	def get_summary(self) -> dict:
+		"""
+		Return the run summary with aggregated histograms and counters.
+
+		Returns:
+			dict: The summary
+		"""
+		failed_files = sum(1 for record in self.files if record.error is not None)
+		return {
+			"started_at": self.started_at,
+			"duration": time.time() - self.started_at,
+			"files": len(self.files) - failed_files,
+			"failed_files": failed_files,
+			"received_bytes": self.received_bytes,
+			"retries": self.retries,
+			"status_codes": self.status_codes,
+			"errors": self.errors,
+			"histograms": {
+				"ttfb_seconds": self.ttfb.to_dict(),
+				"transfer_time_seconds": self.transfer_time.to_dict(),
+				"file_size_bytes": self.file_size.to_dict(),
+			},
+		}
+
+	def write_json(self, filepath: Path):
+		"""
+		Write the run summary, the update summaries and all file records to a JSON file.
+
+		Args:
+			filepath: Path of the JSON file
+		"""
+		data = {
+			"summary": self.get_summary(),
+			"updates": [asdict(update) for update in self.updates],
+			"files": [record.to_dict() for record in self.files],
+		}
+		filepath.parent.mkdir(parents=True, exist_ok=True)
+		with filepath.open("w", encoding="utf8") as f:
+			json.dump(data, f)
+
+	def write_prometheus(self, filepath: Path, labels: dict[str, str]):
+		"""
+		Write the run summary in the Prometheus text format. The file is replaced atomically,
+		so the node exporter never reads a partially written file.
+
+		Args:
+			filepath: Path of the textfile, has to end with ``.prom`` to be collected
+			labels: Labels added to all metrics, e.g. the client
+		"""
+		summary = self.get_summary()
+		lines = []
+
+		def add_metric(name: str, metric_type: str, description: str, samples: list[tuple[dict[str, str], float]]):
+			lines.append(f"# HELP {name} {description}")
+			lines.append(f"# TYPE {name} {metric_type}")
+			for sample_labels, value in samples:
+				lines.append(f"{name}{format_labels(labels | sample_labels)} {value}")
+
+		def add_histogram(name: str, description: str, histogram: Histogram):
+			lines.append(f"# HELP {name} {description}")
+			lines.append(f"# TYPE {name} histogram")
+			for bound, count in histogram.cumulative_counts():
+				lines.append(f"{name}_bucket{format_labels(labels | {'le': bound})} {count}")
+			lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+			lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+		add_metric("azlassets_last_run_timestamp_seconds", "gauge", "Start time of the last run.", [({}, self.started_at)])
+		add_metric("azlassets_last_run_duration_seconds", "gauge", "Duration of the last run.", [({}, summary["duration"])])
+		add_metric(
+			"azlassets_last_run_files",
+			"gauge",
+			"Asset files downloaded by the last run.",
+			[({"result": "success"}, summary["files"]), ({"result": "failed"}, summary["failed_files"])],
+		)
+		add_metric("azlassets_last_run_received_bytes", "gauge", "Bytes received by the last run.", [({}, self.received_bytes)])
+		add_metric("azlassets_last_run_retries", "gauge", "Retried requests of the last run.", [({}, self.retries)])
+		add_metric(
+			"azlassets_last_run_responses",
+			"gauge",
+			"Final responses of the last run by status code.",
+			[({"status": status}, count) for status, count in self.status_codes.items()],
+		)
+		add_metric(
+			"azlassets_last_run_errors",
+			"gauge",
+			"Failed downloads of the last run by error kind.",
+			[({"kind": kind}, count) for kind, count in self.errors.items()],
+		)
+		add_histogram("azlassets_download_ttfb_seconds", "Time to first byte of asset downloads.", self.ttfb)
+		add_histogram("azlassets_download_transfer_seconds", "Transfer time of asset downloads.", self.transfer_time)
+		add_histogram("azlassets_download_file_size_bytes", "Size of downloaded asset files.", self.file_size)
+
+		filepath.parent.mkdir(parents=True, exist_ok=True)
+		temporary_filepath = filepath.with_name(filepath.name + ".tmp")
+		with temporary_filepath.open("w", encoding="utf8") as f:
+			f.write("\n".join(lines) + "\n")
+		temporary_filepath.replace(filepath)
+
+
+def format_labels(labels: dict[str, str]) -> str:
+	"""
+	Format labels of a Prometheus sample.
+
+	Args:
+		labels: The labels
+
+	Returns:
+		str: The formatted labels, e.g. ``{client="EN"}``, or an empty string if there are none
+	"""
+	if not labels:
+		return ""
+	formatted = []
+	for key, value in labels.items():
+		escaped_value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+		formatted.append(f'{key}="{escaped_value}"')
+	return "{" + ",".join(formatted) + "}"
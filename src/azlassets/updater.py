@@ -1,15 +1,18 @@
-import asyncio
-import contextlib
+import aiohttp
+import functools
+import time
 from collections import defaultdict
-from collections.abc import Iterable
+from collections.abc import AsyncGenerator, AsyncIterable, Callable, Iterable
 from pathlib import Path
 from tqdm import tqdm
-from tqdm.asyncio import tqdm_asyncio
 
 from .classes import BundlePath, CompareResult, CompareType, DownloadType, HashRow, UpdateResult
 from .config import UserConfig
 from .downloader import AzurlaneAsyncDownloader
-from .versioncontrol import VersionController, VersionResult, compare_version_string, parse_hash_rows
+from .hashindex import HashIndex
+from .pathfilter import PathFilter
+from .scheduler import JobBatch
+from .versioncontrol import VersionController, VersionResult, compare_version_string
 
 
 def delete_asset_safe(filepath: Path):
@@ -25,15 +28,49 @@ def delete_asset_safe(filepath: Path):
 		print(f"WARN: Tried to remove non-existant asset at {filepath}")
 
 
-downloader_semaphore = asyncio.Semaphore(30)
-large_file_semaphore = asyncio.Semaphore(2)
+async def handle_stored_asset_download(
+	downloader_session: AzurlaneAsyncDownloader, result: CompareResult, save_destination: Path
+) -> bool:
+	"""
+	Place an asset from the asset store of the session, downloading it into the store only
+	if the store doesn't contain it yet.
+
+	Args:
+		downloader_session: Active downloader session with an asset store
+		result: Compare result providing the new hash
+		save_destination: Path of the asset in the client directory
+
+	Returns:
+		bool: True on success, False otherwise
+	"""
+	store = downloader_session.asset_store
+	newhash = result.new_hash
+	if store is None or newhash is None:
+		raise ValueError(f"ERROR: Stored download of {result} is not possible!")
+
+	# a changed file sharing the stored file means the stored file doesn't match its hash either
+	if result.compare_type == CompareType.Changed:
+		store.discard_if_linked(newhash.md5hash, save_destination)
+
+	async with store.lock(newhash.md5hash):
+		if store.contains(newhash.md5hash, newhash.size):
+			downloader_session.statistics.stored_files += 1
+		elif not await downloader_session.download_asset(newhash.md5hash, store.get_path(newhash.md5hash), newhash.size):
+			return False
+
+	try:
+		await store.link(newhash.md5hash, save_destination)
+	except OSError as e:
+		print(f"ERROR: Placing stored asset '{newhash.md5hash}' at '{save_destination}' failed. {e}")
+		return False
+	return True
 
 
 async def handle_asset_download(
 	downloader_session: AzurlaneAsyncDownloader, assetbasepath: Path, result: CompareResult
 ) -> UpdateResult:
 	"""
-	Handle downloading a single asset.
+	Handle downloading a single asset and record the hash of the placed file in the stat cache of the session.
 
 	Args:
 		downloader_session: Active downloader session
@@ -48,16 +85,143 @@ async def handle_asset_download(
 		raise ValueError(f"ERROR: New hash for {result} is None!")
 
 	assetpath = BundlePath.construct(assetbasepath, newhash.filepath)
+	if downloader_session.asset_store:
+		download_success = await handle_stored_asset_download(downloader_session, result, assetpath.full)
+	else:
+		download_success = await downloader_session.download_asset_once(newhash.md5hash, assetpath.full, newhash.size)
+	if download_success and downloader_session.stat_cache:
+		downloader_session.stat_cache.record(assetpath.inner, assetpath.full, newhash.md5hash)
+	return UpdateResult(result, DownloadType.Success if download_success else DownloadType.Failed, assetpath)
 
-	# Large files acquire their own semaphore first to prevent them from saturating
-	# the connection pool and starving each other.
-	is_large_file = newhash.size > 10_485_760  # 10 MB
-	large_file_ctx = large_file_semaphore if is_large_file else contextlib.nullcontext()
-	async with large_file_ctx:
-		async with downloader_semaphore:  # prevent queueing into connection pool, since wait time in pool counts towards timeout
-			download_success = await downloader_session.download_asset(newhash.md5hash, assetpath.full, newhash.size)
 
-	return UpdateResult(result, DownloadType.Success if download_success else DownloadType.Failed, assetpath)
+def create_download_batch(progressbar: tqdm) -> JobBatch[UpdateResult]:
+	"""
+	Create a batch collecting the results of queued asset downloads.
+
+	Args:
+		progressbar: Progress bar updated whenever a download completed
+
+	Returns:
+		JobBatch[UpdateResult]: The batch passed to :func:`queue_asset_download`
+	"""
+	return JobBatch(lambda: progressbar.update())
+
+
+def queue_asset_download(
+	downloader_session: AzurlaneAsyncDownloader, assetbasepath: Path, result: CompareResult, batch: JobBatch[UpdateResult]
+):
+	"""
+	Queue the download of a new or changed asset on the session scheduler, see :func:`handle_asset_download`.
+
+	Args:
+		downloader_session: Active downloader session
+		assetbasepath: Root directory for asset bundles
+		result: Compare result of the file to download
+		batch: Batch collecting the update result, see :func:`create_download_batch`
+	"""
+	job = functools.partial(handle_asset_download, downloader_session, assetbasepath, result)
+	downloader_session.scheduler.submit(result.new_hash, job, batch)  # pyright: ignore [reportArgumentType]
+
+
+async def download_assets(
+	downloader_session: AzurlaneAsyncDownloader, assetbasepath: Path, update_files: list[CompareResult], desc: str
+) -> list[UpdateResult]:
+	"""
+	Queue downloads of new or changed assets on the session scheduler and wait for all of them.
+
+	Args:
+		downloader_session: Active downloader session
+		assetbasepath: Root directory for asset bundles
+		update_files: Compare results of the files to download
+		desc: Description of the progress bar
+
+	Returns:
+		list[UpdateResult]: The update results, in the same order as ``update_files``
+	"""
+	with tqdm(total=len(update_files), desc=desc, unit="files") as progressbar:
+		batch = create_download_batch(progressbar)
+		for result in update_files:
+			queue_asset_download(downloader_session, assetbasepath, result, batch)
+		return await batch.wait()
+
+
+async def requeue_failed_downloads(
+	downloader_session: AzurlaneAsyncDownloader, assetbasepath: Path, download_results: list[UpdateResult], label: str = ""
+):
+	"""
+	Queue failed downloads again, as often as set by the session retry policy. Files known
+	to be missing on the server are not queued again.
+
+	Args:
+		downloader_session: Active downloader session
+		assetbasepath: Root directory for asset bundles
+		download_results: Results of the downloads, failed results are replaced in place
+		label: Prefix of the output, distinguishes concurrent updates
+	"""
+	desc_prefix = f"{label} " if label else ""
+	print_prefix = f"{label}: " if label else ""
+	for requeue_round in range(downloader_session.retry_policy.requeue_rounds):
+		failed_indices = [
+			i
+			for i, r in enumerate(download_results)
+			if r.download_type == DownloadType.Failed
+			and not downloader_session.is_known_missing(r.compare_result.new_hash.md5hash)  # pyright: ignore [reportOptionalMemberAccess]
+		]
+		if not failed_indices:
+			break
+		print(f"{print_prefix}Queueing {len(failed_indices)} failed downloads again (round {requeue_round + 1}).")
+		failed_files = [download_results[i].compare_result for i in failed_indices]
+		retried_results = await download_assets(downloader_session, assetbasepath, failed_files, f"{desc_prefix}Retry Progress")
+		for i, retried_result in zip(failed_indices, retried_results):
+			download_results[i] = retried_result
+
+
+def delete_assets(
+	deleted_files: list[CompareResult], assetbasepath: Path, allow_deletion: bool = True, label: str = ""
+) -> list[UpdateResult]:
+	"""
+	Delete the assets of files that were removed from the hash file.
+
+	Args:
+		deleted_files: Compare results of the deleted files
+		assetbasepath: Root directory for asset bundles
+		allow_deletion: Whether to allow deletion of files, otherwise they are only marked for deletion
+		label: Prefix of the progress bar description, distinguishes concurrent updates
+
+	Returns:
+		list[UpdateResult]: The update results of the deleted files
+	"""
+	update_results = []
+	if len(deleted_files) > 0:
+		if allow_deletion:
+			desc_prefix = f"{label} " if label else ""
+			with tqdm(total=len(deleted_files), desc=f"{desc_prefix}Deletion Progress", unit="files") as progressbar:
+				for result in deleted_files:
+					assetpath = BundlePath.construct(assetbasepath, result.current_hash.filepath)  # pyright: ignore [reportOptionalMemberAccess]
+					delete_asset_safe(assetpath.full)
+					update_results.append(UpdateResult(result, DownloadType.Removed, assetpath))
+					progressbar.update()
+		else:
+			for result in deleted_files:
+				assetpath = BundlePath.construct(assetbasepath, result.current_hash.filepath)  # pyright: ignore [reportOptionalMemberAccess]
+				update_results.append(UpdateResult(result, DownloadType.ForDeletionNoChange, assetpath))
+	return update_results
+
+
+def record_download_telemetry(
+	downloader_session: AzurlaneAsyncDownloader, download_results: list[UpdateResult], duration: float, label: str = ""
+):
+	"""
+	Add the summary of the downloads of an update to the telemetry of the session.
+
+	Args:
+		downloader_session: Active downloader session
+		download_results: Results of the downloads
+		duration: Time in seconds the downloads took
+		label: Label of the update
+	"""
+	failed_downloads = sum(1 for r in download_results if r.download_type == DownloadType.Failed)
+	downloader_session.telemetry.record_update(label, len(download_results) - failed_downloads, failed_downloads, duration)
 
 
 async def update_assets(
@@ -65,15 +229,18 @@ async def update_assets(
 	comparison_results: dict[CompareType, list[CompareResult]],
 	client_directory: Path,
 	allow_deletion: bool = True,
+	label: str = "",
 ) -> list[UpdateResult]:
 	"""
 	Apply a full set of comparison results: download new/changed files and handle deletions.
+	Failed downloads are queued again at the end, as often as set by the session retry policy.
 
 	Args:
 		downloader_session: Active downloader session
 		comparison_results: Output of :func:`compare_hashes`
 		client_directory: Client root directory
 		allow_deletion: Whether to allow deletion of files
+		label: Prefix of the progress bar descriptions, distinguishes concurrent updates
 
 	Returns:
 		list[UpdateResult]: The list of update results
@@ -86,28 +253,177 @@ async def update_assets(
 
 	# handle all new or changed files
 	update_files = comparison_results[CompareType.New] + comparison_results[CompareType.Changed]
+	desc_prefix = f"{label} " if label else ""
 	if len(update_files) > 0:
-		tasks = [handle_asset_download(downloader_session, assetbasepath, result) for result in update_files]
-		update_results += await tqdm_asyncio.gather(*tasks, desc="Download Progress", unit="files")
+		download_start = time.monotonic()
+		download_results = await download_assets(
+			downloader_session, assetbasepath, update_files, f"{desc_prefix}Download Progress"
+		)
+		await requeue_failed_downloads(downloader_session, assetbasepath, download_results, label)
+		update_results += download_results
+		record_download_telemetry(downloader_session, download_results, time.monotonic() - download_start, label)
 
 	# handle all deleted files
-	deleted_files = comparison_results[CompareType.Deleted]
-	if len(deleted_files) > 0:
-		if allow_deletion:
-			with tqdm(total=len(deleted_files), desc="Deletion Progress", unit="files") as progressbar:
-				for result in deleted_files:
-					assetpath = BundlePath.construct(assetbasepath, result.current_hash.filepath)  # pyright: ignore [reportOptionalMemberAccess]
-					delete_asset_safe(assetpath.full)
-					update_results.append(UpdateResult(result, DownloadType.Removed, assetpath))
-					progressbar.update()
-		else:
-			for result in deleted_files:
-				assetpath = BundlePath.construct(assetbasepath, result.current_hash.filepath)  # pyright: ignore [reportOptionalMemberAccess]
-				update_results.append(UpdateResult(result, DownloadType.ForDeletionNoChange, assetpath))
-
+	update_results += delete_assets(comparison_results[CompareType.Deleted], assetbasepath, allow_deletion, label)
 	return update_results
 
 
+async def update_assets_from_stream(
+	downloader_session: AzurlaneAsyncDownloader,
+	oldhashes: Iterable[HashRow],
+	newhashes: AsyncIterable[HashRow],
+	client_directory: Path,
+	allow_deletion: bool = True,
+	label: str = "",
+) -> tuple[list[UpdateResult], bool] | None:
+	"""
+	Compare hash rows while they arrive and queue the download of each new or changed file
+	immediately, so downloads start before the hash file is completely received. Files of
+	``oldhashes`` missing from the complete hash file are deleted at the end.
+
+	If receiving ``newhashes`` fails, the queued downloads are completed, but no files are
+	deleted. The rows of ``oldhashes`` that weren't received yet are kept as unchanged results,
+	so :func:`filter_hashes` still describes the files on disk.
+
+	Args:
+		downloader_session: Active downloader session
+		oldhashes: Previously stored hash rows
+		newhashes: New hash rows, e.g. from :meth:`AzurlaneAsyncDownloader.iterate_hashes`
+		client_directory: Client root directory
+		allow_deletion: Whether to allow deletion of files
+		label: Prefix of the output, distinguishes concurrent updates
+
+	Returns:
+		tuple[list[UpdateResult], bool] or None: The update results and whether all new hash rows
+			were received, or None if no new hash rows were received
+	"""
+	assetbasepath = Path(client_directory, "AssetBundles")
+	desc_prefix = f"{label} " if label else ""
+	if isinstance(oldhashes, HashIndex):
+		# rows of a hash index are looked up with a binary search and only decoded if they changed
+		old_index = oldhashes
+		received_rows = bytearray(len(old_index))
+		remaining_hashes = {}
+	else:
+		old_index = None
+		received_rows = bytearray()
+		remaining_hashes = {row.filepath: row for row in oldhashes}
+	received_paths = set()
+	update_results = []
+	complete = True
+	download_start = time.monotonic()
+
+	with tqdm(total=0, desc=f"{desc_prefix}Download Progress", unit="files") as progressbar:
+		download_batch = create_download_batch(progressbar)
+		try:
+			async for hashrow in newhashes:
+				if hashrow.filepath in received_paths:
+					continue
+				received_paths.add(hashrow.filepath)
+
+				if old_index is not None:
+					index = old_index.find(hashrow.filepath)
+					if index is not None:
+						received_rows[index] = 1
+					unchanged = index is not None and old_index.matches(index, hashrow)
+					current_hash = old_index[index] if index is not None and not unchanged else None
+				else:
+					current_hash = remaining_hashes.pop(hashrow.filepath, None)
+					unchanged = current_hash == hashrow
+				if unchanged:
+					result = CompareResult(hashrow, hashrow, CompareType.Unchanged)
+					update_results.append(
+						UpdateResult(result, DownloadType.NoChange, BundlePath.construct(assetbasepath, hashrow.filepath))
+					)
+					continue
+
+				compare_type = CompareType.New if current_hash is None else CompareType.Changed
+				result = CompareResult(current_hash, hashrow, compare_type)
+				queue_asset_download(downloader_session, assetbasepath, result, download_batch)
+				progressbar.total += 1
+		except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+			print(f"{desc_prefix}Failed to receive the hash file: {e!r}")
+			complete = False
+		download_results = await download_batch.wait()
+
+	if not received_paths:
+		return
+
+	if download_results:
+		await requeue_failed_downloads(downloader_session, assetbasepath, download_results, label)
+		update_results += download_results
+		record_download_telemetry(downloader_session, download_results, time.monotonic() - download_start, label)
+
+	if old_index is not None:
+		remaining_rows = (old_index[i] for i, received in enumerate(received_rows) if not received)
+	else:
+		remaining_rows = remaining_hashes.values()
+	old_results = [CompareResult(row, None, CompareType.Deleted) for row in remaining_rows]
+	if complete:
+		update_results += delete_assets(old_results, assetbasepath, allow_deletion, label)
+	else:
+		# the files weren't compared, keep them as they are
+		for result in old_results:
+			result.new_hash = result.current_hash
+			result.compare_type = CompareType.Unchanged
+			update_results.append(
+				UpdateResult(result, DownloadType.NoChange, BundlePath.construct(assetbasepath, result.new_hash.filepath))  # pyright: ignore [reportOptionalMemberAccess]
+			)
+	return update_results, complete
+
+
+def get_update_label(version_result: VersionResult, downloader_session: AzurlaneAsyncDownloader) -> str:
+	"""
+	Return the label identifying the update of a version type in the output.
+
+	Args:
+		version_result: Version to update
+		downloader_session: Active downloader session, its label is prepended if set
+
+	Returns:
+		str: The label, e.g. ``AZL`` or ``EN AZL``
+	"""
+	return f"{downloader_session.label} {version_result.version_type.name}".lstrip()
+
+
+def create_download_filter(userconfig: UserConfig) -> Callable[[HashRow], bool]:
+	"""
+	Create the function deciding whether a hash row is downloaded, based on the download
+	filter of the user configuration.
+
+	Args:
+		userconfig: The user configuration
+
+	Returns:
+		Callable[[HashRow], bool]: Returns True for hash rows that are downloaded
+	"""
+	path_filter = PathFilter(userconfig.download_filter, userconfig.download_isblacklist, match_prefix=True)
+	return lambda row: path_filter.is_included(row.filepath)
+
+
+async def iterate_filtered_hashes(
+	version_result: VersionResult, downloader_session: AzurlaneAsyncDownloader, userconfig: UserConfig
+) -> AsyncGenerator[HashRow, None]:
+	"""
+	Download the hash file for a version and yield the rows passing the download filter while it is received.
+
+	Args:
+		version_result: Version whose hash file should be fetched
+		downloader_session: Active downloader session
+		userconfig: The user configuration
+
+	Raises:
+		Exception: If the hash file could not be downloaded
+
+	Yields:
+		HashRow: The filtered hash rows
+	"""
+	download_filter = create_download_filter(userconfig)
+	async for hashrow in downloader_session.iterate_hashes(version_result):
+		if download_filter(hashrow):
+			yield hashrow
+
+
 async def download_and_parse_hashes(
 	version_result: VersionResult, downloader_session: AzurlaneAsyncDownloader, userconfig: UserConfig
 ) -> list[HashRow] | None:
@@ -121,30 +437,29 @@ async def download_and_parse_hashes(
 
 	Returns:
 		list[HashRow] or None: Filtered hash rows, or None if the server returned an empty response
+			or the hash file could not be received
 	"""
-	hashes = await downloader_session.download_hashes(version_result)
+	try:
+		hashes = [hashrow async for hashrow in iterate_filtered_hashes(version_result, downloader_session, userconfig)]
+	except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+		print(f"Failed to receive the hash file for {get_update_label(version_result, downloader_session)}, skipping: {e!r}")
+		return
 	if not hashes:
-		print(f"Server returned empty hashfile for {version_result.version_type.name}, skipping.")
+		print(f"Server returned empty hashfile for {get_update_label(version_result, downloader_session)}, skipping.")
 		return
-
-	# hash filter function
-	def _filter(row: HashRow):
-		for path in userconfig.download_filter:
-			if row.filepath.startswith(path):
-				if not userconfig.download_isblacklist:
-					return True
-		return userconfig.download_isblacklist
-
-	return list(filter(_filter, parse_hash_rows(hashes)))
+	return hashes
 
 
-def compare_hashes(oldhashes: Iterable[HashRow], newhashes: Iterable[HashRow]) -> dict[CompareType, list[CompareResult]]:
+def compare_hashes(
+	oldhashes: Iterable[HashRow], newhashes: Iterable[HashRow], include_unchanged: bool = True
+) -> dict[CompareType, list[CompareResult]]:
 	"""
 	Diff two hash lists and classify each file as New, Changed, Unchanged, or Deleted.
 
 	Args:
 		oldhashes: Previously stored hash rows
 		newhashes: New hash rows to compare to
+		include_unchanged: Whether to return results for unchanged files, their list is empty otherwise
 
 	Returns:
 		dict[CompareType, list[CompareResult]]: Results grouped by compare type
@@ -163,7 +478,8 @@ def compare_hashes(oldhashes: Iterable[HashRow], newhashes: Iterable[HashRow]) -
 
 	sorted_results = defaultdict(list)
 	for r in results.values():
-		sorted_results[r.compare_type].append(r)
+		if include_unchanged or r.compare_type != CompareType.Unchanged:
+			sorted_results[r.compare_type].append(r)
 	return sorted_results
 
 
@@ -229,7 +545,11 @@ async def _update_from_hashes(
 	"""
 	comparison_results = compare_hashes(oldhashes, newhashes)
 	update_results = await update_assets(
-		downloader_session, comparison_results, versioncontroller.client_directory, allow_deletion
+		downloader_session,
+		comparison_results,
+		versioncontroller.client_directory,
+		allow_deletion,
+		label=get_update_label(version_result, downloader_session),
 	)
 	hashes_updated = filter_hashes(update_results)
 	versioncontroller.update_version_data(version_result, hashes_updated)
@@ -244,11 +564,13 @@ async def _update(
 	ignore_hashfile: bool = False,
 ) -> list[UpdateResult] | None:
 	"""
-	Download the server hash file and run an update if it is non-empty.
+	Download the server hash file and update the assets while it is received,
+	see :func:`update_assets_from_stream`.
 
 	When ``ignore_hashfile`` is True, the local hash file is skipped and all
 	server files are treated as new. Returns None if the server hash file is
-	empty.
+	empty or could not be received completely. In the latter case, only the hash file
+	is saved with the files downloaded so far, the version is updated on the next run.
 
 	Args:
 		version_result: Version to update
@@ -258,15 +580,26 @@ async def _update(
 		ignore_hashfile: If True, treat all server files as new regardless of local state
 
 	Returns:
-		list[UpdateResult] or None: List of update results, or None if the server returned an empty hash file
+		list[UpdateResult] or None: List of update results, or None if the server hash file was empty or incomplete
 	"""
-	newhashes = await download_and_parse_hashes(version_result, downloader_session, userconfig)
-	if newhashes:
-		if ignore_hashfile:
-			oldhashes = []
-		else:
-			oldhashes = versioncontroller.load_hash_file(version_result.version_type)
-		return await _update_from_hashes(version_result, downloader_session, versioncontroller, oldhashes or [], newhashes)
+	label = get_update_label(version_result, downloader_session)
+	oldhashes = [] if ignore_hashfile else versioncontroller.load_hash_file(version_result.version_type)
+	newhashes = iterate_filtered_hashes(version_result, downloader_session, userconfig)
+	stream_result = await update_assets_from_stream(
+		downloader_session, oldhashes or [], newhashes, versioncontroller.client_directory, label=label
+	)
+	if stream_result is None:
+		print(f"Server returned empty hashfile for {label}, skipping.")
+		return
+
+	update_results, complete = stream_result
+	hashes_updated = filter_hashes(update_results)
+	if not complete:
+		print(f"{label}: Hashfile was not received completely, the version will be updated on the next run.")
+		versioncontroller.save_hash_file(version_result.version_type, hashes_updated)
+		return
+	versioncontroller.update_version_data(version_result, hashes_updated)
+	return update_results
 
 
 async def update(
@@ -295,14 +628,13 @@ async def update(
 	Returns:
 		list[UpdateResult] or None:  List of update results, or None if skipped
 	"""
+	label = get_update_label(version_result, downloader_session)
 	oldversion = versioncontroller.load_version_string(version_result.version_type)
 	if compare_version_string(version_result.version, oldversion):
-		print(
-			f"{version_result.version_type.name}: Current version {oldversion} is older than latest version {version_result.version}."
-		)
+		print(f"{label}: Current version {oldversion} is older than latest version {version_result.version}.")
 		return await _update(version_result, downloader_session, userconfig, versioncontroller, ignore_hashfile)
 	else:
-		print(f"{version_result.version_type.name}: Current version {oldversion} is latest. ", end="")
+		print(f"{label}: Current version {oldversion} is latest. ", end="")
 		if force_refresh:
 			print("(force check enabled: Try downloading files anyway.)")
 			return await _update(version_result, downloader_session, userconfig, versioncontroller, ignore_hashfile)
@@ -7,11 +7,14 @@ from typing import Any, Self
 
 from .classes import (
 	BundlePath,
+	Client,
 	CompareType,
 	DownloadType,
 	HashRow,
 	UpdateResult,
 )
+from .config import load_user_config
+from .hashindex import HashFileFormat, HashIndex, write_hash_index
 
 
 class UnknownVersionTypeError(NotImplementedError):
@@ -328,13 +331,31 @@ def parse_hash_rows(hashes: str) -> Generator[HashRow, None, None]:
 		yield HashRow(path, int(size), md5hash)
 
 
+def parse_hash_row(line: str) -> HashRow:
+	"""
+	Convert a single non-blank CSV line into a ``HashRow``.
+
+	Args:
+		line: A line with the format ``path,size,md5hash``, without line break.
+
+	Returns:
+		HashRow: The parsed row
+	"""
+	path, size, md5hash = line.split(",")
+	return HashRow(path, int(size), md5hash)
+
+
 @dataclass
 class VersionController:
 	"""
 	Manages reading and writing of versioning data for a single game client.
+
+	Hash files are saved in ``hash_file_format``, files in the other format are still read
+	if there is none in ``hash_file_format`` yet.
 	"""
 
 	client_directory: Path
+	hash_file_format: HashFileFormat = HashFileFormat.CSV
 
 	def get_version_string_path(self, version_type: VersionType) -> Path:
 		"""
@@ -388,51 +409,144 @@ class VersionController:
 		with fpath.open("w", encoding="utf8") as f:
 			f.write(version.version)
 
-	def get_hash_file_path(self, version_type: VersionType) -> Path:
+	def get_hash_file_path(self, version_type: VersionType, file_format: HashFileFormat | None = None) -> Path:
 		"""
-		Return the filesystem path for the hashes CSV file of ``version_type``.
+		Return the filesystem path for the hash file of ``version_type``.
 
 		Args:
 			version_type: The version type whose hash file path is needed.
+			file_format: Format of the hash file, ``hash_file_format`` if not set.
 
 		Returns:
-			Path: Path to the ``hashes*.csv`` file.
+			Path: Path to the ``hashes*.csv`` or ``hashes*.idx`` file.
 		"""
-		return Path(self.client_directory, version_type.hashes_filename)
+		filepath = Path(self.client_directory, version_type.hashes_filename)
+		if (file_format or self.hash_file_format) == HashFileFormat.INDEX:
+			return filepath.with_suffix(".idx")
+		return filepath
 
-	def load_hash_file(self, version_type: VersionType) -> Generator[HashRow, None, None] | None:
+	def load_hash_file(self, version_type: VersionType) -> Iterable[HashRow] | None:
 		"""
-		Load the local asset hash CSV file for a given version type.
+		Load the local asset hash file for a given version type. If there is no hash file
+		in ``hash_file_format``, the hash file in the other format is loaded.
 
 		Args:
 			version_type: The version type to load asset info for.
 
-		Yields:
-			HashRow | None: A generator yielding :class:`HashRow` objects objects parsed from the CSV,
-			or ``None`` if the hash file does not exist.
-		"""
-		fpath = self.get_hash_file_path(version_type)
-		try:
-			with open(fpath, "r", encoding="utf8") as f:
-				return parse_hash_rows(f.read())
-		except FileNotFoundError:
-			return
+		Returns:
+			Iterable[HashRow] | None: The :class:`HashRow` objects of the hash file, a generator
+			parsing the CSV or a :class:`HashIndex`, or ``None`` if the hash file does not exist.
+		"""
+		other_format = HashFileFormat.CSV if self.hash_file_format == HashFileFormat.INDEX else HashFileFormat.INDEX
+		for file_format in (self.hash_file_format, other_format):
+			fpath = self.get_hash_file_path(version_type, file_format)
+			try:
+				if file_format == HashFileFormat.INDEX:
+					return HashIndex.open(fpath)
+				with open(fpath, "r", encoding="utf8") as f:
+					return parse_hash_rows(f.read())
+			except FileNotFoundError:
+				continue
 
 	def save_hash_file(self, version_type: VersionType, hashrows: Iterable[HashRow | None]):
 		"""
-		Save asset information in CSV format for a given version type.
-		Writes each ``HashRow`` as a CSV line ``path,size,md5hash``.
+		Save asset information in ``hash_file_format`` for a given version type.
+		As CSV, each ``HashRow`` is written as a line ``path,size,md5hash``.
+		A hash file of the version type in the other format is removed.
 
 		Args:
 			version_type: The version type to save hashes for.
 			hashrows: An iterable of `HashRow` objects to write.
 		"""
+		fpath = self.get_hash_file_path(version_type)
+		if self.hash_file_format == HashFileFormat.INDEX:
+			write_hash_index(fpath, [row for row in hashrows if row])
+			self.get_hash_file_path(version_type, HashFileFormat.CSV).unlink(missing_ok=True)
+			return
+
 		rowstrings = [f"{row.filepath},{row.size},{row.md5hash}" for row in hashrows if row]
 		content = "\n".join(rowstrings)
-		fpath = self.get_hash_file_path(version_type)
 		fpath.parent.mkdir(parents=True, exist_ok=True)
 		with fpath.open("w", encoding="utf8") as f:
 			f.write(content)
+		self.get_hash_file_path(version_type, HashFileFormat.INDEX).unlink(missing_ok=True)
+
+	def convert_hash_files(self, file_format: HashFileFormat) -> list[VersionType]:
+		"""
+		Convert the hash files of all version types to another format, e.g. to export
+		hash indexes as CSV.
+
+		Args:
+			file_format: The format to convert to.
+
+		Returns:
+			list[VersionType]: The version types whose hash files were converted.
+		"""
+		converted_types = []
+		target_controller = VersionController(self.client_directory, file_format)
+		for version_type in VersionType:
+			if target_controller.get_hash_file_path(version_type).exists():
+				continue
+			hashrows = self.load_hash_file(version_type)
+			if hashrows is None:
+				continue
+			target_controller.save_hash_file(version_type, list(hashrows))
+			converted_types.append(version_type)
+		return converted_types
+
+	def get_negative_cache_path(self) -> Path:
+		"""
+		Return the filesystem path of the file recording assets missing on the server.
+
+		Returns:
+			Path: Path to the ``missing-assets.json`` file.
+		"""
+		return Path(self.client_directory, "missing-assets.json")
+
+	def get_stat_cache_path(self) -> Path:
+		"""
+		Return the filesystem path of the file recording the md5 hashes of the files on disk.
+
+		Returns:
+			Path: Path to the ``file-stats.json`` file.
+		"""
+		return Path(self.client_directory, "file-stats.json")
+
+	def get_integrity_sampler_path(self) -> Path:
+		"""
+		Return the filesystem path of the file recording the next round of sampled integrity checks.
+
+		Returns:
+			Path: Path to the ``integrity-check.json`` file.
+		"""
+		return Path(self.client_directory, "integrity-check.json")
+
+	def get_integrity_checkpoint_path(self) -> Path:
+		"""
+		Return the filesystem path of the checkpoint of an unfinished integrity check.
+
+		Returns:
+			Path: Path to the ``integrity-checkpoint.json`` file.
+		"""
+		return Path(self.client_directory, "integrity-checkpoint.json")
+
+	def get_hash_cache_directory(self) -> Path:
+		"""
+		Return the directory containing the cached hash files received from the server.
+
+		Returns:
+			Path: Path to the ``hashcache`` directory.
+		"""
+		return Path(self.client_directory, "hashcache")
+
+	def get_telemetry_path(self) -> Path:
+		"""
+		Return the filesystem path of the file containing the download telemetry of the last run.
+
+		Returns:
+			Path: Path to the ``telemetry.json`` file.
+		"""
+		return Path(self.client_directory, "telemetry.json")
 
 	def update_version_data(self, version: SimpleVersionResult, hashrows: Iterable[HashRow]):
 		"""
@@ -652,3 +766,13 @@ class VersionController:
 		version_diffdir = self.get_difflog_dirpath(version_type)
 		difflog_versionlist = [path.stem for path in version_diffdir.glob("*.json")]
 		return difflog_versionlist
+
+
+def execute_from_args(args):
+	userconfig = load_user_config()
+	for client_name in args.client:
+		client = Client[client_name]
+		versioncontroller = VersionController(Path(userconfig.asset_directory, client.name), userconfig.hash_file_format)
+		file_format = HashFileFormat(args.format)
+		converted_types = versioncontroller.convert_hash_files(file_format)
+		print(f"{client.name}: Converted {len(converted_types)} hash files to {file_format.value}.")
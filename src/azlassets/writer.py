@@ -0,0 +1,403 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import BinaryIO
+
+
+def get_progress_path(filepath: Path) -> Path:
+	"""
+	Return the path of the ``.progress`` sidecar recording the written content of a partial file.
+
+	Args:
+		filepath: Path of the partial file
+
+	Returns:
+		Path: Path of the sidecar file
+	"""
+	return filepath.with_name(filepath.name + ".progress")
+
+
+class WriteProgress:
+	"""
+	Byte ranges of a preallocated partial file whose content is written and synced to disk.
+
+	A preallocated file has its final size before its content is written, so after a crash its size
+	doesn't tell how much of it is valid. The ranges are saved to a sidecar file, see
+	:func:`get_progress_path`, after the content they cover is synced, so an interrupted download
+	is resumed from them. A partial file without a sidecar was truncated to its content when its
+	writer was closed and is valid up to its size.
+	"""
+
+	def __init__(self, filepath: Path, ranges: list[list[int]] | None = None):
+		"""
+		Args:
+			filepath: Path of the sidecar file
+			ranges: Sorted, non-overlapping ``[start, end]`` ranges of written content, end exclusive
+		"""
+		self.filepath = filepath
+		self.ranges = ranges or []
+		# ranges are added by the event loop and saved by the threads of the writer
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def load(filepath: Path) -> "WriteProgress | None":
+		"""
+		Load the progress of a partial file from its sidecar.
+
+		Args:
+			filepath: Path of the sidecar file
+
+		Returns:
+			WriteProgress or None: The progress, None if there is no sidecar. An invalid sidecar
+				returns a progress without written content.
+		"""
+		try:
+			with filepath.open("r", encoding="utf8") as f:
+				ranges = [[int(start), int(end)] for start, end in json.load(f)]
+		except FileNotFoundError:
+			return
+		except (ValueError, TypeError):
+			ranges = []
+		return WriteProgress(filepath, ranges)
+
+	@property
+	def prefix_size(self) -> int:
+		"""Amount of bytes written without a gap from the start of the file."""
+		if self.ranges and self.ranges[0][0] == 0:
+			return self.ranges[0][1]
+		return 0
+
+	def add(self, start: int, end: int):
+		"""
+		Record written content, merging it with adjacent or overlapping ranges.
+
+		Args:
+			start: Offset of the first written byte
+			end: Offset behind the last written byte
+		"""
+		if end <= start:
+			return
+		with self._lock:
+			merged = []
+			for range_start, range_end in self.ranges:
+				if range_end < start or range_start > end:
+					merged.append([range_start, range_end])
+				else:
+					start, end = min(start, range_start), max(end, range_end)
+			merged.append([start, end])
+			merged.sort()
+			self.ranges = merged
+
+	def clip(self, size: int):
+		"""
+		Remove content behind ``size`` from the ranges, e.g. if the partial file is smaller than recorded.
+
+		Args:
+			size: Size of the partial file
+		"""
+		with self._lock:
+			self.ranges = [[start, min(end, size)] for start, end in self.ranges if start < size]
+
+	def get_missing_ranges(self, file_size: int) -> list[tuple[int, int]]:
+		"""
+		Args:
+			file_size: Size of the complete file
+
+		Returns:
+			list[tuple[int, int]]: The ranges of the file that aren't written yet
+		"""
+		missing = []
+		position = 0
+		for start, end in self.ranges:
+			if start > position:
+				missing.append((position, min(start, file_size)))
+			position = max(position, end)
+		if position < file_size:
+			missing.append((position, file_size))
+		return missing
+
+	def save(self):
+		"""
+		Save the ranges to the sidecar file and sync it to disk. Blocking, called by the threads of the writer.
+		"""
+		with self._lock:
+			temporary_filepath = self.filepath.with_name(self.filepath.name + ".tmp")
+			with temporary_filepath.open("w", encoding="utf8") as f:
+				json.dump(self.ranges, f)
+				f.flush()
+				os.fsync(f.fileno())
+			temporary_filepath.replace(self.filepath)
+
+	def remove(self):
+		"""
+		Remove the sidecar file, once the partial file is complete or valid up to its size.
+		"""
+		self.filepath.unlink(missing_ok=True)
+
+
+def preallocate_file(filepath: Path, file_size: int):
+	"""
+	Create a file or extend an existing one to its final size, keeping its content.
+
+	Args:
+		filepath: Path of the file
+		file_size: Size of the complete file in bytes
+	"""
+	with filepath.open("ab") as f:
+		try:
+			os.posix_fallocate(f.fileno(), 0, file_size)
+		except (AttributeError, OSError):
+			# not supported by the platform or filesystem, extend the file without reserving space
+			f.truncate(file_size)
+
+
+def write_file(temporary_path: Path, destination: Path, data: bytes):
+	"""
+	Write a complete file to a temporary path and move it to its destination, so the
+	destination never contains a partially written file.
+
+	Args:
+		temporary_path: Path the file is written to first
+		destination: Final path of the file
+		data: Content of the file
+	"""
+	with temporary_path.open("wb") as f:
+		f.write(data)
+	temporary_path.replace(destination)
+
+
+def preallocate_partial_file(filepath: Path, file_size: int, progress: WriteProgress):
+	"""
+	Save the ``progress`` of a partial file and preallocate it to its final size, keeping its content.
+	The progress is saved first, so the size of the file is never mistaken for its content.
+
+	Args:
+		filepath: Path of the file
+		file_size: Size of the complete file in bytes
+		progress: Progress of the file
+	"""
+	progress.save()
+	preallocate_file(filepath, file_size)
+
+
+def open_preallocated(filepath: Path, file_size: int, offset: int, progress: WriteProgress) -> BinaryIO:
+	"""
+	Open a file for writing from ``offset`` after preallocating it to its final size, see :func:`preallocate_partial_file`.
+
+	Args:
+		filepath: Path of the file
+		file_size: Size of the complete file in bytes
+		offset: Position to write from, content before it is kept
+		progress: Progress of the file, recording the content before ``offset``
+
+	Returns:
+		BinaryIO: The opened file
+	"""
+	if offset == 0:
+		filepath.unlink(missing_ok=True)
+	preallocate_partial_file(filepath, file_size, progress)
+	f = filepath.open("r+b")
+	f.seek(offset)
+	return f
+
+
+def write_block(f: BinaryIO, data: bytes, progress: WriteProgress, checkpoint_start: int | None = None):
+	"""
+	Write data at the current position of a file. With a ``checkpoint_start``, the file is synced
+	to disk afterwards and its content from ``checkpoint_start`` up to the current position is
+	recorded in the saved ``progress``.
+
+	Args:
+		f: The file
+		data: Data to write
+		progress: Progress of the file
+		checkpoint_start: Position the file was written from sequentially, None to skip the checkpoint
+	"""
+	f.write(data)
+	if checkpoint_start is None:
+		return
+	f.flush()
+	os.fsync(f.fileno())
+	progress.add(checkpoint_start, f.tell())
+	progress.save()
+
+
+def close_truncated(f: BinaryIO, data: bytes, progress: WriteProgress, pending_write: Future | None = None):
+	"""
+	Write the remaining data to a file, cut off the preallocated space behind it and close it.
+	The ``progress`` is removed afterwards, the file is valid up to its size.
+
+	Args:
+		f: The file
+		data: Remaining data to write at the current position
+		progress: Progress of the file
+		pending_write: A previous write to the file that has to complete first, e.g. because the
+			coroutine waiting for it was cancelled
+	"""
+	if pending_write is not None:
+		wait([pending_write])
+	try:
+		f.write(data)
+	finally:
+		try:
+			f.truncate(f.tell())
+			f.flush()
+			os.fsync(f.fileno())
+		finally:
+			f.close()
+	progress.remove()
+
+
+class PartialFileWriter:
+	"""
+	Buffered writer of a file that is received in chunks.
+
+	The file is preallocated to its final size, so it doesn't fragment while growing. Chunks are
+	collected up to ``buffer_size`` bytes and written by the thread pool of the
+	:class:`AssetWriter`. Every ``checkpoint_size`` bytes or ``checkpoint_interval`` seconds, the
+	written content is synced and recorded in the :class:`WriteProgress` of the file, so a download
+	interrupted by a crash is resumed from the recorded content, and only content written after the
+	last checkpoint is downloaded again. When
+	the writer is closed, also after an error, the file is truncated to the written content and
+	the progress is removed, so the download can be resumed from its size.
+
+	Use as an async context manager, see :meth:`AssetWriter.open_partial`.
+	"""
+
+	def __init__(self, asset_writer: "AssetWriter", filepath: Path, file_size: int, offset: int):
+		"""
+		Args:
+			asset_writer: The writer whose thread pool performs the writes
+			filepath: Path of the file
+			file_size: Size of the complete file in bytes
+			offset: Amount of bytes already in the file, writing continues behind them
+		"""
+		self.asset_writer = asset_writer
+		self.filepath = filepath
+		self.file_size = file_size
+		self.offset = offset
+		self.progress = WriteProgress(get_progress_path(filepath), [[0, offset]] if offset > 0 else [])
+		self._file: BinaryIO | None = None
+		self._buffer = bytearray()
+		self._pending_write: Future | None = None
+		self._unsynced_size = 0
+		self._last_checkpoint = time.monotonic()
+
+	async def __aenter__(self) -> "PartialFileWriter":
+		self._file = await self.asset_writer.run(open_preallocated, self.filepath, self.file_size, self.offset, self.progress)
+		return self
+
+	async def __aexit__(self, *_):
+		if self._file is None:
+			return
+		data = bytes(self._buffer)
+		self._buffer.clear()
+		file, self._file = self._file, None
+		await self.asset_writer.run(close_truncated, file, data, self.progress, self._pending_write)
+
+	async def write(self, chunk: bytes):
+		"""
+		Append a chunk to the file. The chunk is written once the buffer is full.
+
+		Args:
+			chunk: The received data
+		"""
+		assert self._file is not None
+		self._buffer += chunk
+		if len(self._buffer) >= self.asset_writer.buffer_size:
+			data = bytes(self._buffer)
+			self._buffer.clear()
+			self._unsynced_size += len(data)
+			now = time.monotonic()
+			checkpoint = (
+				self._unsynced_size >= self.asset_writer.checkpoint_size
+				or now - self._last_checkpoint >= self.asset_writer.checkpoint_interval
+			)
+			if checkpoint:
+				self._unsynced_size = 0
+				self._last_checkpoint = now
+			checkpoint_start = self.offset if checkpoint else None
+			self._pending_write = self.asset_writer.submit(write_block, self._file, data, self.progress, checkpoint_start)
+			await asyncio.wrap_future(self._pending_write)
+
+
+class AssetWriter:
+	"""
+	Writes downloaded assets to disk in a dedicated thread pool, keeping blocking file
+	operations away from the event loop and the network coroutines.
+
+	Small files are written in a single operation with :meth:`write_file`, larger files
+	are streamed into a preallocated file with :meth:`open_partial`.
+	"""
+
+	def __init__(
+		self,
+		workers: int = 8,
+		buffer_size: int = 1_048_576,
+		checkpoint_size: int = 16_777_216,
+		checkpoint_interval: float = 5.0,
+	):
+		"""
+		Args:
+			workers: Amount of threads writing files at the same time
+			buffer_size: Amount of bytes collected before they are written to a streamed file
+			checkpoint_size: Amount of written bytes after which a streamed file is synced and its progress saved
+			checkpoint_interval: Seconds after which a streamed file is synced and its progress saved
+		"""
+		self.buffer_size = max(1, buffer_size)
+		self.checkpoint_size = checkpoint_size
+		self.checkpoint_interval = checkpoint_interval
+		self._executor = ThreadPoolExecutor(max(1, workers), thread_name_prefix="azlassets-writer")
+
+	def submit(self, function, *args) -> Future:
+		"""
+		Schedule a blocking function in the thread pool of the writer.
+
+		Returns:
+			Future: The future of the call
+		"""
+		return self._executor.submit(function, *args)
+
+	async def run(self, function, *args):
+		"""
+		Run a blocking function in the thread pool of the writer and wait for it.
+
+		Returns:
+			The return value of the function
+		"""
+		return await asyncio.wrap_future(self.submit(function, *args))
+
+	async def write_file(self, temporary_path: Path, destination: Path, data: bytes):
+		"""
+		Write a complete file and atomically move it to its destination, see :func:`write_file`.
+
+		Args:
+			temporary_path: Path the file is written to first
+			destination: Final path of the file
+			data: Content of the file
+		"""
+		await self.run(write_file, temporary_path, destination, data)
+
+	def open_partial(self, filepath: Path, file_size: int, offset: int = 0) -> PartialFileWriter:
+		"""
+		Open a file for streaming received chunks into it.
+
+		Args:
+			filepath: Path of the file
+			file_size: Size of the complete file in bytes
+			offset: Amount of bytes already in the file, writing continues behind them
+
+		Returns:
+			PartialFileWriter: The writer, to be used as an async context manager
+		"""
+		return PartialFileWriter(self, filepath, file_size, offset)
+
+	def close(self):
+		"""
+		Shut down the thread pool after all pending writes completed.
+		"""
+		self._executor.shutdown(wait=True)